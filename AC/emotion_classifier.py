@@ -189,23 +189,32 @@ class EmotionClassifier(nn.Module):
             zero_vector = np.zeros(27, dtype=np.float32)
             return self.mapper.map_ck_vector_to_dict(zero_vector) if return_dict else zero_vector
     
-    def predict_batch(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+    def predict_batch(self, texts: List[str], batch_size: int = None,
+                      out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         批量文本情感预测
         
         Args:
             texts: 文本列表
             batch_size: 批处理大小
+            out: 可选的预分配输出缓冲 (至少N行, 27列, float32)，循环调用时可复用避免重复分配
             
         Returns:
-            (N, 27) 情绪向量矩阵
+            (N, 27) 情绪向量矩阵 (传入out时为其前N行的视图)
         """
+        if out is not None and (out.ndim != 2 or out.shape[0] < len(texts) or out.shape[1] != 27
+                                or out.dtype != np.float32):
+            raise ValueError(f"输出缓冲形状/类型不匹配: 需要至少({len(texts)}, 27) float32，实际{out.shape} {out.dtype}")
+        
+        if out is None:
+            out = np.empty((len(texts), 27), dtype=np.float32)
+        all_results = out[:len(texts)]
+        
         try:
             if not texts:
-                return np.zeros((0, 27), dtype=np.float32)
+                return all_results
             
             batch_size = batch_size or INFERENCE_CONFIG["max_batch_size"]
-            results = []
             
             logger.info(f"🔄 开始批量预测: {len(texts)} 条文本")
             
@@ -224,33 +233,29 @@ class EmotionClassifier(nn.Module):
                 # 移到设备
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
                 
-                # 批量推理
+                # 批量推理，结果直接写入输出缓冲
                 with torch.no_grad():
                     outputs = self.model(**inputs)
                     logits = outputs.logits
                     
                     # 应用sigmoid激活
-                    probabilities = torch.sigmoid(logits).cpu().numpy()
-                
-                results.append(probabilities)
+                    all_results[i:i + len(batch_texts)] = torch.sigmoid(logits).cpu().numpy()
                 
                 if (i + batch_size) % 100 == 0:
                     logger.info(f"   批量预测进度: {min(i + batch_size, len(texts))}/{len(texts)}")
             
-            # 合并结果
-            all_results = np.vstack(results)
-            
-            # 应用阈值和归一化
+            # 原地应用阈值和归一化
             threshold = INFERENCE_CONFIG["confidence_threshold"]
-            all_results = np.where(all_results > threshold, all_results, 0.0)
-            all_results = np.clip(all_results, 0, 1)
+            all_results[all_results <= threshold] = 0.0
+            np.clip(all_results, 0, 1, out=all_results)
             
             logger.info(f"✅ 批量预测完成: {all_results.shape}")
-            return all_results.astype(np.float32)
+            return all_results
             
         except Exception as e:
             logger.error(f"❌ 批量预测失败: {e}")
-            return np.zeros((len(texts), 27), dtype=np.float32)
+            all_results.fill(0.0)
+            return all_results
     
     def get_top_emotions(self, text: str, top_k: int = 5) -> List[Tuple[str, float]]:
         """
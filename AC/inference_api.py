@@ -101,26 +101,31 @@ class EmotionInferenceAPI:
             else:
                 return []
     
-    def analyze_batch_texts(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+    def analyze_batch_texts(self, texts: List[str], batch_size: int = None,
+                            out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         批量分析文本情感
         
         Args:
             texts: 文本列表
             batch_size: 批处理大小
+            out: 可选的预分配输出缓冲 (至少N行, 27列, float32)，热循环中复用以避免重复分配
             
         Returns:
-            (N, 27) 情感向量矩阵
+            (N, 27) float32 情感向量矩阵
         """
         try:
             if not texts:
                 return np.zeros((0, 27), dtype=np.float32)
             
             batch_size = batch_size or INFERENCE_CONFIG["max_batch_size"]
-            return self.classifier.predict_batch(texts, batch_size)
+            return self.classifier.predict_batch(texts, batch_size, out=out)
             
         except Exception as e:
             logger.error(f"❌ 批量情感分析失败: {e}")
+            if out is not None and out.shape[0] >= len(texts):
+                out[:len(texts)] = 0.0
+                return out[:len(texts)]
             return np.zeros((len(texts), 27), dtype=np.float32)
     
     def get_emotion_for_kg_module(self, text: str) -> np.ndarray:
@@ -136,7 +141,7 @@ class EmotionInferenceAPI:
             np.ndarray: 标准化的27维C&K情感向量 [0, 1]
         """
         try:
-            logger.info(f"🧠 为KG模块分析情感: {text[:50]}...")
+            logger.info("🧠 为KG模块分析情感: %s...", text[:50])
             
             # 获取情感向量
             emotion_vector = self.analyze_single_text(text, output_format="vector")
@@ -146,9 +151,10 @@ class EmotionInferenceAPI:
                 logger.error("❌ 情感向量格式验证失败")
                 return np.zeros(27, dtype=np.float32)
             
-            # 记录主要情感
-            top_emotions = self.mapper.get_top_emotions_from_vector(emotion_vector, 3)
-            logger.info(f"   主要情感: {[(name, f'{score:.3f}') for name, score in top_emotions]}")
+            # 记录主要情感 (仅在INFO级别开启时才计算和格式化)
+            if logger.isEnabledFor(logging.INFO):
+                top_emotions = self.mapper.get_top_emotions_from_vector(emotion_vector, 3)
+                logger.info("   主要情感: %s", [(name, f'{score:.3f}') for name, score in top_emotions])
             
             return emotion_vector
             
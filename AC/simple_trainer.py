@@ -5,6 +5,7 @@
 """
 
 import os
+import re
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -19,6 +20,13 @@ import json
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 分词规则：中日韩汉字逐字切分，其余按Unicode单词切分 (标点不再粘连在词上)
+TOKEN_PATTERN = re.compile(r"[\u3400-\u9fff]|[^\W\u3400-\u9fff]+")
+
+def tokenize(text):
+    """将文本切分为词序列，推理端 (test_simple_model.py) 使用相同规则"""
+    return TOKEN_PATTERN.findall(str(text))
+
 class SimpleEmotionModel(nn.Module):
     """简化的情感分类模型 - 基于LSTM"""
     
@@ -75,7 +83,7 @@ class SimpleEmotionDataset(Dataset):
         
         # 统计词频
         for text in texts:
-            for word in str(text).split():
+            for word in tokenize(text):
                 word_count[word] = word_count.get(word, 0) + 1
         
         # 按频率排序，只保留前48000个词（留2个位置给特殊符号）
@@ -89,7 +97,7 @@ class SimpleEmotionDataset(Dataset):
     
     def _text_to_ids(self, text):
         """将文本转换为ID序列"""
-        words = str(text).split()[:self.max_length]
+        words = tokenize(text)[:self.max_length]
         ids = [self.vocab_dict.get(word, 1) for word in words]  # 1是<UNK>
         
         # 填充或截断到固定长度
@@ -287,7 +295,8 @@ class EmotionModelTrainer:
                 'dropout': 0.3
             },
             'f1_score': f1_score,
-            'emotion_columns': self.emotion_columns
+            'emotion_columns': self.emotion_columns,
+            'tokenizer': 'regex'
         }, save_path / "model.pth")
         
         # 保存词汇表
@@ -15,10 +15,10 @@ def test_trained_model():
     
     try:
         from emotion_classifier import EmotionClassifier
-        from inference_api import EmotionInferenceAPI
+        from inference_api import get_emotion_api
         
-        # 初始化推理API
-        api = EmotionInferenceAPI()
+        # 初始化推理API (复用进程级单例，权重只加载一次)
+        api = get_emotion_api()
         
         # 测试用例
         test_texts = [
@@ -32,22 +32,20 @@ def test_trained_model():
         print("\n📊 情感分析测试结果:")
         print("-" * 80)
         
+        # 一次批量推理，逐行统计用向量化归约完成
+        vecs = np.ascontiguousarray(api.analyze_batch_texts(test_texts), dtype=np.float32)
+        max_emotion_values = vecs.max(axis=1)
+        total_intensities = vecs.sum(axis=1)
+        active_counts = (vecs > 0.1).sum(axis=1)
+        
         for i, text in enumerate(test_texts, 1):
             print(f"\n🔍 测试 {i}: {text}")
             
-            # 获取情绪向量
-            emotion_vector = api.get_emotion_for_kg_module(text)
-            
-            # 分析结果
-            max_emotion_idx = np.argmax(emotion_vector)
-            max_emotion_value = emotion_vector[max_emotion_idx]
-            total_intensity = np.sum(emotion_vector)
-            active_emotions = np.sum(emotion_vector > 0.1)
-            
+            emotion_vector = vecs[i - 1]
             print(f"   📈 27维向量: [{emotion_vector[0]:.3f}, {emotion_vector[1]:.3f}, {emotion_vector[2]:.3f}, ...]")
-            print(f"   🎯 最强情绪强度: {max_emotion_value:.3f}")
-            print(f"   📊 总体情绪强度: {total_intensity:.3f}")
-            print(f"   🔢 活跃情绪数量: {active_emotions}")
+            print(f"   🎯 最强情绪强度: {max_emotion_values[i - 1]:.3f}")
+            print(f"   📊 总体情绪强度: {total_intensities[i - 1]:.3f}")
+            print(f"   🔢 活跃情绪数量: {active_counts[i - 1]}")
         
         print("\n✅ 模型测试完成!")
         print("🎉 你的AC模块现在可以将文本转换为27维情绪向量了!")
@@ -3,15 +3,33 @@
 测试简化版训练完成的情感模型
 """
 
+import sys
 import torch
 import numpy as np
 import json
+import pickle
 from pathlib import Path
 import logging
+from itertools import chain, repeat
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 分词规则直接取自训练脚本，保证推理与训练一致
+sys.path.append(str(Path(__file__).parent))
+from simple_trainer import TOKEN_PATTERN
+
+# 编码后的固定序列长度
+MAX_SEQ_LENGTH = 128
+
+# 预分配的锁页暂存区可容纳的最大批量，超出时退回常规拷贝
+MAX_STAGING_BATCH = 64
+
 class SimpleEmotionModel(torch.nn.Module):
     """简化的情感分类模型 - 与训练时保持一致"""
     
@@ -28,9 +46,10 @@ class SimpleEmotionModel(torch.nn.Module):
         lstm_out, (hidden, cell) = self.lstm(embedded)
         
         if attention_mask is not None:
-            lengths = attention_mask.sum(dim=1).long() - 1
-            batch_size = lstm_out.size(0)
-            last_outputs = lstm_out[range(batch_size), lengths]
+            # 空文本得到-1，取模后与原先的负索引一致，指向最后一个位置
+            lengths = (attention_mask.count_nonzero(dim=1) - 1) % lstm_out.size(1)
+            index = lengths.view(-1, 1, 1).expand(-1, 1, lstm_out.size(-1))
+            last_outputs = lstm_out.gather(1, index).squeeze(1)
         else:
             last_outputs = lstm_out[:, -1, :]
         
@@ -41,9 +60,12 @@ class SimpleEmotionModel(torch.nn.Module):
 class SimpleEmotionInference:
     """简化版情感推理类"""
     
-    def __init__(self, model_path="./models/simple_emotion_model"):
+    def __init__(self, model_path="./models/simple_emotion_model", fp16=True, compile_model=True):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model_path = Path(model_path)
+        # 半精度仅在GPU上启用，CPU上LSTM的FP16/BF16内核收益不稳定
+        self.use_fp16 = fp16 and self.device.type == 'cuda'
+        self.compile_model = compile_model
         
         # 加载模型和配置
         self._load_model()
@@ -53,76 +75,180 @@ class SimpleEmotionInference:
         logger.info(f"📂 加载模型: {self.model_path}")
         
         # 加载模型权重和配置
-        checkpoint = torch.load(self.model_path / "model.pth", map_location=self.device)
+        checkpoint = self._load_checkpoint(self.model_path / "model.pth")
         
         self.model_config = checkpoint['model_config']
-        self.emotion_columns = checkpoint['emotion_columns']
+        self.emotion_columns = np.array(checkpoint['emotion_columns'], dtype=object)
+        # 旧版checkpoint没有记录分词方式，其词汇表是按空白切分构建的
+        self.tokenizer = checkpoint.get('tokenizer', 'whitespace')
         
         # 初始化模型
         self.model = SimpleEmotionModel(**self.model_config)
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.model.to(self.device)
+        if self.use_fp16:
+            self.model.half()
         self.model.eval()
         
+        # 针对固定序列长度编译前向图 (PyTorch 2.x)，静态形状下索引运算可常量折叠；失败时保持eager模式
+        self._compiled_model = None
+        if self.compile_model and hasattr(torch, 'compile'):
+            try:
+                self._compiled_model = torch.compile(self.model, dynamic=False)
+            except Exception as e:
+                logger.warning(f"⚠️  torch.compile 不可用，使用eager模式: {e}")
+        
+        # GPU上预分配锁页内存暂存区和设备端输入缓冲，避免每次推理重新分配
+        if self.device.type == 'cuda':
+            staging_shape = (MAX_STAGING_BATCH, MAX_SEQ_LENGTH)
+            self._ids_host = torch.zeros(staging_shape, dtype=torch.long, pin_memory=True)
+            self._mask_host = torch.zeros(staging_shape, dtype=torch.long, pin_memory=True)
+            self._ids_dev = torch.zeros(staging_shape, dtype=torch.long, device=self.device)
+            self._mask_dev = torch.zeros(staging_shape, dtype=torch.long, device=self.device)
+            self._out_host = torch.zeros((MAX_STAGING_BATCH, len(self.emotion_columns)),
+                                         dtype=torch.float32, pin_memory=True)
+        
         # 加载词汇表
-        with open(self.model_path / "vocab.json", 'r', encoding='utf-8') as f:
-            self.vocab_dict = json.load(f)
+        if orjson is not None:
+            with open(self.model_path / "vocab.json", 'rb') as f:
+                self.vocab_dict = orjson.loads(f.read())
+        else:
+            with open(self.model_path / "vocab.json", 'r', encoding='utf-8') as f:
+                self.vocab_dict = json.load(f)
         
         logger.info(f"✅ 模型加载成功!")
         logger.info(f"   词汇表大小: {len(self.vocab_dict)}")
         logger.info(f"   情绪维度: {len(self.emotion_columns)}")
+        logger.info(f"   分词方式: {self.tokenizer}")
         logger.info(f"   训练F1分数: {checkpoint.get('f1_score', 'N/A'):.4f}")
         
-    def _text_to_ids(self, text, max_length=128):
+    def _load_checkpoint(self, checkpoint_path):
+        """内存映射方式加载checkpoint，只有load_state_dict实际读取的页才会调入内存"""
+        try:
+            return torch.load(checkpoint_path, map_location=self.device, mmap=True, weights_only=True)
+        except TypeError:
+            # PyTorch < 2.1 不支持 mmap 参数
+            return torch.load(checkpoint_path, map_location=self.device)
+        except pickle.UnpicklingError:
+            # 旧版checkpoint包含numpy标量等非张量对象 (如f1_score)，需完整反序列化
+            return torch.load(checkpoint_path, map_location=self.device, mmap=True, weights_only=False)
+    
+    def _text_to_ids(self, text, max_length=MAX_SEQ_LENGTH):
         """将文本转换为ID序列"""
-        words = str(text).split()[:max_length]
-        ids = [self.vocab_dict.get(word, 1) for word in words]  # 1是<UNK>
-        
-        # 填充到固定长度
-        if len(ids) < max_length:
-            attention_mask = [1] * len(ids) + [0] * (max_length - len(ids))
-            ids.extend([0] * (max_length - len(ids)))  # 0是<PAD>
+        input_ids, attention_mask = self._encode_batch([text], max_length)
+        return input_ids[0].tolist(), attention_mask[0].tolist()
+    
+    def _encode_batch(self, texts, max_length=MAX_SEQ_LENGTH):
+        """批量编码文本，一次性填充到 (N, max_length) 矩阵"""
+        if self.tokenizer == 'regex':
+            token_lists = [TOKEN_PATTERN.findall(str(text))[:max_length] for text in texts]
         else:
-            attention_mask = [1] * max_length
-            
-        return ids, attention_mask
+            token_lists = [str(text).split()[:max_length] for text in texts]
+        lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+        
+        # 所有词拼接后一次查表，避免逐词的Python循环
+        flat_words = list(chain.from_iterable(token_lists))
+        flat_ids = np.fromiter(map(self.vocab_dict.get, flat_words, repeat(1)),  # 1是<UNK>
+                               dtype=np.int64, count=len(flat_words))
+        
+        # 有效位置为每行前缀，按行优先顺序回填即可
+        valid = np.arange(max_length) < lengths[:, None]
+        input_ids = np.zeros((len(texts), max_length), dtype=np.int64)  # 0是<PAD>
+        input_ids[valid] = flat_ids
+        
+        return input_ids, valid.astype(np.int64)
     
-    def predict_emotion_vector(self, text):
-        """预测文本的27维情绪向量"""
+    def _to_device(self, input_ids, attention_mask):
+        """把编码后的numpy输入搬到设备上，GPU小批量走锁页暂存区异步拷贝"""
+        batch_size, seq_len = input_ids.shape
+        if self.device.type != 'cuda' or batch_size > MAX_STAGING_BATCH or seq_len != self._ids_host.size(1):
+            # CPU上as_tensor与numpy共享内存，无额外拷贝
+            return (torch.as_tensor(input_ids, dtype=torch.long, device=self.device),
+                    torch.as_tensor(attention_mask, dtype=torch.long, device=self.device))
+        
+        # 上一次推理结束时的.cpu()已同步流，此处可安全复用暂存区
+        ids_host = self._ids_host[:batch_size]
+        mask_host = self._mask_host[:batch_size]
+        ids_host.copy_(torch.from_numpy(input_ids))
+        mask_host.copy_(torch.from_numpy(attention_mask))
+        
+        ids_dev = self._ids_dev[:batch_size]
+        mask_dev = self._mask_dev[:batch_size]
+        ids_dev.copy_(ids_host, non_blocking=True)
+        mask_dev.copy_(mask_host, non_blocking=True)
+        return ids_dev, mask_dev
+    
+    def _to_host(self, probabilities):
+        """把设备上的概率矩阵拷回主机，GPU小批量经锁页缓冲异步拷贝"""
+        batch_size = probabilities.size(0)
+        if self.device.type != 'cuda' or batch_size > MAX_STAGING_BATCH:
+            # CPU上.cpu().numpy()是零拷贝视图
+            return probabilities.cpu().numpy()
+        
+        out_host = self._out_host[:batch_size]
+        out_host.copy_(probabilities, non_blocking=True)
+        torch.cuda.current_stream(self.device).synchronize()
+        # 锁页缓冲会被下一次推理覆盖，返回独立副本
+        return out_host.numpy().copy()
+    
+    def _forward(self, input_ids, attention_mask):
+        """执行模型前向，编译版本首次运行失败时永久回退到eager模型"""
+        # 编译版本只针对 MAX_SEQ_LENGTH 特化，其他长度直接走eager模型
+        if self._compiled_model is not None and input_ids.shape[-1] == MAX_SEQ_LENGTH:
+            try:
+                return self._compiled_model(input_ids, attention_mask)
+            except Exception as e:
+                logger.warning(f"⚠️  编译模型执行失败，回退到eager模式: {e}")
+                self._compiled_model = None
+        return self.model(input_ids, attention_mask)
+    
+    def predict_emotion_vectors(self, texts):
+        """批量预测文本的27维情绪向量，返回 (N, 27) 矩阵"""
+        if not texts:
+            return np.zeros((0, len(self.emotion_columns)), dtype=np.float32)
+        
         # 预处理文本
-        input_ids, attention_mask = self._text_to_ids(text)
+        input_ids, attention_mask = self._encode_batch(texts)
         
         # 转换为tensor
-        input_ids = torch.tensor([input_ids], dtype=torch.long).to(self.device)
-        attention_mask = torch.tensor([attention_mask], dtype=torch.long).to(self.device)
+        input_ids, attention_mask = self._to_device(input_ids, attention_mask)
         
-        # 模型推理
-        with torch.no_grad():
-            outputs = self.model(input_ids, attention_mask)
-            probabilities = torch.sigmoid(outputs).cpu().numpy()[0]
+        # 模型推理 (整批只做一次前向)
+        with torch.inference_mode():
+            with torch.autocast(device_type=self.device.type, dtype=torch.float16, enabled=self.use_fp16):
+                outputs = self._forward(input_ids, attention_mask)
+            # sigmoid在FP32下原地计算，保留尾部精度且不再分配中间张量
+            probabilities = self._to_host(outputs.float().sigmoid_())
         
         return probabilities
     
-    def analyze_emotion(self, text):
-        """分析文本情绪并返回详细结果"""
+    def predict_emotion_vector(self, text):
+        """预测文本的27维情绪向量"""
+        return self.predict_emotion_vectors([text])[0]
+    
+    def analyze_emotion(self, text, include_dict=False):
+        """分析文本情绪并返回详细结果，include_dict=True 时附带完整的情绪字典"""
         vector = self.predict_emotion_vector(text)
         
-        # 分析结果
-        emotion_dict = dict(zip(self.emotion_columns, vector))
-        
-        # 排序找出最强的情绪
-        sorted_emotions = sorted(emotion_dict.items(), key=lambda x: x[1], reverse=True)
+        # 部分排序找出最强的5个情绪
+        top_k = min(5, len(vector))
+        top_idx = np.argpartition(-vector, top_k - 1)[:top_k]
+        top_idx = top_idx[np.argsort(-vector[top_idx], kind='stable')]
+        top_emotions = list(zip(self.emotion_columns[top_idx], vector[top_idx]))
         
-        return {
+        result = {
             'text': text,
             'emotion_vector': vector,
-            'emotion_dict': emotion_dict,
-            'top_emotions': sorted_emotions[:5],
-            'max_emotion': sorted_emotions[0][0],
-            'max_intensity': sorted_emotions[0][1],
+            'top_emotions': top_emotions,
+            'max_emotion': top_emotions[0][0],
+            'max_intensity': top_emotions[0][1],
             'total_intensity': float(np.sum(vector)),
             'active_emotions': int(np.sum(vector > 0.1))
         }
+        if include_dict:
+            result['emotion_dict'] = dict(zip(self.emotion_columns, vector))
+        
+        return result
 
 def test_trained_model():
     """测试训练好的模型"""
@@ -8,8 +8,10 @@
 
 import sys
 import os
+import copy
 import numpy as np
 import logging
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
 
@@ -30,6 +32,10 @@ class EmotionMusicBridge:
     提供从情绪状态到音乐播放的完整解决方案
     """
     
+    # 结果缓存：情绪向量按 [0,1] 量化为 uint8 分档后作为键，相近情绪状态复用同一结果
+    CACHE_QUANTIZATION_BINS = 255
+    CACHE_MAX_SIZE = 256
+    
     def __init__(self, enable_mi_retrieve: bool = True):
         """
         初始化桥接器
@@ -38,9 +44,20 @@ class EmotionMusicBridge:
             enable_mi_retrieve: 是否启用MI_retrieve模块集成
         """
         self.kg = KnowledgeGraph()
+        # 情绪名称 → 向量索引，避免逐个 list.index 线性查找
+        self._emotion_index = {name: i for i, name in enumerate(self.kg.emotion_names)}
         self.enable_mi_retrieve = enable_mi_retrieve
         self.mi_retrieve_api = None
         
+        # 分析/推荐结果的LRU缓存及命中统计
+        self._result_cache = OrderedDict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        
+        # 检索结果缓存：不同情绪向量映射到相同音乐描述时共享一次检索
+        self._search_cache = OrderedDict()
+        self._search_cache_hits = 0
+        
         # 尝试加载MI_retrieve模块
         if enable_mi_retrieve:
             try:
@@ -60,6 +77,9 @@ class EmotionMusicBridge:
         """
         分析情绪并推荐音乐 (核心方法)
         
+        成功的结果按量化后的情绪向量缓存，重复或相近的情绪状态不再重复推理和检索；
+        缓存中存放独立副本，命中时也返回副本，调用方修改返回结果不会影响缓存
+        
         Args:
             emotion_vector: 27维情绪向量
             duration: 音乐时长版本
@@ -68,6 +88,82 @@ class EmotionMusicBridge:
         Returns:
             完整的情绪分析和音乐推荐结果
         """
+        cache_key = self._vec_key(emotion_vector, duration, top_k)
+        
+        if cache_key is not None and cache_key in self._result_cache:
+            self._cache_hits += 1
+            self._result_cache.move_to_end(cache_key)
+            return copy.deepcopy(self._result_cache[cache_key])
+        
+        self._cache_misses += 1
+        result = self._analyze_emotion_and_recommend_music(emotion_vector, duration, top_k)
+        
+        # 只缓存成功的结果，失败可能是暂时的 (如检索服务异常)
+        if cache_key is not None and result["success"] and "music_search_error" not in result:
+            self._result_cache[cache_key] = copy.deepcopy(result)
+            if len(self._result_cache) > self.CACHE_MAX_SIZE:
+                self._result_cache.popitem(last=False)
+        
+        return result
+    
+    def _vec_key(self, emotion_vector: np.ndarray, duration: str, top_k: int) -> Optional[Tuple[bytes, str, int]]:
+        """将情绪向量量化为缓存键，维度不正确时返回None (不缓存)"""
+        vector = np.asarray(emotion_vector, dtype=np.float64)
+        if vector.shape != (27,):
+            return None
+        quantized = np.rint(np.clip(vector, 0, 1) * self.CACHE_QUANTIZATION_BINS).astype(np.uint8)
+        return quantized.tobytes(), duration, top_k
+    
+    def _cache_stats(self) -> Dict[str, Any]:
+        """结果缓存统计 (命中数、未命中数、命中率、当前大小)"""
+        total = self._cache_hits + self._cache_misses
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "hit_rate": self._cache_hits / total if total else 0.0,
+            "size": len(self._result_cache),
+            "search_hits": self._search_cache_hits,
+            "search_size": len(self._search_cache)
+        }
+    
+    def _search_music(self, description: str, duration: str, top_k: int) -> Dict[str, Any]:
+        """
+        调用MI_retrieve按描述检索音乐，成功结果按 (描述, 时长, 数量) 缓存
+        
+        描述由结构化音乐参数确定性生成，相同参数即相同描述；
+        缓存与返回值互为独立副本 (结果列表及其中的字典)，返回结果会嵌入分析结果并可能被调用方修改
+        """
+        cache_key = (description, duration, top_k)
+        if cache_key in self._search_cache:
+            self._search_cache_hits += 1
+            self._search_cache.move_to_end(cache_key)
+            return self._copy_search_result(self._search_cache[cache_key])
+        
+        search_result = self.mi_retrieve_api.search_by_description(
+            description=description,
+            duration=duration,
+            top_k=top_k
+        )
+        
+        if search_result["success"]:
+            self._search_cache[cache_key] = self._copy_search_result(search_result)
+            if len(self._search_cache) > self.CACHE_MAX_SIZE:
+                self._search_cache.popitem(last=False)
+        
+        return search_result
+    
+    @staticmethod
+    def _copy_search_result(search_result: Dict[str, Any]) -> Dict[str, Any]:
+        """复制检索结果：外层字典、查询信息、结果列表及每条结果字典"""
+        copied = dict(search_result)
+        if isinstance(copied.get("query"), dict):
+            copied["query"] = dict(copied["query"])
+        copied["results"] = [dict(item) for item in search_result.get("results", [])]
+        return copied
+    
+    def _analyze_emotion_and_recommend_music(self, emotion_vector: np.ndarray,
+                                           duration: str, top_k: int) -> Dict[str, Any]:
+        """analyze_emotion_and_recommend_music 的实际执行流程 (不经过缓存)"""
         try:
             logger.info("🧠 开始情绪分析和音乐推荐流程...")
             
@@ -98,11 +194,7 @@ class EmotionMusicBridge:
             if self.enable_mi_retrieve and self.mi_retrieve_api:
                 try:
                     logger.info("🔍 执行音乐检索...")
-                    search_result = self.mi_retrieve_api.search_by_description(
-                        description=search_params["text_description"],
-                        duration=duration,
-                        top_k=top_k
-                    )
+                    search_result = self._search_music(search_params["text_description"], duration, top_k)
                     
                     if search_result["success"]:
                         result["music_search_results"] = search_result
@@ -213,24 +305,40 @@ class EmotionMusicBridge:
         logger.info(f"✅ 批量分析完成，处理了 {len(results)} 个情绪状态")
         return results
     
-    def create_emotion_vector_from_dict(self, emotion_dict: Dict[str, float]) -> np.ndarray:
+    def create_emotion_vector_from_dict(self, emotion_dict: Dict[str, float],
+                                        out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         从情绪字典创建27维向量
         
         Args:
             emotion_dict: 情绪字典，如 {"快乐": 0.8, "兴奋": 0.6}
+            out: 可选的输出缓冲 (长度27)，如批量矩阵的一行，会先清零再写入，避免逐个分配新数组
             
         Returns:
-            27维情绪向量
+            27维情绪向量 (传入out时即为out)
         """
-        emotion_vector = np.zeros(27)
+        if out is None:
+            emotion_vector = np.zeros(27)
+        else:
+            if out.shape != (27,):
+                raise ValueError(f"输出缓冲形状必须为(27,)，当前为{out.shape}")
+            emotion_vector = out
+            emotion_vector.fill(0)
         
+        indices = []
+        values = []
         for emotion_name, value in emotion_dict.items():
-            if emotion_name in self.kg.emotion_names:
-                index = self.kg.emotion_names.index(emotion_name)
-                emotion_vector[index] = max(0, min(1, value))  # 确保在[0,1]范围内
-            else:
+            index = self._emotion_index.get(emotion_name)
+            if index is None:
                 logger.warning(f"⚠️  未知情绪名称: {emotion_name}")
+            else:
+                indices.append(index)
+                values.append(value)
+        
+        # 一次散射赋值，再原地裁剪到[0,1]范围内
+        if indices:
+            emotion_vector[indices] = values
+            np.clip(emotion_vector, 0.0, 1.0, out=emotion_vector)
         
         return emotion_vector
     
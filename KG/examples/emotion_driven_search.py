@@ -9,6 +9,7 @@
 import sys
 import os
 import numpy as np
+from functools import lru_cache
 from pathlib import Path
 
 # 添加KG模块路径
@@ -18,28 +19,84 @@ from knowledge_graph import KnowledgeGraph
 from emotion_music_bridge import EmotionMusicBridge
 from parameter_mapping import ParameterMapper
 
-def example_1_basic_usage():
-    """示例1: 基础使用流程"""
-    print("🌟 示例1: 基础情绪分析与音乐推荐")
-    print("-" * 50)
-    
-    # 初始化桥接器
-    bridge = EmotionMusicBridge(enable_mi_retrieve=True)
-    
-    # 定义用户情绪状态
-    user_emotions = {
+@lru_cache(maxsize=2)
+def _get_bridge(enable_mi_retrieve: bool) -> EmotionMusicBridge:
+    """按是否启用MI_retrieve缓存桥接器，各示例共享，检索索引只加载一次"""
+    return EmotionMusicBridge(enable_mi_retrieve=enable_mi_retrieve)
+
+@lru_cache(maxsize=1)
+def _get_kg() -> KnowledgeGraph:
+    """各示例共享的知识图谱"""
+    return KnowledgeGraph()
+
+# 示例场景表：mi 表示是否使用启用MI_retrieve的桥接器
+BASIC_SCENARIO = {
+    "name": "基础情绪分析",
+    "emotions": {
         "焦虑": 0.8,     # 高度焦虑
         "平静": 0.1,     # 低平静度  
         "恐惧": 0.3      # 轻微恐惧
+    },
+    "mi": True,
+    "duration": "3min",
+    "top_k": 3
+}
+
+THERAPY_SCENARIOS = [
+    {
+        "name": "考试焦虑缓解",
+        "emotions": {"焦虑": 0.8, "恐惧": 0.4, "平静": 0.1},
+        "goal": "降低焦虑，提升专注力",
+        "mi": True
+    },
+    {
+        "name": "失恋情感支持",
+        "emotions": {"悲伤": 0.9, "失望": 0.7, "愤怒": 0.3, "怀旧": 0.5},
+        "goal": "情感宣泄，逐步愈合",
+        "mi": True
+    },
+    {
+        "name": "工作压力释放",
+        "emotions": {"愤怒": 0.6, "焦虑": 0.5, "疲劳": 0.8},  # 注意: 疲劳不在27维中
+        "goal": "压力释放，身心放松",
+        "mi": True
+    },
+    {
+        "name": "庆祝成功喜悦",
+        "emotions": {"快乐": 0.9, "兴奋": 0.8, "钦佩": 0.6},
+        "goal": "维持积极情绪，分享喜悦",
+        "mi": True
+    },
+    {
+        "name": "深度冥想",
+        "emotions": {"平静": 0.9, "审美欣赏": 0.7, "敬畏": 0.5},
+        "goal": "深层放松，内在探索",
+        "mi": True
     }
+]
+
+def run_scenario(scenario: dict) -> dict:
+    """
+    运行一个场景：带 duration/top_k 的场景执行完整推荐，否则仅获取治疗参数
+    """
+    bridge = _get_bridge(scenario.get("mi", True))
+    emotion_vector = bridge.create_emotion_vector_from_dict(scenario["emotions"])
+    
+    if "top_k" in scenario:
+        return bridge.analyze_emotion_and_recommend_music(
+            emotion_vector, duration=scenario.get("duration", "3min"), top_k=scenario["top_k"]
+        )
+    return bridge.get_therapy_parameters_only(emotion_vector)
+
+def example_1_basic_usage():
+    """示例1: 基础使用流程"""
+    print("🌟 示例1: 基础情绪分析与音乐推荐")
+    print("-" * 50)
     
-    print(f"🧠 用户情绪状态: {user_emotions}")
-    
-    # 创建情绪向量
-    emotion_vector = bridge.create_emotion_vector_from_dict(user_emotions)
+    print(f"🧠 用户情绪状态: {BASIC_SCENARIO['emotions']}")
     
-    # 获取音乐推荐
-    result = bridge.analyze_emotion_and_recommend_music(emotion_vector, duration="3min", top_k=3)
+    # 创建情绪向量并获取音乐推荐
+    result = run_scenario(BASIC_SCENARIO)
     
     if result["success"]:
         print(f"✅ 分析成功")
@@ -62,7 +119,7 @@ def example_2_detailed_analysis():
     print("-" * 50)
     
     # 初始化组件
-    kg = KnowledgeGraph()
+    kg = _get_kg()
     mapper = ParameterMapper()
     
     # 复杂情绪状态
@@ -76,11 +133,7 @@ def example_2_detailed_analysis():
     print(f"🎭 复杂情绪状态: {complex_emotions}")
     
     # 创建情绪向量
-    emotion_vector = np.zeros(27)
-    for emotion_name, value in complex_emotions.items():
-        if emotion_name in kg.emotion_names:
-            index = kg.emotion_names.index(emotion_name)
-            emotion_vector[index] = value
+    emotion_vector = _get_bridge(False).create_emotion_vector_from_dict(complex_emotions)
     
     # 详细分析
     emotion_analysis = kg.analyze_emotion_vector(emotion_vector)
@@ -112,45 +165,13 @@ def example_3_therapy_scenarios():
     print("\n🌟 示例3: 不同音乐治疗场景")
     print("-" * 50)
     
-    bridge = EmotionMusicBridge(enable_mi_retrieve=True)
-    
-    # 定义多种治疗场景
-    therapy_scenarios = [
-        {
-            "name": "考试焦虑缓解",
-            "emotions": {"焦虑": 0.8, "恐惧": 0.4, "平静": 0.1},
-            "goal": "降低焦虑，提升专注力"
-        },
-        {
-            "name": "失恋情感支持",
-            "emotions": {"悲伤": 0.9, "失望": 0.7, "愤怒": 0.3, "怀旧": 0.5},
-            "goal": "情感宣泄，逐步愈合"
-        },
-        {
-            "name": "工作压力释放",
-            "emotions": {"愤怒": 0.6, "焦虑": 0.5, "疲劳": 0.8},  # 注意: 疲劳不在27维中
-            "goal": "压力释放，身心放松"
-        },
-        {
-            "name": "庆祝成功喜悦",
-            "emotions": {"快乐": 0.9, "兴奋": 0.8, "钦佩": 0.6},
-            "goal": "维持积极情绪，分享喜悦"
-        },
-        {
-            "name": "深度冥想",
-            "emotions": {"平静": 0.9, "审美欣赏": 0.7, "敬畏": 0.5},
-            "goal": "深层放松，内在探索"
-        }
-    ]
-    
-    for i, scenario in enumerate(therapy_scenarios, 1):
+    for i, scenario in enumerate(THERAPY_SCENARIOS, 1):
         print(f"\n🎬 场景{i}: {scenario['name']}")
         print(f"   治疗目标: {scenario['goal']}")
         print(f"   情绪状态: {scenario['emotions']}")
         
         # 分析情绪并获取治疗建议
-        emotion_vector = bridge.create_emotion_vector_from_dict(scenario["emotions"])
-        result = bridge.get_therapy_parameters_only(emotion_vector)
+        result = run_scenario(scenario)
         
         if result["success"]:
             therapy = result["therapy_recommendation"]
@@ -173,7 +194,7 @@ def example_4_batch_processing():
     print("\n🌟 示例4: 批量情绪分析")
     print("-" * 50)
     
-    bridge = EmotionMusicBridge(enable_mi_retrieve=False)  # 仅参数模式，避免过多检索
+    bridge = _get_bridge(False)  # 仅参数模式，避免过多检索
     
     # 创建多个情绪向量
     emotion_sets = [
@@ -184,31 +205,30 @@ def example_4_batch_processing():
         {"愤怒": 0.7, "厌恶": 0.4}
     ]
     
-    emotion_vectors = []
-    for emotions in emotion_sets:
-        vector = bridge.create_emotion_vector_from_dict(emotions)
-        emotion_vectors.append(vector)
+    # 直接写入预分配的 (N, 27) 情绪矩阵的各行
+    emotion_matrix = np.empty((len(emotion_sets), 27))
+    for row, emotions in zip(emotion_matrix, emotion_sets):
+        bridge.create_emotion_vector_from_dict(emotions, out=row)
     
-    print(f"📦 批量处理 {len(emotion_vectors)} 个情绪状态...")
+    print(f"📦 批量处理 {len(emotion_matrix)} 个情绪状态...")
     
-    # 批量分析
-    results = bridge.batch_emotion_analysis(emotion_vectors, duration="3min")
+    # 批量分析：整批一次完成规则评估与情绪统计
+    kg = _get_kg()
+    batch_params = kg.get_initial_music_parameters_batch(emotion_matrix)
+    batch_analysis = kg.analyze_emotion_batch(emotion_matrix)
     
     print(f"\n📊 批量分析结果:")
-    for i, result in enumerate(results, 1):
-        if result["success"]:
-            max_emotion = result["emotion_analysis"]["max_emotion"]
-            tempo = result["music_parameters"]["tempo"]
-            print(f"   {i}. 主要情绪: {max_emotion[0]} ({max_emotion[1]:.2f}) -> Tempo: {tempo} BPM")
-        else:
-            print(f"   {i}. ❌ 分析失败")
+    for i, (max_index, max_value, tempo) in enumerate(zip(batch_analysis["max_emotion_index"],
+                                                          batch_analysis["max_emotion_value"],
+                                                          batch_params["tempo"]), 1):
+        print(f"   {i}. 主要情绪: {kg.emotion_names[max_index]} ({max_value:.2f}) -> Tempo: {tempo:g} BPM")
 
 def example_5_advanced_usage():
     """示例5: 高级使用场景"""
     print("\n🌟 示例5: 高级使用场景与自定义")
     print("-" * 50)
     
-    kg = KnowledgeGraph()
+    kg = _get_kg()
     
     # 情绪向量插值 (两种情绪状态之间的过渡)
     emotion_start = np.zeros(27)
@@ -223,53 +243,43 @@ def example_5_advanced_usage():
     
     # 生成过渡序列
     steps = 5
-    for i in range(steps + 1):
-        t = i / steps
-        transition_vector = (1 - t) * emotion_start + t * emotion_end
-        
-        music_params = kg.get_initial_music_parameters(transition_vector)
-        
-        print(f"   步骤{i+1}: 焦虑{(1-t)*0.8:.1f}/平静{t*0.8:.1f} -> Tempo: {music_params['tempo']:.0f} BPM")
+    t = np.linspace(0, 1, steps + 1)[:, None]
+    transitions = (1 - t) * emotion_start + t * emotion_end  # (steps+1, 27) 一次广播生成
+    
+    transition_params = kg.get_initial_music_parameters_batch(transitions)
+    
+    for i, (t_i, tempo) in enumerate(zip(t[:, 0], transition_params['tempo'])):
+        print(f"   步骤{i+1}: 焦虑{(1-t_i)*0.8:.1f}/平静{t_i*0.8:.1f} -> Tempo: {tempo:.0f} BPM")
     
     # 情绪向量分析
     print(f"\n🔍 情绪向量统计分析:")
     
-    # 创建随机情绪状态样本
-    np.random.seed(42)  # 可重复性
-    random_vectors = []
+    # 创建随机情绪状态样本：每行随机选择2-4个情绪，给予随机强度
+    rng = np.random.default_rng(42)  # 可重复性
+    num_samples = 10
+    intensities = rng.uniform(0.2, 1.0, (num_samples, 27))
+    num_emotions = rng.integers(2, 5, num_samples)
     
-    for _ in range(10):
-        # 随机选择2-4个情绪，给予随机强度
-        vector = np.zeros(27)
-        num_emotions = np.random.randint(2, 5)
-        selected_indices = np.random.choice(27, num_emotions, replace=False)
-        
-        for idx in selected_indices:
-            vector[idx] = np.random.uniform(0.2, 1.0)
-        
-        random_vectors.append(vector)
+    # 每行随机排列的名次小于该行情绪数即被选中 (等价于无放回抽样)
+    ranks = rng.random((num_samples, 27)).argsort(axis=1).argsort(axis=1)
+    random_vectors = np.where(ranks < num_emotions[:, None], intensities, 0.0)
     
     # 分析随机向量的模式
-    tempos = []
-    modes = []
-    
-    for vector in random_vectors:
-        params = kg.get_initial_music_parameters(vector)
-        tempos.append(params['tempo'])
-        modes.append(params['mode'])
+    params = kg.get_initial_music_parameters_batch(random_vectors)
+    tempos, modes = params['tempo'], params['mode']
     
     print(f"   随机样本数: {len(random_vectors)}")
-    print(f"   Tempo范围: {min(tempos):.0f} - {max(tempos):.0f} BPM")
-    print(f"   平均Tempo: {np.mean(tempos):.0f} BPM")
-    print(f"   Mode范围: {min(modes):.2f} - {max(modes):.2f}")
-    print(f"   平均Mode: {np.mean(modes):.2f}")
+    print(f"   Tempo范围: {tempos.min():.0f} - {tempos.max():.0f} BPM")
+    print(f"   平均Tempo: {tempos.mean():.0f} BPM")
+    print(f"   Mode范围: {modes.min():.2f} - {modes.max():.2f}")
+    print(f"   平均Mode: {modes.mean():.2f}")
 
 def example_6_error_handling():
     """示例6: 错误处理与异常情况"""
     print("\n🌟 示例6: 错误处理与边界情况")
     print("-" * 50)
     
-    bridge = EmotionMusicBridge(enable_mi_retrieve=False)
+    bridge = _get_bridge(False)
     
     # 测试各种异常输入
     test_cases = [
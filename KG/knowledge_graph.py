@@ -7,6 +7,8 @@
 
 import numpy as np
 import logging
+from collections import Counter
+from types import MappingProxyType
 from typing import Dict, List, Tuple, Any, Optional
 
 # 设置日志
@@ -82,19 +84,33 @@ class KnowledgeGraph:
     27维情绪向量到音乐治疗参数的智能映射
     """
     
+    # 情绪效价分类
+    POSITIVE_EMOTIONS = ["快乐", "兴奋", "娱乐", "钦佩", "崇拜", "审美欣赏", "敬畏", "入迷", "兴趣", "浪漫"]
+    NEGATIVE_EMOTIONS = ["愤怒", "焦虑", "悲伤", "恐惧", "内疚", "恐怖", "失望", "厌恶", "嫉妒", "蔑视"]
+    NEUTRAL_EMOTIONS = ["平静", "无聊", "困惑", "尴尬", "同情", "渴望", "怀旧"]
+    
+    # 无规则匹配时按最强情绪做基础调整的情绪分组
+    FEAR_LIKE_EMOTIONS = ["焦虑", "恐惧", "恐怖"]
+    JOY_LIKE_EMOTIONS = ["快乐", "兴奋", "娱乐"]
+    SADNESS_LIKE_EMOTIONS = ["悲伤", "失望", "怀旧"]
+    
+    # 数值型与类别型音乐参数
+    NUMERIC_PARAMETERS = ['tempo', 'mode', 'dynamics', 'harmony_consonance', 'pitch_register', 'density']
+    CATEGORICAL_PARAMETERS = ['timbre_preference', 'emotional_envelope_direction']
+    
     def __init__(self):
         """初始化知识图谱"""
         
-        # 27个情绪名称 (固定顺序，对应27维向量的索引)
-        self.emotion_names = [
+        # 27个情绪名称 (固定顺序，对应27维向量的索引；不可变)
+        self.emotion_names = (
             "钦佩", "崇拜", "审美欣赏", "娱乐", "愤怒", "焦虑", "敬畏", "尴尬",
             "无聊", "平静", "困惑", "蔑视", "渴望", "失望", "厌恶", "同情",
             "入迷", "嫉妒", "兴奋", "恐惧", "内疚", "恐怖", "兴趣", "快乐",
             "怀旧", "浪漫", "悲伤"
-        ]
+        )
         
-        # 默认/中性音乐参数 (治疗起始点)
-        self.default_music_parameters = {
+        # 默认/中性音乐参数 (治疗起始点；只读视图，使用时通过 .copy() 得到可修改的dict)
+        self.default_music_parameters = MappingProxyType({
             'tempo': 80.0,                    # BPM，中等节拍
             'mode': 0.5,                      # 0=小调, 1=大调, 0.5=中性
             'dynamics': 0.5,                  # 0=很轻, 1=很响, 0.5=适中
@@ -103,12 +119,23 @@ class KnowledgeGraph:
             'pitch_register': 0.5,            # 0=低音, 1=高音, 0.5=中音
             'density': 0.5,                   # 0=稀疏, 1=密集, 0.5=适中
             'emotional_envelope_direction': 'neutral'  # 情绪包络方向
-        }
+        })
+        
+        # 效价查找表 (3, 27)：行依次为 positive/negative/neutral，批量分析时一次矩阵乘得到情绪平衡
+        self._balance_table = np.array([
+            [name in group for name in self.emotion_names]
+            for group in (self.POSITIVE_EMOTIONS, self.NEGATIVE_EMOTIONS, self.NEUTRAL_EMOTIONS)
+        ], dtype=np.float32)
         
         # 建立基于GEMS模型的规则系统
         self.rules = []
         self._initialize_gems_rules()
         
+        # 规则元数据是静态的：优先级分布和按优先级降序排列的规则只需计算一次
+        self._priority_counts = Counter(rule.priority for rule in self.rules)
+        self._rules_sorted = sorted(self.rules, key=lambda rule: -rule.priority_weights[rule.priority])
+        self._build_rule_tables()
+        
         logger.info("✅ 知识图谱初始化完成")
         logger.info(f"   情绪维度: {len(self.emotion_names)}")
         logger.info(f"   规则数量: {len(self.rules)}")
@@ -296,6 +323,47 @@ class KnowledgeGraph:
         
         logger.info(f"📚 GEMS规则系统加载完成: {len(self.rules)} 条规则")
     
+    def _build_rule_tables(self):
+        """
+        把规则折叠成矩阵，供批量推理使用
+        
+        - _rule_condition_mask: (R, 27) 规则涉及的情绪
+        - _rule_thresholds: (R, 27) 各情绪阈值 (未涉及处为0)
+        - _rule_weights: (R,) 优先级权重 / 条件数
+        - _rule_numeric_params: {参数名: (R,)}，规则未设置的参数取默认值
+        - _rule_categorical_params: {参数名: (R,) object数组}
+        
+        行顺序与 _rules_sorted 一致，保证与逐条评估时的同分取舍相同
+        """
+        emotion_index = {name: i for i, name in enumerate(self.emotion_names)}
+        num_rules = len(self._rules_sorted)
+        
+        self._rule_condition_mask = np.zeros((num_rules, 27), dtype=bool)
+        self._rule_thresholds = np.zeros((num_rules, 27), dtype=np.float64)
+        self._rule_weights = np.zeros(num_rules, dtype=np.float64)
+        
+        for r, rule in enumerate(self._rules_sorted):
+            for emotion_name, threshold in rule.conditions.items():
+                self._rule_condition_mask[r, emotion_index[emotion_name]] = True
+                self._rule_thresholds[r, emotion_index[emotion_name]] = threshold
+            self._rule_weights[r] = rule.priority_weights[rule.priority] / len(rule.conditions)
+        
+        self._rule_numeric_params = {
+            name: np.array([rule.parameters.get(name, self.default_music_parameters[name]) for rule in self._rules_sorted],
+                           dtype=np.float64)
+            for name in self.NUMERIC_PARAMETERS
+        }
+        self._rule_categorical_params = {
+            name: np.array([rule.parameters.get(name, self.default_music_parameters[name]) for rule in self._rules_sorted],
+                           dtype=object)
+            for name in self.CATEGORICAL_PARAMETERS
+        }
+        
+        # 基础调整用的情绪分组掩码
+        self._fear_like_mask = np.isin(self.emotion_names, self.FEAR_LIKE_EMOTIONS)
+        self._joy_like_mask = np.isin(self.emotion_names, self.JOY_LIKE_EMOTIONS)
+        self._sadness_like_mask = np.isin(self.emotion_names, self.SADNESS_LIKE_EMOTIONS)
+    
     def _vector_to_emotion_dict(self, emotion_vector: np.ndarray) -> Dict[str, float]:
         """
         将27维情绪向量转换为情绪字典
@@ -379,13 +447,13 @@ class KnowledgeGraph:
             best_match_strength = 0.0
             matched_rules = []
             
-            for rule in self.rules:
-                is_match, match_strength = rule.evaluate(emotion_dict)
-                if is_match:
-                    matched_rules.append((rule, match_strength))
-                    if match_strength > best_match_strength:
-                        best_match_strength = match_strength
-                        best_rule = rule
+            matched, strength = self._evaluate_rules(emotion_vector[None, :])
+            for r in np.flatnonzero(matched[0]):
+                rule, match_strength = self._rules_sorted[r], float(strength[0, r])
+                matched_rules.append((rule, match_strength))
+                if match_strength > best_match_strength:
+                    best_match_strength = match_strength
+                    best_rule = rule
             
             # 开始构建音乐参数
             music_params = self.default_music_parameters.copy()
@@ -409,15 +477,15 @@ class KnowledgeGraph:
                 
                 if max_emotion_value > 0.3:  # 有明显情绪
                     # 基础情绪调整逻辑
-                    if max_emotion_name in ["焦虑", "恐惧", "恐怖"]:
+                    if max_emotion_name in self.FEAR_LIKE_EMOTIONS:
                         music_params['tempo'] = max(50, music_params['tempo'] - 20)
                         music_params['harmony_consonance'] = 0.8
                         music_params['dynamics'] = 0.3
-                    elif max_emotion_name in ["快乐", "兴奋", "娱乐"]:
+                    elif max_emotion_name in self.JOY_LIKE_EMOTIONS:
                         music_params['tempo'] = min(120, music_params['tempo'] + 20) 
                         music_params['mode'] = 0.8
                         music_params['dynamics'] = 0.7
-                    elif max_emotion_name in ["悲伤", "失望", "怀旧"]:
+                    elif max_emotion_name in self.SADNESS_LIKE_EMOTIONS:
                         music_params['tempo'] = max(60, music_params['tempo'] - 10)
                         music_params['mode'] = 0.3
                         
@@ -440,6 +508,81 @@ class KnowledgeGraph:
             logger.info("🔄 返回默认参数")
             return self.default_music_parameters.copy()
     
+    def _evaluate_rules(self, emotion_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        用规则矩阵一次评估所有规则 (与 MusicRule.evaluate 逐条评估等价)
+        
+        Args:
+            emotion_matrix: (N, 27) 情绪矩阵，已裁剪到[0,1]
+            
+        Returns:
+            (matched, strength)，形状均为 (N, R)，列顺序与 _rules_sorted 一致；未匹配处强度为0
+        """
+        # (N, R, 27)：规则所有条件都满足才算匹配，匹配强度 = 平均超出量 × 优先级权重
+        excess = emotion_matrix[:, None, :] - self._rule_thresholds[None, :, :]
+        matched = np.all((excess >= 0) | ~self._rule_condition_mask, axis=2)
+        strength = np.where(self._rule_condition_mask, excess, 0.0).sum(axis=2) * self._rule_weights
+        return matched, np.where(matched, strength, 0.0)
+    
+    def get_initial_music_parameters_batch(self, emotion_matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        批量获取初始音乐参数，规则评估对整批一次完成
+        
+        结果与逐行调用 get_initial_music_parameters 一致 (不输出逐行日志)
+        
+        Args:
+            emotion_matrix: (N, 27) 情绪向量矩阵，取值范围[0,1]
+            
+        Returns:
+            {参数名: (N,) 数组}，数值参数为float64，音色/包络方向为object数组
+        """
+        emotion_matrix = np.asarray(emotion_matrix, dtype=np.float64)
+        if emotion_matrix.ndim != 2 or emotion_matrix.shape[1] != 27:
+            raise ValueError(f"情绪矩阵形状必须为(N, 27)，当前为{emotion_matrix.shape}")
+        emotion_matrix = np.clip(emotion_matrix, 0, 1)
+        num_vectors = emotion_matrix.shape[0]
+        
+        matched, strength = self._evaluate_rules(emotion_matrix)
+        
+        # 与逐条比较 (严格大于) 一致：同强度取先出现的规则，强度为0视为未匹配
+        best_rule = strength.argmax(axis=1) if len(self.rules) else np.zeros(num_vectors, dtype=np.int64)
+        has_rule = strength.max(axis=1, initial=0.0) > 0.0
+        
+        music_params = {}
+        for name in self.NUMERIC_PARAMETERS:
+            default = np.full(num_vectors, self.default_music_parameters[name], dtype=np.float64)
+            music_params[name] = np.where(has_rule, self._rule_numeric_params[name][best_rule], default) \
+                if len(self.rules) else default
+        for name in self.CATEGORICAL_PARAMETERS:
+            default = np.full(num_vectors, self.default_music_parameters[name], dtype=object)
+            music_params[name] = np.where(has_rule, self._rule_categorical_params[name][best_rule], default) \
+                if len(self.rules) else default
+        
+        # 未匹配规则时，按最强情绪 (> 0.3) 做基础调整
+        max_index = emotion_matrix.argmax(axis=1)
+        needs_adjust = ~has_rule & (emotion_matrix.max(axis=1) > 0.3)
+        fear_like = needs_adjust & self._fear_like_mask[max_index]
+        joy_like = needs_adjust & self._joy_like_mask[max_index]
+        sadness_like = needs_adjust & self._sadness_like_mask[max_index]
+        
+        tempo = music_params['tempo']
+        tempo[fear_like] = np.maximum(50, tempo[fear_like] - 20)
+        music_params['harmony_consonance'][fear_like] = 0.8
+        music_params['dynamics'][fear_like] = 0.3
+        tempo[joy_like] = np.minimum(120, tempo[joy_like] + 20)
+        music_params['mode'][joy_like] = 0.8
+        music_params['dynamics'][joy_like] = 0.7
+        tempo[sadness_like] = np.maximum(60, tempo[sadness_like] - 10)
+        music_params['mode'][sadness_like] = 0.3
+        
+        # 确保参数在合理范围内
+        np.clip(tempo, 40, 160, out=tempo)
+        for name in self.NUMERIC_PARAMETERS:
+            if name != 'tempo':
+                np.clip(music_params[name], 0, 1, out=music_params[name])
+        
+        return music_params
+    
     def get_music_search_parameters(self, emotion_vector: np.ndarray) -> Dict[str, Any]:
         """
         获取适用于MI_retrieve模块的搜索参数
@@ -590,24 +733,29 @@ class KnowledgeGraph:
             情绪分析结果
         """
         emotion_dict = self._vector_to_emotion_dict(emotion_vector)
+        values = np.fromiter(emotion_dict.values(), dtype=np.float64, count=27)
         
-        # 排序并分析
-        sorted_emotions = sorted(emotion_dict.items(), key=lambda x: x[1], reverse=True)
+        # 部分排序取前5：严格大于第5大值的全部入选，同值的按索引顺序补齐 (与稳定排序结果一致)
+        k = 5
+        kth_value = np.partition(values, 27 - k)[27 - k]
+        above = np.flatnonzero(values > kth_value)
+        ties = np.flatnonzero(values == kth_value)[:k - len(above)]
+        top_indices = np.concatenate((above[np.argsort(-values[above], kind="stable")], ties))
         
-        # 找出显著情绪 (> 0.3)
-        significant_emotions = [(name, value) for name, value in sorted_emotions if value > 0.3]
+        # 找出显著情绪 (> 0.3)，按强度降序
+        significant_indices = np.flatnonzero(values > 0.3)
+        significant_indices = significant_indices[np.argsort(-values[significant_indices], kind="stable")]
         
-        # 情绪分类
-        positive_emotions = ["快乐", "兴奋", "娱乐", "钦佩", "崇拜", "审美欣赏", "敬畏", "入迷", "兴趣", "浪漫"]
-        negative_emotions = ["愤怒", "焦虑", "悲伤", "恐惧", "内疚", "恐怖", "失望", "厌恶", "嫉妒", "蔑视"]
-        neutral_emotions = ["平静", "无聊", "困惑", "尴尬", "同情", "渴望", "怀旧"]
+        top_emotions = [(self.emotion_names[i], float(values[i])) for i in top_indices]
+        significant_emotions = [(self.emotion_names[i], float(values[i])) for i in significant_indices]
         
-        positive_score = sum(emotion_dict[e] for e in positive_emotions if e in emotion_dict)
-        negative_score = sum(emotion_dict[e] for e in negative_emotions if e in emotion_dict)
-        neutral_score = sum(emotion_dict[e] for e in neutral_emotions if e in emotion_dict)
+        # 情绪分类
+        positive_score = sum(emotion_dict[e] for e in self.POSITIVE_EMOTIONS if e in emotion_dict)
+        negative_score = sum(emotion_dict[e] for e in self.NEGATIVE_EMOTIONS if e in emotion_dict)
+        neutral_score = sum(emotion_dict[e] for e in self.NEUTRAL_EMOTIONS if e in emotion_dict)
         
         return {
-            "top_emotions": sorted_emotions[:5],
+            "top_emotions": top_emotions,
             "significant_emotions": significant_emotions,
             "emotion_balance": {
                 "positive": positive_score,
@@ -615,9 +763,41 @@ class KnowledgeGraph:
                 "neutral": neutral_score
             },
             "overall_intensity": np.mean(emotion_vector),
-            "max_emotion": sorted_emotions[0],
+            "max_emotion": top_emotions[0],
             "emotion_diversity": len(significant_emotions)
         }
+    
+    def analyze_emotion_batch(self, emotion_matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        批量分析多个情绪向量，所有统计量沿 axis=1 一次算出
+        
+        Args:
+            emotion_matrix: (N, 27) 情绪向量矩阵
+            
+        Returns:
+            按列组织的分析结果，第i行对应第i个向量：
+            - top_indices: (N, 5) 最强的5个情绪索引，按强度降序
+            - max_emotion_index / max_emotion_value: (N,) 最强情绪
+            - emotion_balance: (N, 3) positive/negative/neutral 得分
+            - overall_intensity: (N,) 平均强度
+            - emotion_diversity: (N,) 显著情绪 (> 0.3) 数量
+        """
+        emotion_matrix = np.ascontiguousarray(emotion_matrix, dtype=np.float32)
+        if emotion_matrix.ndim != 2 or emotion_matrix.shape[1] != 27:
+            raise ValueError(f"情绪矩阵形状必须为(N, 27)，当前为{emotion_matrix.shape}")
+        
+        # 稳定排序，同值时与 analyze_emotion_vector 的 sorted 保持相同顺序
+        top_indices = np.argsort(-emotion_matrix, axis=1, kind="stable")[:, :5]
+        max_emotion_index = top_indices[:, 0]
+        
+        return {
+            "top_indices": top_indices,
+            "max_emotion_index": max_emotion_index,
+            "max_emotion_value": np.take_along_axis(emotion_matrix, max_emotion_index[:, None], axis=1)[:, 0],
+            "emotion_balance": emotion_matrix @ self._balance_table.T,
+            "overall_intensity": emotion_matrix.mean(axis=1),
+            "emotion_diversity": np.count_nonzero(emotion_matrix > 0.3, axis=1)
+        }
 
 def main():
     """演示知识图谱的使用"""
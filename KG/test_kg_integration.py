@@ -6,8 +6,10 @@ KG模块集成测试
 验证与MI_retrieve模块的集成效果
 """
 
+import io
 import sys
 import os
+import contextlib
 import numpy as np
 import logging
 from pathlib import Path
@@ -23,6 +25,72 @@ from parameter_mapping import ParameterMapper
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _dump(title: str, params: dict):
+    """打印标题及参数字典，每项一行，整体一次写出"""
+    print("\n".join([title, *(f"   {key}: {value}" for key, value in params.items())]))
+
+def _reference_music_parameters(kg: KnowledgeGraph, emotion_vector: np.ndarray) -> dict:
+    """参照实现：用 MusicRule.evaluate 逐条评估规则，得到初始音乐参数"""
+    emotion_vector = np.clip(np.asarray(emotion_vector, dtype=np.float64), 0, 1)
+    emotion_dict = {name: float(value) for name, value in zip(kg.emotion_names, emotion_vector)}
+    
+    best_rule = None
+    best_match_strength = 0.0
+    for rule in kg.rules:
+        is_match, match_strength = rule.evaluate(emotion_dict)
+        if is_match and match_strength > best_match_strength:
+            best_match_strength = match_strength
+            best_rule = rule
+    
+    music_params = kg.default_music_parameters.copy()
+    if best_rule:
+        music_params.update(best_rule.parameters)
+    else:
+        max_emotion_name, max_emotion_value = max(emotion_dict.items(), key=lambda x: x[1])
+        if max_emotion_value > 0.3:
+            if max_emotion_name in kg.FEAR_LIKE_EMOTIONS:
+                music_params['tempo'] = max(50, music_params['tempo'] - 20)
+                music_params['harmony_consonance'] = 0.8
+                music_params['dynamics'] = 0.3
+            elif max_emotion_name in kg.JOY_LIKE_EMOTIONS:
+                music_params['tempo'] = min(120, music_params['tempo'] + 20)
+                music_params['mode'] = 0.8
+                music_params['dynamics'] = 0.7
+            elif max_emotion_name in kg.SADNESS_LIKE_EMOTIONS:
+                music_params['tempo'] = max(60, music_params['tempo'] - 10)
+                music_params['mode'] = 0.3
+    
+    music_params['tempo'] = max(40, min(160, music_params['tempo']))
+    for name in kg.NUMERIC_PARAMETERS:
+        if name != 'tempo':
+            music_params[name] = max(0, min(1, music_params[name]))
+    return music_params
+
+def _rule_edge_case_vectors(kg: KnowledgeGraph) -> list:
+    """规则评估的边界向量：全零、并列情绪、恰好等于/略低于规则阈值、超出[0,1]"""
+    index = {name: i for i, name in enumerate(kg.emotion_names)}
+    vectors = [np.zeros(27), np.full(27, 0.5), np.ones(27)]
+    
+    # 多个同优先级规则的情绪并列
+    tied = np.zeros(27)
+    tied[[index["焦虑"], index["愤怒"], index["恐惧"]]] = 0.9
+    vectors.append(tied)
+    
+    # 每条规则的条件恰好等于阈值 / 略低于阈值
+    for rule in kg.rules:
+        at_threshold = np.zeros(27)
+        below_threshold = np.zeros(27)
+        for emotion_name, threshold in rule.conditions.items():
+            at_threshold[index[emotion_name]] = threshold
+            below_threshold[index[emotion_name]] = np.nextafter(threshold, 0.0)
+        vectors.extend([at_threshold, below_threshold])
+    
+    out_of_range = np.zeros(27)
+    out_of_range[index["焦虑"]] = 1.5
+    out_of_range[index["平静"]] = -0.2
+    vectors.append(out_of_range)
+    return vectors
+
 class KGIntegrationTester:
     """KG模块集成测试器"""
     
@@ -50,17 +118,10 @@ class KGIntegrationTester:
             print(f"🎯 GEMS规则数量: {len(self.kg.rules)}")
             
             # 显示各优先级规则数量
-            priority_counts = {}
-            for rule in self.kg.rules:
-                priority = rule.priority
-                priority_counts[priority] = priority_counts.get(priority, 0) + 1
-            
-            print(f"📊 规则优先级分布: {priority_counts}")
+            print(f"📊 规则优先级分布: {dict(self.kg._priority_counts)}")
             
             # 测试默认参数
-            print(f"🎵 默认音乐参数:")
-            for key, value in self.kg.default_music_parameters.items():
-                print(f"   {key}: {value}")
+            _dump("🎵 默认音乐参数:", self.kg.default_music_parameters)
             
             print("✅ 知识图谱基础功能测试通过")
             return True
@@ -165,9 +226,7 @@ class KGIntegrationTester:
                 'emotional_envelope_direction': 'uplifting'
             }
             
-            print("🧪 测试KG参数:")
-            for key, value in test_kg_params.items():
-                print(f"   {key}: {value}")
+            _dump("🧪 测试KG参数:", test_kg_params)
             
             # 验证参数
             is_valid, errors = self.mapper.validate_parameters(test_kg_params)
@@ -183,15 +242,11 @@ class KGIntegrationTester:
             
             # 转换为结构化参数
             structured = self.mapper.kg_to_structured_params(test_kg_params)
-            print(f"\n🏗️  结构化参数:")
-            for key, value in structured.items():
-                print(f"   {key}: {value}")
+            _dump("\n🏗️  结构化参数:", structured)
             
             # 反向转换测试
             reverse_params = self.mapper.text_to_kg_params(text_desc)
-            print(f"\n🔄 反向转换 (实验性):")
-            for key, value in reverse_params.items():
-                print(f"   {key}: {value}")
+            _dump("\n🔄 反向转换 (实验性):", reverse_params)
             
             print("✅ 参数映射功能测试通过")
             return True
@@ -209,9 +264,7 @@ class KGIntegrationTester:
         try:
             # 显示桥接器状态
             status = self.bridge.get_bridge_status()
-            print("📊 桥接器状态:")
-            for key, value in status.items():
-                print(f"   {key}: {value}")
+            _dump("📊 桥接器状态:", status)
             
             # 测试情绪向量模板
             template = self.bridge.get_emotion_vector_template()
@@ -392,9 +445,7 @@ class KGIntegrationTester:
             
             # 步骤4: 展示音乐参数
             music_params = result["music_parameters"]
-            print(f"\n🎵 推荐音乐参数:")
-            for key, value in music_params.items():
-                print(f"   {key}: {value}")
+            _dump("\n🎵 推荐音乐参数:", music_params)
             
             # 步骤5: 展示治疗建议
             therapy = result["therapy_recommendation"]
@@ -429,6 +480,102 @@ class KGIntegrationTester:
             print(f"❌ 完整集成流程测试失败: {e}")
             return False
     
+    def test_batch_analysis(self):
+        """测试批量情绪分析与逐个分析结果一致"""
+        print("\n" + "="*60)
+        print("📦 测试 7: 批量情绪分析")
+        print("="*60)
+        
+        try:
+            rng = np.random.default_rng(0)
+            vectors = rng.random((8, 27)).astype(np.float32)
+            batch = self.kg.analyze_emotion_batch(vectors)
+            
+            for i, vector in enumerate(vectors):
+                single = self.kg.analyze_emotion_vector(vector)
+                expected_max = self.kg.emotion_names.index(single["max_emotion"][0])
+                expected_balance = [single["emotion_balance"][k] for k in ("positive", "negative", "neutral")]
+                
+                assert batch["max_emotion_index"][i] == expected_max
+                assert np.allclose(batch["emotion_balance"][i], expected_balance, atol=1e-5)
+                assert batch["emotion_diversity"][i] == single["emotion_diversity"]
+            
+            print(f"   ✅ {len(vectors)} 个向量的批量结果与逐个分析一致")
+            return True
+            
+        except Exception as e:
+            print(f"❌ 批量情绪分析测试失败: {e}")
+            return False
+    
+    def test_rule_evaluation_equivalence(self):
+        """测试规则矩阵评估与 MusicRule.evaluate 逐条评估结果一致，批量结果与逐行结果一致"""
+        print("\n" + "="*60)
+        print("📐 测试 8: 规则评估等价性")
+        print("="*60)
+        
+        kg_logger = logging.getLogger("knowledge_graph")
+        previous_level = kg_logger.level
+        try:
+            rng = np.random.default_rng(0)
+            vectors = list(rng.random((64, 27)))
+            # 稀疏向量多数不匹配任何规则，覆盖按最强情绪调整的分支
+            vectors += list(rng.random((32, 27)) * (rng.random((32, 27)) < 0.15))
+            vectors += _rule_edge_case_vectors(self.kg)
+            
+            kg_logger.setLevel(logging.ERROR)
+            batch = self.kg.get_initial_music_parameters_batch(np.stack(vectors))
+            for i, vector in enumerate(vectors):
+                expected = _reference_music_parameters(self.kg, vector)
+                single = self.kg.get_initial_music_parameters(vector)
+                assert single == expected, f"向量{i}: {single} != {expected}"
+                
+                row = {name: batch[name][i] for name in expected}
+                assert row == expected, f"批量第{i}行: {row} != {expected}"
+            
+            print(f"   ✅ {len(vectors)} 个向量 (含全零/并列/阈值边界) 的单向量/批量结果与逐条评估一致")
+            return True
+            
+        except Exception as e:
+            print(f"❌ 规则评估等价性测试失败: {e}")
+            return False
+        finally:
+            kg_logger.setLevel(previous_level)
+    
+    def test_result_cache(self):
+        """测试结果缓存的命中统计，以及修改返回结果不会污染缓存"""
+        print("\n" + "="*60)
+        print("🗃️  测试 9: 结果缓存")
+        print("="*60)
+        
+        try:
+            bridge = EmotionMusicBridge(enable_mi_retrieve=False)
+            vector = bridge.create_emotion_vector_from_dict({"焦虑": 0.8, "平静": 0.2})
+            
+            first = bridge.analyze_emotion_and_recommend_music(vector)
+            expected_tempo = first["music_parameters"]["tempo"]
+            first["music_parameters"]["tempo"] = -1.0
+            first["emotion_analysis"].clear()
+            
+            # 相同分档内的相近向量命中缓存
+            nearby = vector + 1e-4
+            second = bridge.analyze_emotion_and_recommend_music(nearby)
+            stats = bridge._cache_stats()
+            assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1), stats
+            assert second["music_parameters"]["tempo"] == expected_tempo
+            assert second["emotion_analysis"], "缓存中的情绪分析被调用方修改"
+            
+            second["music_parameters"]["tempo"] = -2.0
+            third = bridge.analyze_emotion_and_recommend_music(vector)
+            assert third["music_parameters"]["tempo"] == expected_tempo
+            assert bridge._cache_stats()["hits"] == 2
+            
+            print("   ✅ 缓存命中/未命中统计正确，返回结果与缓存相互独立")
+            return True
+            
+        except Exception as e:
+            print(f"❌ 结果缓存测试失败: {e}")
+            return False
+    
     def run_all_tests(self):
         """运行所有测试"""
         print("🧪 开始KG模块完整集成测试")
@@ -440,18 +587,26 @@ class KGIntegrationTester:
             self.test_parameter_mapping,
             self.test_emotion_music_bridge,
             self.test_edge_cases,
-            self.test_full_integration
+            self.test_full_integration,
+            self.test_batch_analysis,
+            self.test_rule_evaluation_equivalence,
+            self.test_result_cache
         ]
         
         passed = 0
         total = len(test_methods)
         
         for test_method in test_methods:
-            try:
-                if test_method():
-                    passed += 1
-            except Exception as e:
-                print(f"❌ 测试方法 {test_method.__name__} 执行异常: {e}")
+            # 每个测试的输出先写入内存缓冲，结束后一次性写出，避免逐行写终端
+            buffer = io.StringIO()
+            with contextlib.redirect_stdout(buffer):
+                try:
+                    if test_method():
+                        passed += 1
+                except Exception as e:
+                    print(f"❌ 测试方法 {test_method.__name__} 执行异常: {e}")
+            sys.stdout.write(buffer.getvalue())
+            sys.stdout.flush()
         
         # 测试总结
         print("\n" + "="*80)
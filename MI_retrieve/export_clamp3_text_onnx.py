@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+导出CLAMP3文本塔为ONNX - 供 semantic_text_extractor 的ONNX Runtime后端使用
+
+用法: python export_clamp3_text_onnx.py [--output code/clamp3_text.onnx]
+"""
+
+import argparse
+
+import torch
+
+from semantic_text_extractor import SemanticTextExtractor, DEFAULT_ONNX_PATH
+
+class TextTower(torch.nn.Module):
+    """文本编码 + 平均池化 + 投影，输出 (batch_size, 768) 全局特征"""
+    
+    def __init__(self, clamp3_model):
+        super().__init__()
+        self.clamp3_model = clamp3_model
+    
+    def forward(self, input_ids, attention_mask):
+        return self.clamp3_model.get_text_features(input_ids, attention_mask, get_global=True)
+
+def main():
+    """导出ONNX文本塔"""
+    parser = argparse.ArgumentParser(description="导出CLAMP3文本塔为ONNX")
+    parser.add_argument("--output", "-o", type=str, default=DEFAULT_ONNX_PATH, help="ONNX输出路径")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset版本")
+    args = parser.parse_args()
+    
+    print("🔄 加载CLAMP3模型 (PyTorch)...")
+    extractor = SemanticTextExtractor(backend="torch")
+    extractor.model.to("cpu")  # device 属性随参数所在设备变化，导出统一在CPU上追踪
+    
+    tower = TextTower(extractor.model).eval()
+    
+    # 示例输入只用于追踪，批大小和序列长度均为动态维度
+    encoded = extractor.tokenizer(["tempo 90 BPM, 大调, 轻松愉悦的音乐"], return_tensors='pt')
+    
+    print(f"🔄 导出ONNX: {args.output}")
+    with torch.no_grad():
+        torch.onnx.export(
+            tower,
+            (encoded['input_ids'], encoded['attention_mask']),
+            args.output,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['text_features'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'text_features': {0: 'batch'}
+            },
+            opset_version=args.opset
+        )
+    
+    print("✅ 导出完成，设置 CLAMP3_BACKEND=ort (或保持auto) 即可使用ONNX Runtime推理")
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ import numpy as np
 from pathlib import Path
 from datetime import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Dict, List, Tuple, Optional, Any
 import json
 
@@ -21,7 +22,7 @@ import json
 sys.path.append(str(Path(__file__).parent))
 
 try:
-    from music_search_api import MusicSearchAPI
+    from music_search_api import get_music_search_api
 except ImportError:
     print("❌ 无法导入 music_search_api，请确保文件存在")
     sys.exit(1)
@@ -38,12 +39,11 @@ class MusicRetrievalUI:
         self.app_name = "🎵 音乐信息检索系统"
         self.version = "1.0.0"
         
-        # 初始化检索API
-        try:
-            self.music_api = MusicSearchAPI()
-        except Exception as e:
-            logger.error(f"初始化MusicSearchAPI失败: {e}")
-            self.music_api = None
+        # 检索API加载较慢，放到后台线程初始化，界面可立即渲染；initialize_system 时等待其完成
+        self.music_api = None
+        api_executor = ThreadPoolExecutor(max_workers=1)
+        self._api_future = api_executor.submit(get_music_search_api)
+        api_executor.shutdown(wait=False)
         
         # 状态变量
         self.is_initialized = False
@@ -67,13 +67,29 @@ class MusicRetrievalUI:
         
         logger.info(f"🚀 初始化 {self.app_name}")
     
+    def _await_music_api(self, timeout: float = 60):
+        """等待后台初始化的检索API，超时则保留任务以便下次继续等待"""
+        if self.music_api is None and self._api_future is not None:
+            try:
+                self.music_api = self._api_future.result(timeout=timeout)
+                self._api_future = None
+            except FutureTimeoutError:
+                logger.warning("⏳ MusicSearchAPI 仍在加载中")
+            except Exception as e:
+                logger.error(f"初始化MusicSearchAPI失败: {e}")
+                self._api_future = None
+        return self.music_api
+    
     def initialize_system(self) -> str:
         """初始化音乐检索系统"""
         try:
             if self.is_initialized:
                 return "✅ 系统已初始化完成"
             
+            self._await_music_api()
             if self.music_api is None:
+                if self._api_future is not None:
+                    return "⏳ 音乐检索API仍在加载中，请稍后再次点击初始化"
                 return "❌ 系统初始化失败: MusicSearchAPI 未能正确初始化"
             
             logger.info("🔄 开始音乐检索系统初始化...")
@@ -7,24 +7,95 @@
 import gradio as gr
 import os
 import sys
-import random
 import logging
+import numpy as np
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Any
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple, Optional, Any
+from urllib.parse import quote
+
+# Gradio 5起文件路由位于 /gradio_api 前缀下，Gradio 4没有该前缀
+try:
+    from gradio.route_utils import API_PREFIX as GRADIO_API_PREFIX
+except ImportError:
+    GRADIO_API_PREFIX = ""
 
 # 添加当前目录到路径
 sys.path.append(str(Path(__file__).parent))
 
 try:
-    from music_search_api import MusicSearchAPI
+    from music_search_api import MusicSearchError, get_music_search_api
 except ImportError:
     print("❌ 无法导入 music_search_api，请确保文件存在")
     sys.exit(1)
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
+# 设置日志 (默认只输出警告及以上，调试时可设置 MI_LOG_LEVEL=INFO)
+LOG_LEVEL = os.getenv("MI_LOG_LEVEL", "WARNING").upper()
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+# 检索视频库目录 (其下为 segments_{时长} 子目录)
+RETRIEVE_LIBRARY_DIR = Path(__file__).parent / "retrieve_libraries"
+
+# Gradio允许访问的视频目录，只保留实际存在的时长目录
+ALLOWED_PATHS = [
+    path for path in (RETRIEVE_LIBRARY_DIR / f"segments_{duration}"
+                      for duration in ("1min", "3min", "5min", "10min", "20min", "30min"))
+    if path.is_dir()
+]
+
+# 播放器：视频经Gradio文件路由 (仅限 allowed_paths) 直接读取，浏览器通过HTTP Range请求边下边播，无需Gradio先复制整个文件
+VIDEO_PLAYER_TEMPLATE = '<video src="{url}" controls preload="metadata" style="width: 100%; max-height: 400px;"></video>'
+
+# 支持的时长版本 (目前只有1min和3min有特征文件)
+DURATION_OPTIONS = ("1min", "3min")
+
+# 预设音乐类型示例 (只读，所有实例共享)
+MUSIC_EXAMPLES: Mapping[str, str] = MappingProxyType({
+    "疗愈音乐(示例)": "建议初始节奏为 90-110 BPM，调式倾向小调或不确定性，和声包含轻微不协和，音色可能略显尖锐",
+    "放松冥想": "节奏缓慢平稳，60-80 BPM，大调为主，和声简单纯净，音色温暖柔和，适合深度放松",
+    "专注工作": "节奏中等稳定，100-120 BPM，调式中性，和声不过于复杂，音色清晰不分散注意力",
+    "情绪疏导": "节奏渐进变化，80-100 BPM，小调转大调，和声层次丰富，音色表现力强",
+    "睡前安眠": "节奏极慢，50-70 BPM，大调柔和，和声简单，音色轻柔如耳语",
+    "焦虑缓解": "节奏规律稳定，70-90 BPM，避免突然变化，和声稳定，音色温暖包容",
+    "活力提升": "节奏明快活泼，120-140 BPM，大调明亮，和声丰富，音色清新有活力",
+    "深度思考": "节奏慢而深沉，60-80 BPM，小调神秘，和声复杂层次，音色富有内涵"
+})
+_EXAMPLE_KEYS = tuple(MUSIC_EXAMPLES.keys())
+_FIRST_VALUE = next(iter(MUSIC_EXAMPLES.values()))
+
+# 语义检索报告模板，匹配列表 {match_list} 预先用 "\n".join 拼好
+SEMANTIC_SEARCH_REPORT_TEMPLATE = """✅ 语义音乐检索完成！
+
+💭 您的描述:
+   • 音乐特征: {description}
+   • 检索方式: {search_method}
+   • 智能推荐: 基于跨模态特征匹配
+
+🎯 检索结果:
+   • 找到匹配音乐: {result_count} 首
+   • 搜索时长版本: {duration}
+   • 匹配策略: 真正的语义理解 + 特征向量相似度
+
+🎵 随机选择结果:
+   • 音乐名称: {video_name}
+   • 相似度: {similarity:.4f}
+   • 时长版本: {selected_duration}
+   • 检索方法: {method}
+
+📊 语义匹配列表:
+{match_list}
+
+🧠 语义检索技术:
+   • 基于CLAMP3多模态模型的文本特征提取
+   • 与音频特征向量进行余弦相似度计算
+   • 跨模态语义理解，非关键词匹配
+   • 智能降级机制确保稳定性
+
+✨ 请在播放器中欣赏为您语义匹配的音乐！"""
+
 class MusicRetrievalUI:
     """音乐检索系统用户界面"""
     
@@ -33,34 +104,71 @@ class MusicRetrievalUI:
         self.app_name = "🎵 音乐疗愈检索系统"
         self.version = "1.0.0"
         
-        # 初始化检索API
-        try:
-            self.music_api = MusicSearchAPI()
-        except Exception as e:
-            logger.error(f"初始化MusicSearchAPI失败: {e}")
-            self.music_api = None
+        # 检索API加载较慢，放到后台线程初始化，界面可立即渲染；initialize_system 时等待其完成
+        self.music_api = None
+        api_executor = ThreadPoolExecutor(max_workers=1)
+        self._api_future = api_executor.submit(get_music_search_api)
+        api_executor.shutdown(wait=False)
         
         # 状态变量
         self.is_initialized = False
         self.last_search_results = []
         self.current_selection = None
         
-        # 支持的时长版本 (目前只有1min和3min有特征文件)
-        self.duration_options = ["1min", "3min"]
+        # 随机选择用的生成器，测试时可替换为带种子的生成器以复现选择
+        self._rng = np.random.default_rng()
         
-        # 预设音乐类型示例
-        self.music_examples = {
-            "疗愈音乐(示例)": "建议初始节奏为 90-110 BPM，调式倾向小调或不确定性，和声包含轻微不协和，音色可能略显尖锐",
-            "放松冥想": "节奏缓慢平稳，60-80 BPM，大调为主，和声简单纯净，音色温暖柔和，适合深度放松",
-            "专注工作": "节奏中等稳定，100-120 BPM，调式中性，和声不过于复杂，音色清晰不分散注意力",
-            "情绪疏导": "节奏渐进变化，80-100 BPM，小调转大调，和声层次丰富，音色表现力强",
-            "睡前安眠": "节奏极慢，50-70 BPM，大调柔和，和声简单，音色轻柔如耳语",
-            "焦虑缓解": "节奏规律稳定，70-90 BPM，避免突然变化，和声稳定，音色温暖包容",
-            "活力提升": "节奏明快活泼，120-140 BPM，大调明亮，和声丰富，音色清新有活力",
-            "深度思考": "节奏慢而深沉，60-80 BPM，小调神秘，和声复杂层次，音色富有内涵"
-        }
+        # 支持的时长版本与预设示例 (引用模块级只读常量)
+        self.duration_options = DURATION_OPTIONS
+        self.music_examples = MUSIC_EXAMPLES
+        
+        # 预设描述的文本特征 (initialize_system 时批量预计算)
+        self._preset_embeds = {}
+        
+        # (时长, 视频名称) -> 视频路径，initialize_system 时扫描一次
+        self._path_index: Dict[Tuple[str, str], Path] = {}
         
-        logger.info(f"🚀 初始化 {self.app_name}")
+        # 视频库中所有可用文件，替代每次交互的文件存在性检查
+        self._available_files: frozenset = frozenset()
+        
+        logger.info("🚀 初始化 %s", self.app_name)
+    
+    def _warm_preset_embeddings(self):
+        """一次批量编码所有预设描述，首次检索无需等待文本编码"""
+        try:
+            preset_texts = list(self.music_examples.values())
+            preset_features = self.music_api.encode_texts_batch(preset_texts)
+            self._preset_embeds = dict(zip(preset_texts, preset_features))
+            logger.info("✅ 预计算 %d 个预设描述的文本特征", len(self._preset_embeds))
+        except Exception as e:
+            logger.warning("⚠️  预设描述特征预计算失败，检索时再编码: %s", e)
+    
+    def _build_path_index(self):
+        """扫描各时长版本的视频目录，建立视频路径索引"""
+        self._path_index = {
+            (duration, video_file.stem): video_file
+            for duration in self.duration_options
+            for video_file in (RETRIEVE_LIBRARY_DIR / f"segments_{duration}").glob("*.mp4")
+        }
+        self._available_files = frozenset(self._path_index.values())
+        logger.info("📁 视频路径索引: %d 个文件", len(self._path_index))
+    
+    def refresh_library_index(self):
+        """视频库文件增删后重新扫描 (测试或素材更新后调用)"""
+        self._build_path_index()
+    
+    def _await_music_api(self, timeout: float = 60):
+        """等待后台初始化的检索API，超时则保留任务以便下次继续等待"""
+        if self.music_api is None and self._api_future is not None:
+            try:
+                self.music_api = self._api_future.result(timeout=timeout)
+                self._api_future = None
+            except FutureTimeoutError:
+                logger.warning("⏳ MusicSearchAPI 仍在加载中")
+            except Exception as e:
+                logger.error("初始化MusicSearchAPI失败: %s", e)
+                self._api_future = None
+        return self.music_api
     
     def initialize_system(self) -> str:
         """初始化音乐检索系统"""
@@ -68,7 +176,10 @@ class MusicRetrievalUI:
             if self.is_initialized:
                 return "✅ 系统已初始化完成"
             
+            self._await_music_api()
             if self.music_api is None:
+                if self._api_future is not None:
+                    return "⏳ 音乐检索API仍在加载中，请稍后再次点击初始化"
                 return "❌ 系统初始化失败: MusicSearchAPI 未能正确初始化"
             
             logger.info("🔄 开始音乐检索系统初始化...")
@@ -84,6 +195,9 @@ class MusicRetrievalUI:
             if stats["total_features"] == 0:
                 return "❌ 系统初始化失败: 未找到音乐特征库\n请确保已完成音乐特征提取"
             
+            self._warm_preset_embeddings()
+            self._build_path_index()
+            
             self.is_initialized = True
             
             # 生成初始化报告
@@ -122,7 +236,7 @@ class MusicRetrievalUI:
             return report
             
         except Exception as e:
-            logger.error(f"系统初始化失败: {e}")
+            logger.error("系统初始化失败: %s", e)
             return f"❌ 系统初始化失败: {str(e)}"
     
     def search_by_description(self, description: str, duration: str, search_count: int = 5) -> Tuple[str, Optional[str]]:
@@ -137,91 +251,101 @@ class MusicRetrievalUI:
             return "❌ 音乐检索API未初始化", None
         
         try:
-            logger.info(f"🔍 开始语义检索: {description}")
+            logger.info("🔍 开始语义检索: %s", description)
             
             # 使用真正的语义检索API
-            result = self.music_api.search_by_description(
-                description=description,
-                duration=duration,
-                top_k=search_count
-            )
-            
-            if not result["success"]:
-                return f"❌ 语义检索失败: {result['error']}", None
-            
-            if not result["results"]:
+            try:
+                result = self.music_api.find_by_description(
+                    description=description,
+                    duration=duration,
+                    top_k=search_count,
+                    text_features=self._preset_embeds.get(description)
+                )
+            except MusicSearchError as e:
+                return f"❌ 语义检索失败: {e}", None
+            
+            if not len(result):
                 return f"❌ 没有找到匹配的音乐，请尝试其他描述", None
             
-            # 转换结果格式并添加正确的路径
-            semantic_results = []
-            for item in result["results"]:
-                video_path = f"/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_{duration}/{item['video_name']}.mp4"
-                
-                semantic_results.append({
-                    "video_name": item["video_name"],
-                    "similarity": item["similarity"],
-                    "video_path": video_path,
-                    "duration": duration,
-                    "method": "semantic_search"
-                })
+            # 只保留视频库中有对应文件的结果，路径取自视频库索引
+            keep = [i for i, name in enumerate(result.names) if (duration, name) in self._path_index]
+            if not keep:
+                return f"❌ 匹配的音乐在 {duration} 视频库中没有对应文件", None
+            
+            names = [result.names[i] for i in keep]
+            semantic_results = replace(
+                result,
+                names=names,
+                scores=result.scores[keep],
+                paths=[str(self._path_index[(duration, name)]) for name in names]
+            )
             
             # 保存搜索结果
             self.last_search_results = semantic_results
             
-            # 从前3个结果中随机选择一个
-            top_results = semantic_results[:min(3, len(semantic_results))]
-            selected_music = random.choice(top_results)
+            # 从相似度最高的3个结果中随机选择一个 (部分排序取前3)
+            scores = semantic_results.scores
+            k = min(3, len(scores))
+            top_indices = np.argpartition(-scores, k - 1)[:k]
+            top_indices = top_indices[np.argsort(-scores[top_indices], kind="stable")]
+            selected_index = int(self._rng.choice(top_indices))
+            selected_music = self._make_selection(semantic_results, selected_index)
             self.current_selection = selected_music
             
             # 生成搜索报告
-            search_method = "CLAMP3语义检索" if result["query"].get("method") == "semantic_search" else "简化版语义检索"
-            
-            report = f"""✅ 语义音乐检索完成！
-
-💭 您的描述:
-   • 音乐特征: {description}
-   • 检索方式: {search_method}
-   • 智能推荐: 基于跨模态特征匹配
-
-🎯 检索结果:
-   • 找到匹配音乐: {len(semantic_results)} 首
-   • 搜索时长版本: {duration}
-   • 匹配策略: 真正的语义理解 + 特征向量相似度
-
-🎵 随机选择结果:
-   • 音乐名称: {selected_music['video_name']}
-   • 相似度: {selected_music['similarity']:.4f}
-   • 时长版本: {selected_music['duration']}
-   • 检索方法: {selected_music.get('method', 'semantic_search')}
-
-📊 语义匹配列表:"""
+            search_method = "CLAMP3语义检索" if result.method == "semantic_search" else "简化版语义检索"
             
-            for i, item in enumerate(semantic_results, 1):
-                marker = "🎯" if item['video_name'] == selected_music['video_name'] else "  "
-                report += f"\n   {marker} {i}. {item['video_name']} - 相似度: {item['similarity']:.4f}"
+            match_list = "\n".join(
+                f"   {'🎯' if i == selected_index else '  '} {i + 1}. {name} - 相似度: {score:.4f}"
+                for i, (name, score) in enumerate(zip(semantic_results.names, scores))
+            )
             
-            report += f"""
-
-🧠 语义检索技术:
-   • 基于CLAMP3多模态模型的文本特征提取
-   • 与音频特征向量进行余弦相似度计算
-   • 跨模态语义理解，非关键词匹配
-   • 智能降级机制确保稳定性
-
-✨ 请在播放器中欣赏为您语义匹配的音乐！"""
+            report = SEMANTIC_SEARCH_REPORT_TEMPLATE.format(
+                description=description,
+                search_method=search_method,
+                result_count=len(semantic_results),
+                duration=duration,
+                video_name=selected_music['video_name'],
+                similarity=selected_music['similarity'],
+                selected_duration=selected_music['duration'],
+                method=selected_music.get('method', 'semantic_search'),
+                match_list=match_list
+            )
             
-            # 准备播放文件
-            video_path = selected_music["video_path"]
-            if os.path.exists(video_path):
-                return report, video_path
-            else:
-                return f"❌ 选中的音乐文件不存在: {video_path}", None
+            # 准备播放文件 (路径来自初始化时扫描的视频库索引)
+            return report, selected_music["video_path"]
                 
         except Exception as e:
-            logger.error(f"描述检索失败: {e}")
+            logger.error("描述检索失败: %s", e)
             return f"❌ 检索失败: {str(e)}", None
     
     
+    def _player_html(self, video_path: Optional[str]) -> str:
+        """生成播放器HTML，视频地址为Gradio文件路由 {前缀}/file={绝对路径}"""
+        if not video_path:
+            return ""
+        return VIDEO_PLAYER_TEMPLATE.format(url=f"{GRADIO_API_PREFIX}/file={quote(str(Path(video_path).resolve()))}")
+    
+    def _search_for_player(self, description: str, duration: str) -> Tuple[str, str]:
+        """界面检索回调：检索并返回播放器HTML"""
+        report, video_path = self.search_by_description(description, duration)
+        return report, self._player_html(video_path)
+    
+    def _reselect_for_player(self) -> Tuple[str, str]:
+        """界面重新选择回调：重新选择并返回播放器HTML"""
+        report, video_path = self.reselect_music()
+        return report, self._player_html(video_path)
+    
+    def _make_selection(self, results, index: int) -> Dict[str, Any]:
+        """取出检索结果中第index个音乐的信息"""
+        return {
+            "video_name": results.names[index],
+            "similarity": float(results.scores[index]),
+            "video_path": results.paths[index],
+            "duration": results.duration,
+            "method": results.method
+        }
+    
     def reselect_music(self) -> Tuple[str, Optional[str]]:
         """重新从上次搜索结果中随机选择音乐"""
         if not self.last_search_results:
@@ -229,7 +353,8 @@ class MusicRetrievalUI:
         
         try:
             # 随机选择一个结果
-            selected_music = random.choice(self.last_search_results)
+            selected_music = self._make_selection(self.last_search_results,
+                                                  int(self._rng.integers(len(self.last_search_results))))
             self.current_selection = selected_music
             
             # 生成重新选择报告
@@ -252,13 +377,13 @@ class MusicRetrievalUI:
             
             # 准备播放文件
             video_path = selected_music["video_path"]
-            if os.path.exists(video_path):
+            if Path(video_path) in self._available_files:
                 return report, video_path
             else:
                 return f"❌ 选中的音乐文件不存在: {video_path}", None
                 
         except Exception as e:
-            logger.error(f"重新选择失败: {e}")
+            logger.error("重新选择失败: %s", e)
             return f"❌ 重新选择失败: {str(e)}", None
     
     def create_interface(self) -> gr.Blocks:
@@ -291,16 +416,16 @@ class MusicRetrievalUI:
                 with gr.Column(scale=1):
                     # 时长选择
                     duration_choice = gr.Dropdown(
-                        choices=self.duration_options,
+                        choices=list(DURATION_OPTIONS),
                         value="3min",
                         label="⏱️ 时长版本"
                     )
                     
                     # 预设示例
                     music_examples = gr.Dropdown(
-                        choices=list(self.music_examples.keys()),
+                        choices=list(_EXAMPLE_KEYS),
                         label="🎭 疗愈音乐类型示例",
-                        value=list(self.music_examples.keys())[0]
+                        value=_EXAMPLE_KEYS[0]
                     )
                     
                     # 重新选择按钮
@@ -312,7 +437,7 @@ class MusicRetrievalUI:
                         label="💭 音乐特征描述",
                         placeholder="例如：建议初始节奏为 90-110 BPM，调式倾向小调或不确定性，和声包含轻微不协和，音色可能略显尖锐",
                         lines=4,
-                        value=list(self.music_examples.values())[0]
+                        value=_FIRST_VALUE
                     )
                     
                     # 搜索按钮
@@ -327,9 +452,8 @@ class MusicRetrievalUI:
             )
             
             # 音乐播放器
-            music_player = gr.Video(
-                label="🎵 音乐播放器",
-                height=400
+            music_player = gr.HTML(
+                label="🎵 音乐播放器"
             )
             
             # 使用指南
@@ -359,9 +483,7 @@ class MusicRetrievalUI:
             
             # 事件绑定
             def update_description_from_example(selected_type):
-                if selected_type in self.music_examples:
-                    return self.music_examples[selected_type]
-                return ""
+                return MUSIC_EXAMPLES.get(selected_type, "")
             
             music_examples.change(
                 update_description_from_example,
@@ -376,13 +498,13 @@ class MusicRetrievalUI:
             )
             
             search_btn.click(
-                self.search_by_description,
+                self._search_for_player,
                 inputs=[description_input, duration_choice],
                 outputs=[search_report, music_player]
             )
             
             reselect_btn.click(
-                self.reselect_music,
+                self._reselect_for_player,
                 inputs=[],
                 outputs=[search_report, music_player]
             )
@@ -409,14 +531,7 @@ def main():
         show_error=True,
         debug=False,
         inbrowser=True,  # 自动打开浏览器
-        allowed_paths=[
-            "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_1min",
-            "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_3min",
-            "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_5min",
-            "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_10min",
-            "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_20min",
-            "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/retrieve_libraries/segments_30min"
-        ]
+        allowed_paths=[str(path.resolve()) for path in ALLOWED_PATHS]
     )
 
 if __name__ == "__main__":
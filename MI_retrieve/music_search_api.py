@@ -7,15 +7,62 @@ import os
 import sys
 import json
 import argparse
-from typing import Dict, List, Any
+import functools
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
 from music_search_system import MusicSearchSystem
 
+class MusicSearchError(Exception):
+    """音乐检索失败 (参数无效或检索过程异常)"""
+
+@dataclass
+class SearchResult:
+    """文本描述检索结果 (按列存储：第i个结果为 names[i], scores[i], paths[i])"""
+    description: str
+    duration: str
+    top_k: int
+    method: str
+    names: List[str]
+    scores: np.ndarray  # float32相似度，按降序排列
+    paths: List[Optional[str]]
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为 search_by_description 的字典格式"""
+        return {
+            "success": True,
+            "query": {
+                "description": self.description,
+                "duration": self.duration,
+                "top_k": self.top_k,
+                "method": self.method
+            },
+            "results": [
+                {
+                    "video_name": name,
+                    "similarity": round(float(score), 4),
+                    "video_path": path,
+                    "duration": self.duration
+                }
+                for name, score, path in zip(self.names, self.scores, self.paths)
+            ],
+            "total_results": len(self.names)
+        }
+
 class MusicSearchAPI:
     """音乐检索API类"""
     
-    def __init__(self):
-        """初始化API"""
-        self.search_system = MusicSearchSystem()
+    def __init__(self, use_int8: bool = False):
+        """
+        初始化API
+        
+        Args:
+            use_int8: 是否使用int8量化特征检索
+        """
+        self.search_system = MusicSearchSystem(use_int8=use_int8)
         print("✅ 音乐检索API初始化完成")
     
     def search_by_audio_file(self, audio_path: str, duration: str = "3min", 
@@ -119,8 +166,20 @@ class MusicSearchAPI:
                 "results": []
             }
     
+    def encode_texts_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        批量提取文本描述的CLAMP3特征 (一次批量前向计算，结果写入文本特征缓存)
+        
+        Args:
+            texts: 描述文本列表
+            
+        Returns:
+            (len(texts), 768) 特征矩阵
+        """
+        return self.search_system.encode_texts(texts)
+    
     def search_by_description(self, description: str, duration: str = "3min", 
-                            top_k: int = 5) -> Dict[str, Any]:
+                            top_k: int = 5, text_features: Optional[np.ndarray] = None) -> Dict[str, Any]:
         """
         通过文本描述搜索相似音乐 (真正的语义检索)
         
@@ -128,63 +187,111 @@ class MusicSearchAPI:
             description: 音乐特征描述
             duration: 搜索版本
             top_k: 返回结果数量
+            text_features: 可选的预计算文本特征 (如 encode_texts_batch 的结果)，提供时跳过文本编码
             
         Returns:
             搜索结果字典
         """
         try:
-            # 验证参数
-            if not description or len(description.strip()) < 3:
-                return {
-                    "success": False,
-                    "error": "描述内容过短，请提供至少3个字符的描述",
-                    "results": []
-                }
-            
-            supported_durations = ["1min", "3min", "5min", "10min", "20min", "30min"]
-            if duration not in supported_durations:
-                return {
-                    "success": False,
-                    "error": f"不支持的时长版本: {duration}，仅支持 {', '.join(supported_durations)}",
-                    "results": []
-                }
-            
+            return self.find_by_description(description, duration, top_k, text_features).to_dict()
+        except MusicSearchError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "results": []
+            }
+    
+    def find_by_description(self, description: str, duration: str = "3min", 
+                          top_k: int = 5, text_features: Optional[np.ndarray] = None) -> SearchResult:
+        """
+        通过文本描述搜索相似音乐，失败时抛出 MusicSearchError (参数同 search_by_description)
+        
+        Returns:
+            SearchResult 检索结果
+        """
+        # 验证参数
+        if not description or len(description.strip()) < 3:
+            raise MusicSearchError("描述内容过短，请提供至少3个字符的描述")
+        
+        supported_durations = ["1min", "3min", "5min", "10min", "20min", "30min"]
+        if duration not in supported_durations:
+            raise MusicSearchError(f"不支持的时长版本: {duration}，仅支持 {', '.join(supported_durations)}")
+        
+        try:
             # 执行语义检索
             results = self.search_system.search_music_by_text(
                 text_description=description,
                 duration=duration,
-                top_k=top_k
+                top_k=top_k,
+                text_features=text_features
             )
-            
-            # 格式化结果
-            formatted_results = []
-            for video_name, similarity in results:
-                video_path = self.search_system.get_video_path(video_name, duration)
-                formatted_results.append({
-                    "video_name": video_name,
-                    "similarity": round(similarity, 4),
-                    "video_path": video_path,
-                    "duration": duration
-                })
-            
-            return {
-                "success": True,
-                "query": {
-                    "description": description,
-                    "duration": duration,
-                    "top_k": top_k,
-                    "method": "semantic_search"
-                },
-                "results": formatted_results,
-                "total_results": len(formatted_results)
-            }
-            
+            return self._build_search_result(description, duration, top_k, results)
         except Exception as e:
-            return {
+            raise MusicSearchError(str(e)) from e
+    
+    def search_by_descriptions(self, descriptions: List[str], duration: str = "3min", 
+                             top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        批量文本描述检索：所有描述一次批量编码、一次矩阵乘完成检索
+        
+        Args:
+            descriptions: 音乐特征描述列表
+            duration: 搜索版本
+            top_k: 每个描述返回的结果数量
+            
+        Returns:
+            与 descriptions 一一对应的搜索结果字典列表 (格式同 search_by_description)
+        """
+        supported_durations = ["1min", "3min", "5min", "10min", "20min", "30min"]
+        if duration not in supported_durations:
+            error = {
                 "success": False,
-                "error": str(e),
+                "error": f"不支持的时长版本: {duration}，仅支持 {', '.join(supported_durations)}",
                 "results": []
             }
+            return [dict(error) for _ in descriptions]
+        
+        responses = [None] * len(descriptions)
+        valid = []
+        for i, description in enumerate(descriptions):
+            if not description or len(description.strip()) < 3:
+                responses[i] = {
+                    "success": False,
+                    "error": "描述内容过短，请提供至少3个字符的描述",
+                    "results": []
+                }
+            else:
+                valid.append(i)
+        
+        try:
+            batch_results = self.search_system.search_music_by_texts(
+                [descriptions[i] for i in valid], duration, top_k
+            )
+            for i, results in zip(valid, batch_results):
+                responses[i] = self._build_search_result(descriptions[i], duration, top_k, results).to_dict()
+        except Exception as e:
+            for i in valid:
+                responses[i] = {
+                    "success": False,
+                    "error": str(e),
+                    "results": []
+                }
+        
+        return responses
+    
+    def _build_search_result(self, description: str, duration: str, top_k: int,
+                             results: List[tuple]) -> SearchResult:
+        """构建文本检索结果"""
+        names = [video_name for video_name, _ in results]
+        return SearchResult(
+            description=description,
+            duration=duration,
+            top_k=top_k,
+            method="semantic_search",
+            names=names,
+            scores=np.fromiter((similarity for _, similarity in results), dtype=np.float32, count=len(results)),
+            paths=[self.search_system.get_video_path(video_name, duration) for video_name in names]
+        )
     
     def get_feature_library_stats(self) -> Dict[str, Any]:
         """获取特征库统计信息"""
@@ -224,6 +331,15 @@ class MusicSearchAPI:
         
         return results
 
+@functools.lru_cache(maxsize=1)
+def get_music_search_api() -> MusicSearchAPI:
+    """
+    进程内共享的MusicSearchAPI实例，避免UI和测试重复加载特征库和CLAMP3模型
+    
+    需要独立实例时可先调用 get_music_search_api.cache_clear()
+    """
+    return MusicSearchAPI()
+
 def main():
     """命令行接口"""
     parser = argparse.ArgumentParser(description="音乐检索API命令行工具")
@@ -236,12 +352,13 @@ def main():
     parser.add_argument("--top-k", "-k", type=int, default=3, help="返回结果数量")
     parser.add_argument("--full-audio", action="store_true", help="使用完整音频（默认使用前25%）")
     parser.add_argument("--stats", action="store_true", help="显示特征库统计信息")
+    parser.add_argument("--int8", action="store_true", help="使用int8量化特征检索（默认FP32）")
     parser.add_argument("--output", "-o", type=str, help="输出结果到JSON文件")
     
     args = parser.parse_args()
     
     # 初始化API
-    api = MusicSearchAPI()
+    api = MusicSearchAPI(use_int8=args.int8)
     
     # 显示统计信息
     if args.stats:
@@ -5,7 +5,7 @@
 
 import os
 import sys
-from music_search_api import MusicSearchAPI
+from music_search_api import get_music_search_api
 
 def demo_search_by_video():
     """演示通过视频文件搜索音乐"""
@@ -13,7 +13,7 @@ def demo_search_by_video():
     print("="*50)
     
     # 初始化API
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     # 示例1: 使用1分钟视频在3分钟版本中搜索
     print("\n📺 示例1: 跨时长版本搜索")
@@ -97,7 +97,7 @@ def interactive_demo():
     print("\n🎮 交互式音乐搜索")
     print("="*50)
     
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     # 列出可用的测试文件
     test_files_1min = [
@@ -9,7 +9,6 @@ import sys
 import numpy as np
 import json
 import time
-import glob
 import subprocess
 import shutil
 import logging
@@ -17,19 +16,52 @@ from typing import List, Tuple, Dict, Optional
 from pathlib import Path
 import tempfile
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
+from text_embed_cache import get_default_cache
+
+# 合并特征矩阵的读写与 clamp3 的特征提取脚本共用一份实现
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'clamp3'))
+from feature_matrix import build_feature_matrix, load_feature_matrix
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# 设置日志 (默认只输出警告及以上，调试时可设置 MI_LOG_LEVEL=INFO)
+LOG_LEVEL = os.getenv("MI_LOG_LEVEL", "WARNING").upper()
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    对称逐向量int8量化：scale = max(|v|) / 127，q = round(v / scale)
+    
+    Args:
+        vectors: (D,) 或 (N, D) 特征
+        
+    Returns:
+        (int8量化值, float32缩放系数)，v ≈ q * scale；全零向量的scale为1
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales).astype(np.int8)
+    return quantized, scales[..., 0]
+
 class MusicSearchSystem:
     """音乐检索系统核心类"""
     
-    def __init__(self, features_base_dir: str = None):
+    # 特征库规模达到该值且安装了FAISS时，改用HNSW近似检索；小库直接精确矩阵乘
+    FAISS_MIN_LIBRARY_SIZE = 1000
+    HNSW_NEIGHBORS = 32
+    
+    def __init__(self, features_base_dir: str = None, use_int8: bool = False):
         """
         初始化音乐检索系统
         
         Args:
             features_base_dir: 特征文件基础目录
+            use_int8: 是否以int8量化特征检索 (特征库内存为FP32的1/4，相似度有微小误差)
         """
         if features_base_dir is None:
             features_base_dir = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/music_features"
@@ -37,12 +69,25 @@ class MusicSearchSystem:
         self.features_base_dir = features_base_dir
         self.supported_durations = ["1min", "3min", "5min", "10min", "20min", "30min"]
         self.feature_cache = {}
+        self.use_int8 = use_int8
+        
+        # 检索索引：每个时长一份
+        # (视频名称列表, L2归一化特征矩阵, 零向量掩码, FAISS索引或None, (int8矩阵, 缩放系数)或None)
+        self.search_index = {}
+        
+        # CLAMP3文本特征持久化缓存，命中时无需加载文本编码模型
+        self.text_embed_cache = get_default_cache()
         
         # 加载所有特征文件
         self._load_features()
     
     def _load_features(self):
-        """加载所有可用的特征文件"""
+        """
+        加载所有可用的特征文件
+        
+        每个时长的特征合并为一个L2归一化矩阵文件并以内存映射方式打开，
+        由操作系统按需换入，特征目录未变化时不再逐个读取小文件
+        """
         print("🔄 加载音乐特征库...")
         
         for duration in self.supported_durations:
@@ -52,39 +97,122 @@ class MusicSearchSystem:
                 print(f"⚠️  {duration} 特征目录不存在: {features_dir}")
                 continue
             
-            # 加载该时长的所有特征
-            feature_files = glob.glob(os.path.join(features_dir, "*.npy"))
-            
-            if not feature_files:
-                print(f"⚠️  {duration} 目录中没有特征文件")
+            loaded = load_feature_matrix(self.features_base_dir, duration)
+            if loaded is None:
+                loaded = build_feature_matrix(self.features_base_dir, duration)
+            if loaded is None:
                 continue
             
-            duration_features = {}
-            for feature_file in feature_files:
-                try:
-                    # 从文件名提取视频名称
-                    video_name = os.path.splitext(os.path.basename(feature_file))[0]
-                    
-                    # 加载特征向量
-                    feature_vector = np.load(feature_file)
-                    
-                    # 确保特征向量是正确的维度 (1, 768)
-                    if feature_vector.shape != (1, 768):
-                        print(f"⚠️  {video_name} 特征维度异常: {feature_vector.shape}")
-                        continue
-                    
-                    duration_features[video_name] = feature_vector.flatten()  # 转为1D数组
-                    
-                except Exception as e:
-                    print(f"❌ 加载特征文件失败 {feature_file}: {e}")
-                    continue
-            
-            self.feature_cache[duration] = duration_features
-            print(f"✅ {duration}: 加载了 {len(duration_features)} 个特征文件")
+            video_names, matrix = loaded
+            # 每个视频的特征是矩阵行视图 (已归一化，余弦相似度不受影响)，不额外复制
+            self.feature_cache[duration] = dict(zip(video_names, matrix))
+            self._build_search_index(duration, video_names, matrix)
+            print(f"✅ {duration}: 加载了 {len(video_names)} 个特征文件")
         
         total_features = sum(len(features) for features in self.feature_cache.values())
         print(f"🎉 特征库加载完成，总计: {total_features} 个音乐特征")
     
+    def _build_search_index(self, duration: str, video_names: List[str], matrix: np.ndarray):
+        """
+        建立某时长的检索索引，余弦相似度即一次矩阵乘
+        
+        Args:
+            duration: 时长版本
+            video_names: 视频名称列表
+            matrix: (N, 768) L2归一化特征矩阵 (可为内存映射数组，暴力检索时直接按需读取)
+        """
+        if not video_names:
+            return
+        
+        zero_rows = ~np.any(matrix, axis=1)
+        
+        index = None
+        if faiss is not None and len(video_names) >= self.FAISS_MIN_LIBRARY_SIZE:
+            # FAISS需要连续内存，复制一次加入索引后即释放
+            index = faiss.IndexHNSWFlat(matrix.shape[1], self.HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            index.add(np.ascontiguousarray(matrix, dtype=np.float32))
+            if self.use_int8:
+                logger.warning("⚠️  %s 使用FAISS检索，int8量化不生效", duration)
+        
+        # int8量化只用于暴力检索，FAISS路径不需要
+        quantized = quantize_int8(matrix) if self.use_int8 and index is None else None
+        
+        self.search_index[duration] = (video_names, matrix, zero_rows, index, quantized)
+    
+    def _rank_by_similarity(self, query_features: np.ndarray, duration: str, top_k: int) -> List[Tuple[str, float]]:
+        """
+        在指定时长的特征库中检索与查询向量最相似的前top_k个音乐
+        
+        相似度与 _compute_cosine_similarity 一致：余弦相似度映射到[0,1]，零向量相似度为0
+        """
+        query = np.asarray(query_features, dtype=np.float32).reshape(1, -1)
+        return self._rank_batch_by_similarity(query, duration, top_k)[0]
+    
+    def _rank_batch_by_similarity(self, query_features: np.ndarray, duration: str,
+                                  top_k: int) -> List[List[Tuple[str, float]]]:
+        """
+        批量检索：B个查询向量与特征库只做一次 (B, D) x (D, M) 矩阵乘
+        
+        Args:
+            query_features: (B, D) 查询特征
+            duration: 搜索版本
+            top_k: 每个查询返回的结果数量
+            
+        Returns:
+            每个查询的 [(视频名称, 相似度分数), ...] 列表，按相似度降序排列
+        """
+        video_names, matrix, zero_rows, index, quantized = self.search_index[duration]
+        queries = np.asarray(query_features, dtype=np.float32).reshape(-1, matrix.shape[1])
+        top_k = min(top_k, len(video_names))
+        if top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        
+        query_norms = np.linalg.norm(queries, axis=1)
+        zero_queries = query_norms == 0
+        queries = queries / np.where(zero_queries, 1.0, query_norms)[:, None]
+        
+        if index is not None:
+            cosines, indices = index.search(queries, top_k)
+            results = []
+            for row_indices, row_scores, zero_query in zip(indices, (cosines + 1) / 2, zero_queries):
+                if zero_query:
+                    results.append([(name, 0.0) for name in video_names[:top_k]])
+                    continue
+                keep = row_indices >= 0
+                row_indices, row_scores = row_indices[keep], row_scores[keep]
+                # 与暴力检索一致：零向量特征相似度为0，重新按相似度降序 (同分保持特征库顺序)
+                row_scores[zero_rows[row_indices]] = 0.0
+                order = np.lexsort((row_indices, -row_scores))
+                results.append([(video_names[i], float(row_scores[j])) for j, i in zip(order, row_indices[order])])
+            return results
+        
+        if quantized is not None:
+            # int8点积累加到int32，再乘以两侧缩放系数还原余弦相似度
+            q_db, scales_db = quantized
+            q_queries, scales_query = quantize_int8(queries)
+            cosines = (q_queries.astype(np.int32) @ q_db.astype(np.int32).T).astype(np.float32)
+            cosines *= scales_query[:, None] * scales_db[None, :]
+        else:
+            cosines = queries @ matrix.T
+        
+        scores = (cosines + 1) / 2
+        scores[:, zero_rows] = 0.0
+        
+        # 逐行部分排序取前top_k，再按相似度降序 (同分保持特征库顺序)
+        if top_k < scores.shape[1]:
+            top_indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            top_indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        
+        results = []
+        for row_scores, row_indices, zero_query in zip(scores, top_indices, zero_queries):
+            if zero_query:
+                results.append([(name, 0.0) for name in video_names[:top_k]])
+                continue
+            row_indices = row_indices[np.lexsort((row_indices, -row_scores[row_indices]))]
+            results.append([(video_names[i], float(row_scores[i])) for i in row_indices])
+        return results
+    
     def extract_target_features(self, audio_path: str, use_partial: bool = True) -> np.ndarray:
         """
         提取目标音乐的特征
@@ -226,18 +354,8 @@ class MusicSearchSystem:
         
         print(f"🔍 在 {duration} 版本中搜索相似音乐...")
         
-        # 计算与所有音乐的相似度
-        similarities = []
-        
-        for video_name, reference_features in duration_features.items():
-            similarity = self.calculate_similarity(target_features, reference_features)
-            similarities.append((video_name, similarity))
-        
-        # 按相似度降序排序
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        
-        # 返回前top_k个结果
-        return similarities[:top_k]
+        # 一次矩阵乘计算与所有音乐的相似度，返回前top_k个结果
+        return self._rank_by_similarity(target_features, duration, top_k)
     
     def search_music_by_file(self, audio_path: str, duration: str, top_k: int = 3, use_partial: bool = True) -> List[Tuple[str, float]]:
         """
@@ -316,8 +434,23 @@ class MusicSearchSystem:
         
         return stats
     
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        批量提取文本的CLAMP3特征，未缓存的文本合并为一次批量前向计算
+        
+        Args:
+            texts: 文本列表
+            
+        Returns:
+            (len(texts), 768) 特征矩阵
+        """
+        return self.text_embed_cache.get_or_compute_many(
+            texts,
+            lambda missing: self._get_text_extractor().batch_extract_text_features(missing)
+        )
+    
     def search_music_by_text(self, text_description: str, duration: str = "3min", 
-                           top_k: int = 5) -> List[Tuple[str, float]]:
+                           top_k: int = 5, text_features: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
         """
         通过文本描述搜索相似音乐 (语义检索)
         
@@ -325,42 +458,37 @@ class MusicSearchSystem:
             text_description: 文本描述
             duration: 搜索版本
             top_k: 返回结果数量
+            text_features: 可选的预先计算好的文本特征，提供时跳过文本编码
             
         Returns:
             [(视频名称, 相似度分数), ...] 列表，按相似度降序排列
         """
         if duration not in self.feature_cache:
-            logger.warning(f"⚠️  不支持的时长版本: {duration}")
+            logger.warning("⚠️  不支持的时长版本: %s", duration)
             return []
         
         if not self.feature_cache[duration]:
-            logger.warning(f"⚠️  {duration} 版本没有特征数据")
+            logger.warning("⚠️  %s 版本没有特征数据", duration)
             return []
         
         try:
             # 尝试使用CLAMP3语义提取器，失败则使用简化版
             try:
-                from semantic_text_extractor import SemanticTextExtractor
-                
-                # 初始化文本特征提取器
-                if not hasattr(self, 'text_extractor'):
-                    logger.info("🔄 初始化CLAMP3文本特征提取器...")
-                    self.text_extractor = SemanticTextExtractor()
+                # 提取文本特征 (优先使用预计算特征，其次读取缓存)
+                if text_features is None:
+                    logger.info("🔄 提取文本特征: %s", text_description)
+                    text_features = self.text_embed_cache.get_or_compute(
+                        text_description,
+                        lambda text: self._get_text_extractor().extract_single_text_feature(text)
+                    )
                 
-                # 提取文本特征
-                logger.info(f"🔄 提取文本特征: {text_description}")
-                text_features = self.text_extractor.extract_single_text_feature(text_description)
-                
-                # 计算与所有音乐的相似度
-                similarities = []
-                for video_name, audio_features in self.feature_cache[duration].items():
-                    similarity = self._compute_cosine_similarity(text_features, audio_features)
-                    similarities.append((video_name, similarity))
+                # 一次矩阵乘计算与所有音乐的相似度 (已排序的前top_k个)
+                similarities = self._rank_by_similarity(text_features, duration, top_k)
                 
                 logger.info("✅ 使用CLAMP3语义检索")
                 
             except Exception as clamp_error:
-                logger.warning(f"⚠️  CLAMP3检索失败: {clamp_error}")
+                logger.warning("⚠️  CLAMP3检索失败: %s", clamp_error)
                 logger.info("🔄 切换到简化版语义检索...")
                 
                 # 使用简化版语义检索
@@ -369,12 +497,10 @@ class MusicSearchSystem:
                 if not hasattr(self, 'simple_searcher'):
                     self.simple_searcher = SimpleSemanticSearcher()
                 
-                # 计算与所有音乐的相似度
-                similarities = []
-                for video_name, audio_features in self.feature_cache[duration].items():
-                    similarity = self.simple_searcher.compute_text_audio_similarity(
-                        text_description, audio_features)
-                    similarities.append((video_name, similarity))
+                # 一次矩阵乘计算与所有音乐的相似度 (特征库已归一化)
+                video_names, matrix = self.search_index[duration][:2]
+                scores = self.simple_searcher.compute_text_audio_similarities(text_description, matrix)
+                similarities = [(video_name, float(score)) for video_name, score in zip(video_names, scores)]
                 
                 logger.info("✅ 使用简化版语义检索")
             
@@ -384,15 +510,55 @@ class MusicSearchSystem:
             # 返回前top_k个结果
             results = similarities[:top_k]
             
-            logger.info(f"✅ 文本检索完成，返回 {len(results)} 个结果")
+            logger.info("✅ 文本检索完成，返回 %d 个结果", len(results))
             for video_name, similarity in results:
-                logger.info(f"   {video_name}: {similarity:.4f}")
+                logger.info("   %s: %.4f", video_name, similarity)
             
             return results
             
         except Exception as e:
-            logger.error(f"❌ 文本检索失败: {e}")
+            logger.error("❌ 文本检索失败: %s", e)
+            return []
+    
+    def search_music_by_texts(self, text_descriptions: List[str], duration: str = "3min",
+                              top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        """
+        批量语义检索：所有描述一次批量编码 (未缓存部分)，再一次矩阵乘完成检索
+        
+        Args:
+            text_descriptions: 文本描述列表
+            duration: 搜索版本
+            top_k: 每个描述返回的结果数量
+            
+        Returns:
+            与 text_descriptions 一一对应的 [(视频名称, 相似度分数), ...] 列表
+        """
+        if duration not in self.feature_cache or not self.feature_cache[duration]:
+            logger.warning("⚠️  %s 版本没有特征数据", duration)
+            return [[] for _ in text_descriptions]
+        
+        if not text_descriptions:
             return []
+        
+        try:
+            text_features = self.encode_texts(text_descriptions)
+            results = self._rank_batch_by_similarity(text_features, duration, top_k)
+            logger.info("✅ 批量文本检索完成: %d 个描述", len(text_descriptions))
+            return results
+        except Exception as e:
+            # 批量编码失败时逐条检索，由 search_music_by_text 负责降级到简化版语义检索
+            logger.warning("⚠️  批量CLAMP3检索失败: %s，逐条检索", e)
+            return [self.search_music_by_text(text, duration, top_k) for text in text_descriptions]
+    
+    def _get_text_extractor(self):
+        """按需初始化CLAMP3文本特征提取器"""
+        if not hasattr(self, 'text_extractor'):
+            from semantic_text_extractor import SemanticTextExtractor
+            
+            logger.info("🔄 初始化CLAMP3文本特征提取器...")
+            self.text_extractor = SemanticTextExtractor()
+        
+        return self.text_extractor
     
     def _compute_cosine_similarity(self, features1: np.ndarray, features2: np.ndarray) -> float:
         """
@@ -428,7 +594,7 @@ class MusicSearchSystem:
             return float(similarity)
             
         except Exception as e:
-            logger.error(f"❌ 相似度计算失败: {e}")
+            logger.error("❌ 相似度计算失败: %s", e)
             return 0.0
 
 def main():
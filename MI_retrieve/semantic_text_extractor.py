@@ -17,31 +17,58 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'code'))
 from code.utils import CLaMP3Model
 from code.config import *
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ONNX文本塔文件 (由 export_clamp3_text_onnx.py 导出)
+DEFAULT_ONNX_PATH = os.path.join(os.path.dirname(__file__), 'code', 'clamp3_text.onnx')
+
+# 推理后端: torch | ort | auto (ONNX文件存在且安装了onnxruntime时使用ort)
+CLAMP3_BACKEND = os.getenv("CLAMP3_BACKEND", "auto")
+
 class SemanticTextExtractor:
     """CLAMP3语义文本特征提取器"""
     
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, backend: str = None, onnx_path: str = None):
         """
         初始化文本特征提取器
         
         Args:
             model_path: CLAMP3模型权重路径
+            backend: 推理后端 (torch/ort/auto)，默认读取环境变量 CLAMP3_BACKEND
+            onnx_path: ONNX文本塔路径，默认为 code/clamp3_text.onnx
         """
         if model_path is None:
             model_path = os.path.join(os.path.dirname(__file__), 'code', 
                                     'weights_clamp3_saas_h_size_768_t_model_FacebookAI_xlm-roberta-base_t_length_128_a_size_768_a_layers_12_a_length_128_s_size_768_s_layers_12_p_size_64_p_length_512.pth')
         
         self.model_path = model_path
+        self.onnx_path = onnx_path or DEFAULT_ONNX_PATH
+        self.backend = self._select_backend(backend or CLAMP3_BACKEND)
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model = None
+        self.session = None
         self.tokenizer = None
         
         # 初始化模型
         self._initialize_model()
     
+    def _select_backend(self, backend: str) -> str:
+        """确定实际使用的推理后端"""
+        if backend == "torch":
+            return "torch"
+        
+        available = ort is not None and os.path.exists(self.onnx_path)
+        if backend == "ort" and not available:
+            raise RuntimeError(f"ONNX后端不可用: 需要安装onnxruntime并导出 {self.onnx_path}")
+        
+        return "ort" if available else "torch"
+    
     def _initialize_model(self):
         """初始化CLAMP3模型和tokenizer"""
         try:
@@ -51,6 +78,16 @@ class SemanticTextExtractor:
             self.tokenizer = AutoTokenizer.from_pretrained(TEXT_MODEL)
             logger.info(f"✅ 加载tokenizer: {TEXT_MODEL}")
             
+            if self.backend == "ort":
+                # ONNX Runtime: 开启全部图优化 (融合注意力/LayerNorm)，算子内线程数等于核数
+                sess_options = ort.SessionOptions()
+                sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                sess_options.intra_op_num_threads = os.cpu_count() or 1
+                self.session = ort.InferenceSession(self.onnx_path, sess_options=sess_options,
+                                                    providers=['CPUExecutionProvider'])
+                logger.info(f"✅ CLAMP3文本塔初始化完成 (ONNX Runtime: {self.onnx_path})")
+                return
+            
             # 初始化CLAMP3模型
             self.model = CLaMP3Model()
             
@@ -85,7 +122,7 @@ class SemanticTextExtractor:
         Returns:
             形状为 (batch_size, 768) 的特征向量
         """
-        if self.model is None or self.tokenizer is None:
+        if (self.model is None and self.session is None) or self.tokenizer is None:
             raise RuntimeError("模型未初始化")
         
         # 处理输入
@@ -95,6 +132,22 @@ class SemanticTextExtractor:
         try:
             logger.info(f"🔄 提取文本特征，输入数量: {len(text)}")
             
+            if self.session is not None:
+                encoded = self.tokenizer(
+                    text,
+                    max_length=max_length,
+                    padding=True,
+                    truncation=True,
+                    return_tensors='np'
+                )
+                features = self.session.run(None, {
+                    'input_ids': encoded['input_ids'].astype(np.int64),
+                    'attention_mask': encoded['attention_mask'].astype(np.int64)
+                })[0]
+                
+                logger.info(f"✅ 文本特征提取完成，特征形状: {features.shape}")
+                return features
+            
             # 文本tokenization
             encoded = self.tokenizer(
                 text,
@@ -124,6 +124,33 @@ class SimpleSemanticSearcher:
         
         return float(similarity)
     
+    def compute_text_audio_similarities(self, text: str, audio_matrix: np.ndarray) -> np.ndarray:
+        """
+        计算文本与一组音频特征的相似度 (文本向量只生成一次，余弦相似度为一次矩阵乘)
+        
+        Args:
+            text: 文本描述
+            audio_matrix: (N, D) 音频特征矩阵
+            
+        Returns:
+            (N,) 相似度分数 (0-1)，零向量对应0
+        """
+        audio_matrix = np.asarray(audio_matrix)
+        text_features = self.text_to_feature_vector(text, audio_matrix.shape[1])
+        
+        norm_text = np.linalg.norm(text_features)
+        norms_audio = np.linalg.norm(audio_matrix, axis=1)
+        if norm_text == 0:
+            return np.zeros(len(audio_matrix))
+        
+        similarities = (audio_matrix @ text_features) / (np.where(norms_audio == 0, 1.0, norms_audio) * norm_text)
+        
+        # 将相似度从 [-1, 1] 映射到 [0, 1]，并加上关键词加权
+        similarities = np.minimum(1.0, (similarities + 1) / 2 + self._get_keyword_bonus(text))
+        similarities[norms_audio == 0] = 0.0
+        
+        return similarities
+    
     def _get_keyword_bonus(self, text: str) -> float:
         """
         基于关键词匹配获得额外的相似度加分
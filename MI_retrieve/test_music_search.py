@@ -8,14 +8,14 @@ import sys
 import json
 import time
 import random
-from music_search_api import MusicSearchAPI
+from music_search_api import get_music_search_api
 
 def test_basic_search():
     """基础搜索测试"""
     print("🧪 基础搜索测试")
     print("="*50)
     
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     # 测试音频文件
     test_files = [
@@ -52,7 +52,7 @@ def test_partial_vs_full_audio():
     print("\n🧪 部分音频 vs 完整音频测试")
     print("="*50)
     
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     test_file = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/materials/retrieve_libraries/segments_3min/32_3min_01.mp4"
     
@@ -87,7 +87,7 @@ def test_cross_duration_search():
     print("\n🧪 跨时长版本搜索测试")
     print("="*50)
     
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     # 使用1分钟版本的音频在3分钟版本中搜索
     test_1min = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/MI_retrieve/materials/retrieve_libraries/segments_1min/32_1min_01.mp4"
@@ -115,7 +115,7 @@ def test_performance():
     print("\n🧪 性能测试")
     print("="*50)
     
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     # 随机选择几个测试文件
     test_files = [
@@ -163,7 +163,7 @@ def test_feature_library_stats():
     print("\n🧪 特征库统计信息测试")
     print("="*50)
     
-    api = MusicSearchAPI()
+    api = get_music_search_api()
     
     stats_result = api.get_feature_library_stats()
     
@@ -37,6 +37,16 @@ def test_ui_semantic_integration():
         "tempo 120 BPM活泼明快"
     ]
     
+    # 批量检索：所有描述一次编码、一次矩阵乘 (同时写入文本特征缓存，后续逐条检索直接命中)
+    print("\n📦 测试批量语义检索...")
+    batch_results = ui.music_api.search_by_descriptions(test_descriptions, "3min", 3)
+    for description, result in zip(test_descriptions, batch_results):
+        if result["success"]:
+            names = ", ".join(item["video_name"] for item in result["results"])
+            print(f"   {description} -> {names}")
+        else:
+            print(f"   ❌ {description}: {result['error']}")
+    
     for i, description in enumerate(test_descriptions, 1):
         print(f"\n--- 测试 {i}: {description} ---")
         
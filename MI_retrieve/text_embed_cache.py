@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+文本特征持久化缓存 - 基于SQLite，按规范化后的描述文本缓存CLAMP3文本特征
+
+相同描述 (包括预设的音乐类型描述和重复点击检索) 只需编码一次
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存文件位置及命名空间 (对应 semantic_text_extractor 默认加载的CLAMP3权重)
+DEFAULT_CACHE_PATH = Path(__file__).parent / "music_features" / "text_embeddings.sqlite"
+DEFAULT_NAMESPACE = "clamp3_saas_h768_xlm-roberta-base"
+
+class TextEmbeddingCache:
+    """文本特征缓存 (SQLite表: key TEXT PRIMARY KEY, vec BLOB)"""
+    
+    def __init__(self, db_path: Optional[str] = None, namespace: str = ""):
+        """
+        初始化缓存
+        
+        Args:
+            db_path: SQLite数据库路径，默认为 music_features/text_embeddings.sqlite
+            namespace: 缓存命名空间 (如模型标识)，更换模型后旧特征不会被误用
+        """
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        
+        db_path = Path(db_path) if db_path else DEFAULT_CACHE_PATH
+        try:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"⚠️  无法打开文本特征缓存 {db_path}: {e}，改用内存缓存")
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS text_embeddings (key TEXT PRIMARY KEY, vec BLOB)")
+    
+    def make_key(self, text: str) -> str:
+        """
+        生成缓存键：去除首尾空白并合并连续空白后取blake2b摘要
+        
+        不转换大小写，xlm-roberta分词区分大小写，不同大小写的文本特征不同
+        """
+        normalized = " ".join(text.split())
+        return hashlib.blake2b(f"{self.namespace}\x00{normalized}".encode("utf-8"), digest_size=16).hexdigest()
+    
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """读取缓存的特征向量，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT vec FROM text_embeddings WHERE key = ?", (self.make_key(text),)).fetchone()
+        return None if row is None else np.frombuffer(row[0], dtype=np.float32).copy()
+    
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """写入多条特征向量 (一次事务)"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        rows = [(self.make_key(text), vector.tobytes()) for text, vector in zip(texts, vectors)]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO text_embeddings (key, vec) VALUES (?, ?)", rows)
+    
+    def get_or_compute(self, text: str, encoder_fn: Callable[[str], np.ndarray]) -> np.ndarray:
+        """
+        获取文本特征，未命中时调用encoder_fn计算并写入缓存
+        
+        Args:
+            text: 描述文本
+            encoder_fn: 文本 -> 特征向量
+        
+        Returns:
+            float32特征向量
+        """
+        vector = self.get(text)
+        if vector is None:
+            vector = np.asarray(encoder_fn(text), dtype=np.float32).reshape(-1)
+            self.put_many([text], vector[None, :])
+        return vector
+    
+    def get_or_compute_many(self, texts: List[str],
+                            batch_encoder_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        批量获取文本特征，所有未命中的文本合并为一次batch_encoder_fn调用
+        
+        Args:
+            texts: 描述文本列表
+            batch_encoder_fn: 文本列表 -> (M, D) 特征矩阵
+        
+        Returns:
+            (len(texts), D) float32特征矩阵
+        """
+        cached = [self.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        
+        if missing:
+            computed = np.asarray(batch_encoder_fn(missing), dtype=np.float32).reshape(len(missing), -1)
+            self.put_many(missing, computed)
+            computed_by_text = dict(zip(missing, computed))
+            cached = [computed_by_text[text] if vector is None else vector for text, vector in zip(texts, cached)]
+        
+        return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache() -> TextEmbeddingCache:
+    """进程内共享的默认缓存"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TextEmbeddingCache(namespace=DEFAULT_NAMESPACE)
+        return _default_cache
+
+def get_or_compute(text: str, encoder_fn: Callable[[str], np.ndarray]) -> np.ndarray:
+    """使用默认缓存获取文本特征"""
+    return get_default_cache().get_or_compute(text, encoder_fn)
@@ -4,8 +4,10 @@
 将7小时视频切分成完整的素材库，包含所有时长的所有片段
 """
 
+import os
 import sys
 import time
+import asyncio
 import logging
 from pathlib import Path
 from datetime import datetime
@@ -116,11 +118,11 @@ def build_full_material_library():
     print(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
-        # 切分所有片段（非intro模式）
-        segments = processor.segment_videos(
+        # 并发切分所有片段（非intro模式）
+        segments = asyncio.run(processor.segment_videos_async(
             extract_intro_only=False, 
             force_resegment=False
-        )
+        ))
         
         # 统计结果
         final_total = sum(len(seg_list) for seg_list in segments.values())
@@ -173,16 +175,20 @@ def show_current_status():
     total_segments = 0
     total_size = 0
     
-    for duration_dir in segments_dir.iterdir():
-        if duration_dir.is_dir():
-            video_files = list(duration_dir.glob("*.mp4"))
-            count = len(video_files)
-            total_segments += count
-            
-            size_mb = sum(f.stat().st_size for f in video_files) / (1024**2)
-            total_size += size_mb
-            
-            print(f"   {duration_dir.name}: {count:3d} 个片段 ({size_mb:6.1f} MB)")
+    # os.scandir的DirEntry自带文件类型且缓存stat结果，每个文件只需一次系统调用
+    with os.scandir(segments_dir) as duration_dirs:
+        duration_dirs = [entry for entry in duration_dirs if entry.is_dir(follow_symlinks=False)]
+    
+    for duration_dir in duration_dirs:
+        with os.scandir(duration_dir.path) as it:
+            video_files = [entry for entry in it if entry.name.endswith('.mp4')]
+        count = len(video_files)
+        total_segments += count
+        
+        size_mb = sum(entry.stat().st_size for entry in video_files) / (1024**2)
+        total_size += size_mb
+        
+        print(f"   {duration_dir.name}: {count:3d} 个片段 ({size_mb:6.1f} MB)")
     
     print(f"\n总计: {total_segments} 个片段")
     print(f"存储: {total_size:.1f} MB ({total_size/1024:.1f} GB)")
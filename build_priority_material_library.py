@@ -4,12 +4,15 @@
 优先构建关键时长的素材库，为MVP测试提供足够的素材
 """
 
+import os
 import sys
 import time
 import logging
 from pathlib import Path
 from datetime import datetime
 
+import numpy as np
+
 # 添加项目根目录到路径
 sys.path.append(str(Path(__file__).parent))
 
@@ -22,6 +25,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def scan_mp4(path):
+    """
+    一次scandir同时统计目录下mp4文件数和总字节数，目录不存在时返回 (0, 0)
+    
+    POSIX上 DirEntry.stat() 仍是一次真实的stat系统调用 (只有Windows由目录列举结果缓存)，
+    因此每个目录只扫描一次，每个mp4文件只stat一次
+    """
+    if not os.path.isdir(path):
+        return 0, 0
+    count = 0
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.mp4'):
+                count += 1
+                size += entry.stat().st_size
+    return count, size
+
 def build_priority_material_library():
     """构建优先级素材库 - 专注于5分钟和10分钟片段"""
     print("🎯 构建优先级疗愈视频素材库")
@@ -46,20 +67,23 @@ def build_priority_material_library():
         print("❌ 未找到源视频文件")
         return False
     
+    # 一次性计算每个视频在各时长下的片段数 (行: 视频, 列: 时长)
+    all_durations = [1, 3, 5, 10, 20, 30]
+    dur = np.fromiter((video['duration'] for video in videos), dtype=np.float64, count=len(videos))
+    per_video_segments = (dur[:, None] // (np.array(all_durations, dtype=np.float64) * 60)).astype(np.int64)
+    counts = dict(zip(all_durations, per_video_segments.sum(axis=0).tolist()))
+    
     # 显示视频信息和优先级片段计算
     print("📊 视频信息及优先级片段:")
     priority_durations = [5, 10]  # 专注于5分钟和10分钟
-    total_priority_segments = 0
+    priority_columns = [all_durations.index(d) for d in priority_durations]
+    total_priority_segments = sum(counts[d] for d in priority_durations)
     
-    for video in videos:
-        duration_hours = video['duration'] / 3600
+    for video, video_duration, video_segments in zip(videos, dur, per_video_segments[:, priority_columns].tolist()):
         print(f"   📹 {video['file_name']}")
-        print(f"      时长: {duration_hours:.1f}小时")
+        print(f"      时长: {video_duration / 3600:.1f}小时")
         
-        for duration_min in priority_durations:
-            duration_sec = duration_min * 60
-            num_segments = int(video['duration'] // duration_sec)
-            total_priority_segments += num_segments
+        for duration_min, num_segments in zip(priority_durations, video_segments):
             print(f"      {duration_min}分钟: {num_segments}个片段")
     
     print(f"\n🎯 优先级片段总计: {total_priority_segments}个")
@@ -68,16 +92,16 @@ def build_priority_material_library():
     
     # 检查当前5分钟和10分钟片段
     segments_dir = Path("materials/segments")
-    current_5min = len(list((segments_dir / "5min").glob("*.mp4"))) if (segments_dir / "5min").exists() else 0
-    current_10min = len(list((segments_dir / "10min").glob("*.mp4"))) if (segments_dir / "10min").exists() else 0
+    current_5min, current_5min_size = scan_mp4(segments_dir / "5min")
+    current_10min, current_10min_size = scan_mp4(segments_dir / "10min")
     
     print(f"\n📈 当前状态:")
     print(f"   5分钟片段: {current_5min}个")
     print(f"   10分钟片段: {current_10min}个")
     
     # 计算需要生成的片段
-    target_5min = sum(int(video['duration'] // 300) for video in videos)  # 5分钟 = 300秒
-    target_10min = sum(int(video['duration'] // 600) for video in videos)  # 10分钟 = 600秒
+    target_5min = counts[5]
+    target_10min = counts[10]
     
     needed_5min = max(0, target_5min - current_5min)
     needed_10min = max(0, target_10min - current_10min)
@@ -94,18 +118,20 @@ def build_priority_material_library():
     print(f"\n🔪 开始构建优先级素材库...")
     
     try:
-        # 创建自定义视频处理器，只处理5分钟和10分钟
-        custom_processor = VideoProcessor(durations=[5, 10])
+        # 创建自定义视频处理器，只处理仍有缺口的时长
+        durations_to_build = [d for d, needed in [(5, needed_5min), (10, needed_10min)] if needed > 0]
+        custom_processor = VideoProcessor(durations=durations_to_build)
         
         # 切分关键时长片段
         segments = custom_processor.segment_videos(
             extract_intro_only=False, 
-            force_resegment=False
+            force_resegment=False,
+            skip_existing=True
         )
         
-        # 统计结果
-        final_5min = len(segments.get('5min', []))
-        final_10min = len(segments.get('10min', []))
+        # 统计结果 (未重新处理的时长沿用当前数量)
+        final_5min = len(segments['5min']) if '5min' in segments else current_5min
+        final_10min = len(segments['10min']) if '10min' in segments else current_10min
         total_generated = final_5min + final_10min
         
         print(f"\n✅ 优先级素材库构建完成！")
@@ -114,12 +140,12 @@ def build_priority_material_library():
         print(f"   总计: {total_generated}个")
         
         # 显示存储使用情况
+        # 片段信息自带文件大小，未重新处理的时长沿用切分前扫描得到的大小，不再扫描目录
         summary = custom_processor.get_processing_summary()
-        priority_size = 0
-        if (segments_dir / "5min").exists():
-            priority_size += sum(f.stat().st_size for f in (segments_dir / "5min").glob("*.mp4"))
-        if (segments_dir / "10min").exists():
-            priority_size += sum(f.stat().st_size for f in (segments_dir / "10min").glob("*.mp4"))
+        priority_size = sum(
+            sum(segment['file_size'] for segment in segments[key]) if key in segments else current_size
+            for key, current_size in [('5min', current_5min_size), ('10min', current_10min_size)]
+        )
         
         priority_size_mb = priority_size / (1024**2)
         print(f"\n💾 优先级素材存储: {priority_size_mb:.1f} MB ({priority_size_mb/1024:.1f} GB)")
@@ -194,16 +220,17 @@ def main():
         total_segments = 0
         total_size = 0
         
-        for duration_dir in segments_dir.iterdir():
-            if duration_dir.is_dir():
-                video_files = list(duration_dir.glob("*.mp4"))
-                count = len(video_files)
-                total_segments += count
-                
-                size_mb = sum(f.stat().st_size for f in video_files) / (1024**2)
-                total_size += size_mb
-                
-                print(f"   {duration_dir.name}: {count:3d} 个片段 ({size_mb:6.1f} MB)")
+        with os.scandir(segments_dir) as duration_dirs:
+            duration_dirs = [entry for entry in duration_dirs if entry.is_dir()]
+        
+        for duration_dir in duration_dirs:
+            count, size = scan_mp4(duration_dir.path)
+            total_segments += count
+            
+            size_mb = size / (1024**2)
+            total_size += size_mb
+            
+            print(f"   {duration_dir.name}: {count:3d} 个片段 ({size_mb:6.1f} MB)")
         
         print(f"\n总计: {total_segments} 个片段")
         print(f"存储: {total_size:.1f} MB ({total_size/1024:.1f} GB)")
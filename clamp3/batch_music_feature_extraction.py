@@ -11,9 +11,83 @@ import time
 import shutil
 from pathlib import Path
 import glob
+import json
+import atexit
+import struct
+import tempfile
+import sqlite3
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# 常驻CLAMP3特征提取进程 (见 _get_clamp3_server)
+CLAMP3_PROC = None
+
+# 设置 CLAMP3_FFMPEG_DEBUG=1 时捕获ffmpeg的stderr并在失败时打印，便于排查
+FFMPEG_DEBUG = os.getenv("CLAMP3_FFMPEG_DEBUG") == "1"
+
+# MERT音频编码器的输入采样率 (preprocessing/audio/extract_mert.py 中的 target_sr，单声道)
+CLAMP3_SAMPLE_RATE = 24000
+
+# 每次CLAMP3调用处理的音频数：常驻进程只加载一次模型，批次越小与ffmpeg重叠越充分，越大每批固定开销占比越低
+CLAMP3_CHUNK_SIZE = int(os.getenv("CLAMP3_CHUNK_SIZE", "64"))
+
+# 特征清单文件名 (位于各 features_{时长} 目录下，见 FeatureManifest)
+MANIFEST_NAME = ".manifest.sqlite"
+
+# 音频临时目录根路径：优先使用内存文件系统，WAV不落盘 (可用 CLAMP3_AUDIO_TEMP_ROOT 覆盖)
+AUDIO_TEMP_ROOT = os.getenv("CLAMP3_AUDIO_TEMP_ROOT") or ("/dev/shm" if os.access("/dev/shm", os.W_OK) else None)
+
+def _iter_atoms(f, start, end):
+    """遍历 [start, end) 范围内的mp4 atom，产出 (类型, 数据起始偏移, atom结束偏移)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, atom_type = struct.unpack(">I4s", header)
+        data_start = offset + 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            data_start += 8
+        elif size == 0:
+            size = end - offset
+        if size < data_start - offset:
+            return
+        yield atom_type, data_start, offset + size
+        offset += size
+
+def _read_mp4_duration(video_path):
+    """从 moov/mvhd atom 读取时长 (ISO/IEC 14496-12)，解析失败返回None"""
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        for atom_type, moov_start, moov_end in _iter_atoms(f, 0, file_size):
+            if atom_type != b'moov':
+                continue
+            for child_type, data_start, _ in _iter_atoms(f, moov_start, moov_end):
+                if child_type != b'mvhd':
+                    continue
+                f.seek(data_start)
+                version = f.read(4)[0]
+                if version == 1:
+                    timescale, duration = struct.unpack(">16xIQ", f.read(28))
+                else:
+                    timescale, duration = struct.unpack(">8xII", f.read(16))
+                return duration / timescale if timescale else None
+    return None
 
 def get_video_duration(video_path):
-    """获取视频时长"""
+    """获取视频时长 (优先直接读取mp4头部，失败时回退ffprobe)"""
+    try:
+        duration = _read_mp4_duration(video_path)
+        if duration:
+            return duration
+    except (OSError, struct.error, IndexError):
+        pass
+    
     try:
         result = subprocess.run([
             'ffprobe', '-v', 'quiet', '-show_entries', 
@@ -24,18 +98,351 @@ def get_video_duration(video_path):
         return 0
 
 def extract_audio_from_video(video_path, audio_path):
-    """从视频中提取音频"""
+    """从视频中提取音频 (直接输出MERT所需的单声道采样率)"""
     try:
         cmd = [
-            'ffmpeg', '-i', video_path, '-q:a', '0', '-map', 'a', 
+            'ffmpeg', '-i', video_path, '-vn', '-map', 'a', 
+            '-ac', '1', '-ar', str(CLAMP3_SAMPLE_RATE), '-f', 'wav',
             '-y', audio_path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        if FFMPEG_DEBUG:
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"ffmpeg错误 {video_path}: {result.stderr[-1000:]}")
+        else:
+            # 只需要返回码：丢弃ffmpeg的大量stderr输出，不经过Python管道
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, check=False)
         return result.returncode == 0
     except Exception as e:
         print(f"音频提取失败 {video_path}: {e}")
         return False
 
+def decode_audio_from_video(video_path, threads=None):
+    """
+    把视频音轨解码为MERT所需的单声道PCM，经管道直接读入内存 (不落临时WAV)
+    
+    Args:
+        video_path: 视频路径
+        threads: ffmpeg解码线程数上限，多个ffmpeg并发时用于避免超额占用CPU
+    
+    Returns:
+        float32波形 (-1~1)，失败返回None
+    """
+    thread_args = ['-threads', str(threads)] if threads else []
+    cmd = [
+        'ffmpeg', *thread_args, '-i', video_path, '-vn', '-map', 'a',
+        '-ac', '1', '-ar', str(CLAMP3_SAMPLE_RATE), '-f', 's16le',
+        'pipe:1'
+    ]
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE if FFMPEG_DEBUG else subprocess.DEVNULL, check=False)
+    except Exception as e:
+        print(f"音频解码失败 {video_path}: {e}")
+        return None
+    
+    if result.returncode != 0 or not result.stdout:
+        if FFMPEG_DEBUG and result.stderr:
+            print(f"ffmpeg错误 {video_path}: {result.stderr[-1000:].decode(errors='replace')}")
+        return None
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) * (1 / 32768.)
+
+def make_audio_temp_dir(segment_type, default_parent):
+    """创建本次批量提取的音频临时目录 (AUDIO_TEMP_ROOT 不可用时放在 default_parent 下)"""
+    parent = AUDIO_TEMP_ROOT or default_parent
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"audio_temp_{segment_type}_", dir=parent)
+
+class FeatureManifest:
+    """
+    已提取特征清单 (features_dir/.manifest.sqlite)，记录提取时源视频的 mtime/size
+    
+    跳过判断只需查字典；源视频被替换后 mtime/size 变化，特征会被重新提取
+    """
+    
+    def __init__(self, features_dir):
+        path = os.path.join(features_dir, MANIFEST_NAME)
+        self.is_new = not os.path.exists(path)
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS manifest (base_name TEXT PRIMARY KEY, mtime REAL, size INTEGER)")
+        self.entries = {
+            base_name: (mtime, size)
+            for base_name, mtime, size in self._conn.execute("SELECT base_name, mtime, size FROM manifest")
+        }
+    
+    def is_current(self, base_name, video_stat):
+        """特征是否已按当前版本的视频提取"""
+        entry = self.entries.get(base_name)
+        return entry is not None and entry[0] >= video_stat.st_mtime and entry[1] == video_stat.st_size
+    
+    def record_many(self, items):
+        """登记 [(base_name, 视频os.stat结果), ...] (一次事务)"""
+        rows = [(base_name, stat.st_mtime, stat.st_size) for base_name, stat in items]
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO manifest (base_name, mtime, size) VALUES (?, ?, ?)", rows)
+        self.entries.update((base_name, (mtime, size)) for base_name, mtime, size in rows)
+    
+    def remove_many(self, base_names):
+        """删除 base_name 列表对应的记录 (一次事务)"""
+        with self._conn:
+            self._conn.executemany("DELETE FROM manifest WHERE base_name = ?", [(base_name,) for base_name in base_names])
+        for base_name in base_names:
+            self.entries.pop(base_name, None)
+    
+    def count(self):
+        """已登记的特征数"""
+        return len(self.entries)
+    
+    def close(self):
+        self._conn.close()
+
+def split_pending_videos(video_files, features_dir):
+    """
+    按清单区分已完成和待处理的视频
+    
+    首次建立清单时，features_dir 中已有的特征文件登记为对应当前版本的视频；
+    特征文件缺失或为空的记录会被删除，对应视频重新提取
+    
+    Returns:
+        (manifest, 已完成的base_name列表, 待处理的 [(video_path, os.stat结果), ...])
+    """
+    os.makedirs(features_dir, exist_ok=True)
+    manifest = FeatureManifest(features_dir)
+    video_stats = [
+        (video_path, os.path.splitext(os.path.basename(video_path))[0], os.stat(video_path))
+        for video_path in video_files
+    ]
+    
+    # 一次scandir列出已有的非空特征文件 (每个目录项一次stat)
+    with os.scandir(features_dir) as entries:
+        existing = {entry.name[:-4] for entry in entries if entry.name.endswith('.npy') and entry.stat().st_size > 0}
+    
+    if manifest.is_new:
+        manifest.record_many([(base_name, stat) for _, base_name, stat in video_stats if base_name in existing])
+    
+    missing = [base_name for base_name in manifest.entries if base_name not in existing]
+    if missing:
+        manifest.remove_many(missing)
+    
+    done = []
+    pending = []
+    for video_path, base_name, stat in video_stats:
+        if manifest.is_current(base_name, stat):
+            done.append(base_name)
+        else:
+            pending.append((video_path, stat))
+    
+    return manifest, done, pending
+
+def _process_one(video_path, audio_temp_dir):
+    """
+    阶段1：提取单个视频的音频到 audio_temp_dir/{base_name}.wav (在进程池中运行)
+    
+    Returns:
+        (base_name, ok, err)
+    """
+    video_name = os.path.basename(video_path)
+    base_name = os.path.splitext(video_name)[0]
+    
+    # 定义路径
+    audio_path = os.path.join(audio_temp_dir, f"{base_name}.wav")
+    
+    try:
+        # 1. 提取音频
+        if not extract_audio_from_video(video_path, audio_path):
+            # 失败的残留文件不能留在批量目录里被CLAMP3处理
+            Path(audio_path).unlink(missing_ok=True)
+            return base_name, False, "音频提取失败"
+        
+        # 2. 检查音频文件大小 (文件不存在按空文件处理)
+        try:
+            audio_size = os.path.getsize(audio_path)
+        except OSError:
+            audio_size = 0
+        if audio_size == 0:
+            Path(audio_path).unlink(missing_ok=True)
+            return base_name, False, "音频文件为空"
+        
+        return base_name, True, None
+        
+    except Exception as e:
+        Path(audio_path).unlink(missing_ok=True)
+        return base_name, False, f"处理异常: {e}"
+
+def _get_clamp3_server():
+    """获取常驻的 clamp3_embd.py --server 进程 (首次调用时启动)"""
+    global CLAMP3_PROC
+    if CLAMP3_PROC is None or CLAMP3_PROC.poll() is not None:
+        # 每个服务进程使用独立的中间目录，多个时长并行提取时互不覆盖
+        env = dict(os.environ, CLAMP3_TEMP_DIR=f"temp_{os.getpid()}")
+        CLAMP3_PROC = subprocess.Popen(
+            ['python', 'clamp3_embd.py', '--server'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=os.getcwd(), env=env
+        )
+        atexit.register(stop_clamp3_server)
+    return CLAMP3_PROC
+
+def stop_clamp3_server():
+    """关闭常驻CLAMP3进程 (关闭stdin后服务循环自行退出)"""
+    global CLAMP3_PROC
+    if CLAMP3_PROC is not None and CLAMP3_PROC.poll() is None:
+        CLAMP3_PROC.stdin.close()
+        CLAMP3_PROC.wait()
+    CLAMP3_PROC = None
+
+def run_clamp3_batch(audio_dir, output_dir):
+    """
+    阶段2：通过常驻CLAMP3进程对整个音频目录提取特征 (进程内只加载一次MERT和CLAMP3模型)
+    
+    Returns:
+        (ok, err)
+    """
+    try:
+        proc = _get_clamp3_server()
+        proc.stdin.write(json.dumps([audio_dir, output_dir, True]) + "\n")
+        proc.stdin.flush()
+        reply = proc.stdout.readline().strip()
+    except (OSError, ValueError) as e:
+        return False, f"CLAMP3进程通信失败: {e}"
+    
+    if reply == "OK":
+        return True, None
+    return False, reply or "CLAMP3进程意外退出"
+
+def _seal_chunk(audio_temp_dir, chunk_index, base_names):
+    """把已提取的一组音频移入独立的批次目录，返回 (批次目录, base_name列表)"""
+    chunk_dir = os.path.join(audio_temp_dir, f"chunk_{chunk_index:03d}")
+    os.makedirs(chunk_dir, exist_ok=True)
+    for base_name in base_names:
+        os.replace(os.path.join(audio_temp_dir, f"{base_name}.wav"), os.path.join(chunk_dir, f"{base_name}.wav"))
+    return chunk_dir, base_names
+
+def _extract_chunk_features(chunk_dir, base_names, features_dir, manifest, video_stats):
+    """
+    对一个批次目录调用一次CLAMP3，特征移动到 features_dir 并登记到清单
+    
+    Returns:
+        (processed_count, failed_count)
+    """
+    # clamp3_embd.py 在输出目录已存在时会跳过提取，因此使用新的批量输出目录
+    # 批量输出目录与 features_dir 在同一文件系统，每个特征只需一次rename即可就位，无需复制数据
+    batch_features_dir = os.path.join(os.path.dirname(os.path.abspath(features_dir)),
+                                      f".{os.path.basename(os.path.dirname(chunk_dir))}_{os.path.basename(chunk_dir)}_features")
+    shutil.rmtree(batch_features_dir, ignore_errors=True)
+    
+    print(f"🔄 CLAMP3批量提取特征: {len(base_names)} 个音频")
+    ok, err = run_clamp3_batch(chunk_dir, batch_features_dir)
+    
+    failed_count = 0
+    extracted = []
+    for base_name in base_names:
+        batch_feature_file = os.path.join(batch_features_dir, f"{base_name}.npy")
+        try:
+            os.replace(batch_feature_file, os.path.join(features_dir, f"{base_name}.npy"))
+        except FileNotFoundError:
+            failed_count += 1
+            print(f"    ❌ 特征文件未生成: {base_name}")
+        else:
+            extracted.append((base_name, video_stats[base_name]))
+    
+    manifest.record_many(extracted)
+    
+    if not ok:
+        print(f"    ❌ 特征提取失败: {err}")
+    
+    shutil.rmtree(batch_features_dir, ignore_errors=True)
+    
+    return len(extracted), failed_count
+
+def process_videos_parallel(video_files, features_dir, audio_temp_dir, max_workers=None,
+                            chunk_size=CLAMP3_CHUNK_SIZE):
+    """
+    流水线处理视频列表
+    
+    生产者线程：进程池并行提取音频，
+    每凑满 chunk_size 个音频封装成一个批次放入有界队列
+    消费者 (当前线程)：逐批调用CLAMP3，特征移动到 features_dir 并登记到清单
+    
+    ffmpeg与CLAMP3占用不同资源，两者重叠执行；清单 (FeatureManifest) 中按当前版本视频提取过的片段直接跳过
+    
+    Returns:
+        (processed_count, failed_count)
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    
+    manifest, done, todo = split_pending_videos(video_files, features_dir)
+    processed_count = len(done)
+    failed_count = 0
+    total = len(todo)
+    video_stats = {os.path.splitext(os.path.basename(video_path))[0]: stat for video_path, stat in todo}
+    
+    if done:
+        print(f"✓ 已存在: {len(done)} 个特征")
+    if not todo:
+        manifest.close()
+        return processed_count, failed_count
+    
+    chunks = queue.Queue(maxsize=2)
+    producer_failed = []
+    producer_errors = []
+    
+    def produce():
+        """提取音频并按批次放入队列，结束时放入None；异常交给消费者在 join 后重新抛出"""
+        chunk = []
+        chunk_index = 0
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(_process_one, video_path, audio_temp_dir) for video_path, _ in todo]
+                
+                for i, future in enumerate(as_completed(futures), 1):
+                    base_name, ok, err = future.result()
+                    if not ok:
+                        producer_failed.append(base_name)
+                        print(f"[{i:2d}/{total}] ❌ {base_name}: {err}")
+                        continue
+                    
+                    print(f"[{i:2d}/{total}] 🎵 音频已提取: {base_name}")
+                    chunk.append(base_name)
+                    if len(chunk) >= chunk_size:
+                        chunks.put(_seal_chunk(audio_temp_dir, chunk_index, chunk))
+                        chunk = []
+                        chunk_index += 1
+            
+            if chunk:
+                chunks.put(_seal_chunk(audio_temp_dir, chunk_index, chunk))
+        except BaseException as e:
+            producer_errors.append(e)
+        finally:
+            chunks.put(None)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            chunk_dir, base_names = item
+            chunk_processed, chunk_failed = _extract_chunk_features(chunk_dir, base_names, features_dir,
+                                                                    manifest, video_stats)
+            processed_count += chunk_processed
+            failed_count += chunk_failed
+            # 批次处理完立即释放音频 (可能位于内存文件系统)
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+    finally:
+        manifest.close()
+    
+    producer.join()
+    if producer_errors:
+        # 例如进程池崩溃：未处理的视频不能被当作不存在而返回偏小的计数
+        raise producer_errors[0]
+    failed_count += len(producer_failed)
+    
+    return processed_count, failed_count
+
 def extract_features_for_segment(input_dir, output_dir, segment_type):
     """为特定时长的视频片段提取特征"""
     print(f"\n{'='*60}")
@@ -44,10 +451,8 @@ def extract_features_for_segment(input_dir, output_dir, segment_type):
     
     # 创建输出目录
     features_dir = os.path.join(output_dir, f"features_{segment_type}")
-    audio_temp_dir = os.path.join(output_dir, f"audio_temp_{segment_type}")
     
     os.makedirs(features_dir, exist_ok=True)
-    os.makedirs(audio_temp_dir, exist_ok=True)
     
     # 获取所有视频文件
     video_files = glob.glob(os.path.join(input_dir, f"segments_{segment_type}", "*.mp4"))
@@ -60,89 +465,14 @@ def extract_features_for_segment(input_dir, output_dir, segment_type):
     print(f"找到 {len(video_files)} 个视频文件")
     
     # 统计信息
-    processed_count = 0
-    failed_count = 0
     start_time = time.time()
     
-    for i, video_path in enumerate(video_files, 1):
-        video_name = os.path.basename(video_path)
-        base_name = os.path.splitext(video_name)[0]
-        
-        # 定义路径
-        audio_path = os.path.join(audio_temp_dir, f"{base_name}.wav")
-        feature_path = os.path.join(features_dir, f"{base_name}.npy")
-        
-        # 检查是否已经处理过
-        if os.path.exists(feature_path):
-            print(f"[{i:2d}/{len(video_files)}] ✓ 已存在: {base_name}")
-            processed_count += 1
-            continue
-        
-        print(f"[{i:2d}/{len(video_files)}] 🔄 处理中: {base_name}")
-        
-        try:
-            # 1. 提取音频
-            if not extract_audio_from_video(video_path, audio_path):
-                print(f"    ❌ 音频提取失败")
-                failed_count += 1
-                continue
-            
-            # 2. 检查音频文件大小
-            if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
-                print(f"    ❌ 音频文件为空")
-                failed_count += 1
-                continue
-            
-            # 3. 使用CLAMP3提取特征
-            # 只处理当前音频文件
-            temp_single_dir = os.path.join(audio_temp_dir, f"single_{base_name}")
-            temp_features_dir = os.path.join(audio_temp_dir, f"features_{base_name}")
-            
-            # 确保临时目录不存在
-            if os.path.exists(temp_single_dir):
-                shutil.rmtree(temp_single_dir)
-            if os.path.exists(temp_features_dir):
-                shutil.rmtree(temp_features_dir)
-                
-            os.makedirs(temp_single_dir, exist_ok=True)
-            temp_audio_path = os.path.join(temp_single_dir, f"{base_name}.wav")
-            shutil.copy2(audio_path, temp_audio_path)
-            
-            # 提取特征
-            result = subprocess.run([
-                'python', 'clamp3_embd.py', 
-                temp_single_dir, temp_features_dir, '--get_global'
-            ], capture_output=True, text=True, cwd=os.getcwd())
-            
-            # 复制特征文件到最终目录
-            temp_feature_file = os.path.join(temp_features_dir, f"{base_name}.npy")
-            if os.path.exists(temp_feature_file):
-                shutil.copy2(temp_feature_file, feature_path)
-            
-            # 清理临时文件
-            shutil.rmtree(temp_single_dir)
-            if os.path.exists(temp_features_dir):
-                shutil.rmtree(temp_features_dir)
-            os.remove(audio_path)
-            
-            if result.returncode == 0 and os.path.exists(feature_path):
-                print(f"    ✅ 特征提取成功")
-                processed_count += 1
-            else:
-                print(f"    ❌ 特征提取失败: {result.stderr}")
-                failed_count += 1
-                
-        except Exception as e:
-            print(f"    ❌ 处理异常: {e}")
-            failed_count += 1
-            
-            # 清理可能的临时文件
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-    
-    # 清理临时目录
-    if os.path.exists(audio_temp_dir):
-        shutil.rmtree(audio_temp_dir)
+    audio_temp_dir = make_audio_temp_dir(segment_type, output_dir)
+    try:
+        processed_count, failed_count = process_videos_parallel(video_files, features_dir, audio_temp_dir)
+    finally:
+        # 清理临时目录
+        shutil.rmtree(audio_temp_dir, ignore_errors=True)
     
     # 统计结果
     end_time = time.time()
@@ -210,11 +540,12 @@ def main():
     print("验证提取结果...")
     for segment in segments:
         features_dir = os.path.join(output_dir, f"features_{segment}")
-        if os.path.exists(features_dir):
-            feature_files = glob.glob(os.path.join(features_dir, "*.npy"))
-            print(f"  {segment}: {len(feature_files)} 个特征文件")
+        if os.path.exists(os.path.join(features_dir, MANIFEST_NAME)):
+            manifest = FeatureManifest(features_dir)
+            print(f"  {segment}: {manifest.count()} 个特征文件")
+            manifest.close()
         else:
-            print(f"  {segment}: 目录不存在")
+            print(f"  {segment}: 无特征清单")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
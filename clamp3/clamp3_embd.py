@@ -1,22 +1,41 @@
 import os
 import sys
+import json
+import importlib.util
+import numpy as np
 from utils import *
 
-def main():
-    if len(sys.argv) < 3 or len(sys.argv) > 4:
-        print('Usage: python clamp3_embd.py <input_dir_path> <output_dir_path> [--get_global]')
-        sys.exit(1)
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-    input_dir_path = os.path.abspath(sys.argv[1])
-    output_dir_path = os.path.abspath(sys.argv[2])
+# Settings used by preprocessing/audio/extract_mert.py and utils.extract_audio_features
+MERT_MODEL_PATH = 'm-a-p/MERT-v1-95M'
+MERT_SAMPLE_RATE = 24000
+MERT_WINDOW_IN_SEC = 5
+
+# Forward-pass batch sizes for embed_audio_batch
+MERT_BATCH_SIZE = 16  # 5 s windows
+CLAMP3_BATCH_SIZE = 64  # MAX_AUDIO_LENGTH segments
+
+# Audio files held in memory and embedded together by embed_audio_dir
+FILE_BATCH_SIZE = 8
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg')
+
+MODALITY_FUNCTIONS = {
+    'txt': extract_txt_features,
+    'img': extract_img_features,
+    'xml': extract_xml_features,
+    'mid': extract_mid_features,
+    'audio': extract_audio_features,
+}
 
+def run_extraction(input_dir_path, output_dir_path, global_flag):
+    '''Extract features for one input directory.'''
     input_dir = os.path.basename(input_dir_path)
     output_dir = os.path.basename(output_dir_path)
 
-    global_flag = True if len(sys.argv) == 4 and sys.argv[3] == '--get_global' else False
-
     # Step 1: Create a temporary directory
-    os.makedirs('temp', exist_ok=True)
+    os.makedirs(TEMP_DIR, exist_ok=True)
 
     # Step 2: Determine modalities automatically
     input_modality = get_modality_from_dir(input_dir_path)
@@ -28,21 +47,322 @@ def main():
     print(f'Detected input modality: {input_modality}')
 
     # Step 3: Extract features based on detected modality
-    modality_functions = {
-        'txt': extract_txt_features,
-        'img': extract_img_features,
-        'xml': extract_xml_features,
-        'mid': extract_mid_features,
-        'audio': extract_audio_features,
-    }
-
     if os.path.exists(output_dir_path):
         print(f'Warning: {output_dir} already exists, skipping extraction.')
     else:
-        modality_functions[input_modality](input_dir_path, output_dir_path, global_flag)
+        MODALITY_FUNCTIONS[input_modality](input_dir_path, output_dir_path, global_flag)
 
     # Step 4: Clean up
-    remove_folder('temp')
+    remove_folder(TEMP_DIR)
+
+# Audio models for in-process extraction, loaded on first use by load_model()
+_models = None
+
+def _import_from(name, path):
+    '''Import a module from a file path (code/utils.py would clash with the utils module imported above).'''
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_model():
+    '''Load MERT and the CLaMP 3 audio encoder into this process once; later calls return the same models.'''
+    global _models
+    if _models is not None:
+        return _models
+
+    # Heavy imports happen here so the command-line and --server paths stay light
+    import torch
+    import contextlib
+    from transformers import BertConfig
+
+    code_dir = os.path.join(ROOT_DIR, 'code')
+    mert_dir = os.path.join(ROOT_DIR, 'preprocessing', 'audio')
+    for path in (code_dir, mert_dir):
+        if path not in sys.path:
+            sys.path.append(path)
+    clamp3_code = _import_from('clamp3_code_utils', os.path.join(code_dir, 'utils.py'))
+    from hf_pretrains import HuBERTFeature
+    from MERT_utils import load_audio
+
+    if torch.cuda.is_available():
+        device = torch.device('cuda')
+    elif torch.backends.mps.is_available():
+        device = torch.device('mps')
+    else:
+        device = torch.device('cpu')
+    print('Using device:', device)
+
+    mert = HuBERTFeature(MERT_MODEL_PATH, MERT_SAMPLE_RATE, force_half=False, processor_normalize=True)
+    mert.to(device)
+    mert.eval()
+
+    # Same configuration as code/extract_clamp3.py
+    c = clamp3_code
+    audio_config = BertConfig(vocab_size=1,
+                              hidden_size=c.AUDIO_HIDDEN_SIZE,
+                              num_hidden_layers=c.AUDIO_NUM_LAYERS,
+                              num_attention_heads=c.AUDIO_HIDDEN_SIZE//64,
+                              intermediate_size=c.AUDIO_HIDDEN_SIZE*4,
+                              max_position_embeddings=c.MAX_AUDIO_LENGTH)
+    symbolic_config = BertConfig(vocab_size=1,
+                                 hidden_size=c.M3_HIDDEN_SIZE,
+                                 num_hidden_layers=c.PATCH_NUM_LAYERS,
+                                 num_attention_heads=c.M3_HIDDEN_SIZE//64,
+                                 intermediate_size=c.M3_HIDDEN_SIZE*4,
+                                 max_position_embeddings=c.PATCH_LENGTH)
+    model = c.CLaMP3Model(audio_config=audio_config,
+                          symbolic_config=symbolic_config,
+                          text_model_name=c.TEXT_MODEL_NAME,
+                          hidden_size=c.CLAMP3_HIDDEN_SIZE,
+                          load_m3=c.CLAMP3_LOAD_M3)
+
+    # As in code/extract_clamp3.py, the bf16 checkpoint is only used on the CUDA bf16 autocast path
+    use_bf16 = device.type == 'cuda' and torch.cuda.is_bf16_supported()
+    checkpoint_path = os.path.join(code_dir, c.CLAMP3_WEIGHTS_PATH)
+    bf16_checkpoint_path = checkpoint_path.replace('.pth', c.BF16_CHECKPOINT_SUFFIX)
+    if use_bf16 and os.path.exists(bf16_checkpoint_path):
+        checkpoint_path = bf16_checkpoint_path
+    if not os.path.exists(checkpoint_path):
+        raise FileNotFoundError(f'No CLaMP 3 weights found at "{checkpoint_path}", run download_weights.py first')
+
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=True)
+    model.load_state_dict(checkpoint['model'])
+    model = model.to(device)
+    model.eval()
+    print(f'Successfully Loaded CLaMP 3 Checkpoint from Epoch {checkpoint["epoch"]} with loss {checkpoint["min_eval_loss"]}')
+
+    if use_bf16:
+        inference_context = lambda: torch.autocast(device_type='cuda', dtype=torch.bfloat16)
+    else:
+        inference_context = contextlib.nullcontext
+
+    _models = {
+        'device': device,
+        'mert': mert,
+        'clamp3': model,
+        'config': c,
+        'load_audio': load_audio,
+        'inference_context': inference_context,
+    }
+    return _models
+
+def _mert_features_batch(models, waveforms):
+    '''MERT features of mono 24 kHz waveforms (1, n_sample): one layer-averaged row per 5 s window.
+
+    Full windows of all waveforms share MERT forward passes; a shorter last window runs on its own
+    so no window is padded.
+    '''
+    import torch
+
+    mert = models['mert']
+    window = MERT_SAMPLE_RATE * MERT_WINDOW_IN_SEC
+
+    file_wavs = []
+    for waveform in waveforms:
+        wav = mert.process_wav(waveform).to(models['device'])
+        wavs = [wav[:, i:i + window] for i in range(0, wav.shape[-1], window)]
+        if wavs and wavs[-1].shape[-1] < MERT_SAMPLE_RATE:
+            wavs = wavs[:-1]
+        if not wavs:
+            raise ValueError('audio is shorter than one second')
+        file_wavs.append(wavs)
+
+    rows = [[None] * len(wavs) for wavs in file_wavs]
+    full = [(f, j) for f, wavs in enumerate(file_wavs) for j, wav_chunk in enumerate(wavs) if wav_chunk.shape[-1] == window]
+    for start in range(0, len(full), MERT_BATCH_SIZE):
+        batch = full[start:start + MERT_BATCH_SIZE]
+        features = mert(torch.cat([file_wavs[f][j] for f, j in batch], 0), layer=None, reduction='mean').mean(dim=0)
+        for (f, j), row in zip(batch, features):
+            rows[f][j] = row
+
+    for f, wavs in enumerate(file_wavs):
+        for j, wav_chunk in enumerate(wavs):
+            if rows[f][j] is None:
+                rows[f][j] = mert(wav_chunk, layer=None, reduction='mean').mean(dim=0)[0]
+
+    return [torch.stack(file_rows) for file_rows in rows]
+
+def _clamp3_segments(c, mert_features):
+    '''Split MERT features into zero-padded CLaMP 3 input segments, as extract_feature() in code/extract_clamp3.py does.'''
+    import torch
+
+    max_input_length = c.MAX_AUDIO_LENGTH
+    input_data = mert_features.reshape(-1, mert_features.size(-1)).float().cpu()
+    zero_vec = torch.zeros((1, input_data.size(-1)))
+    input_data = torch.cat((zero_vec, input_data, zero_vec), 0)
+
+    segment_list = [input_data[i:i+max_input_length] for i in range(0, len(input_data), max_input_length)]
+    segment_list[-1] = input_data[-max_input_length:]
+
+    segments, masks = [], []
+    for input_segment in segment_list:
+        masks.append(torch.cat((torch.ones(input_segment.size(0)), torch.zeros(max_input_length - input_segment.size(0))), 0))
+        pad_indices = torch.zeros((max_input_length - input_segment.size(0), c.AUDIO_HIDDEN_SIZE))
+        segments.append(torch.cat((input_segment, pad_indices), 0))
+
+    return len(input_data), torch.stack(segments), torch.stack(masks)
+
+def _pool_segments(c, last_hidden_states, masks, input_length, get_global, device):
+    '''Combine the per-segment CLaMP 3 outputs of one file, as extract_feature() in code/extract_clamp3.py does.'''
+    import torch
+
+    max_input_length = c.MAX_AUDIO_LENGTH
+    if not get_global:
+        last_hidden_states_list = [states[:int(mask.sum().item())] for states, mask in zip(last_hidden_states, masks)]
+        last_hidden_states_list[-1] = last_hidden_states_list[-1][-(input_length%max_input_length):]
+        return torch.concat(last_hidden_states_list, 0)
+
+    full_chunk_cnt = input_length // max_input_length
+    remain_chunk_len = input_length % max_input_length
+    if remain_chunk_len == 0:
+        feature_weights = torch.tensor([max_input_length] * full_chunk_cnt, device=device).view(-1, 1)
+    else:
+        feature_weights = torch.tensor([max_input_length] * full_chunk_cnt + [remain_chunk_len], device=device).view(-1, 1)
+
+    last_hidden_states = last_hidden_states * feature_weights
+    return last_hidden_states.sum(dim=0) / feature_weights.sum()
+
+def _embed_waveforms(waveforms, get_global):
+    '''Embed mono 24 kHz waveforms (1, n_sample) with batched MERT and CLaMP 3 forward passes.'''
+    import torch
+
+    models = load_model()
+    c, model, device = models['config'], models['clamp3'], models['device']
+
+    with torch.no_grad():
+        file_segments = [_clamp3_segments(c, mert_features) for mert_features in _mert_features_batch(models, waveforms)]
+        segments = torch.cat([file_segment[1] for file_segment in file_segments], 0)
+        masks = torch.cat([file_segment[2] for file_segment in file_segments], 0)
+
+        # Segments of every file are padded to MAX_AUDIO_LENGTH, so they stack into shared forward passes
+        outputs = []
+        with models['inference_context']():
+            for start in range(0, len(segments), CLAMP3_BATCH_SIZE):
+                outputs.append(model.get_audio_features(audio_inputs=segments[start:start + CLAMP3_BATCH_SIZE].to(device),
+                                                        audio_masks=masks[start:start + CLAMP3_BATCH_SIZE].to(device),
+                                                        get_global=get_global))
+        outputs = torch.cat(outputs, 0)
+
+        features, offset = [], 0
+        for input_length, file_inputs, file_masks in file_segments:
+            file_outputs = outputs[offset:offset + len(file_inputs)]
+            offset += len(file_inputs)
+            pooled = _pool_segments(c, file_outputs, file_masks, input_length, get_global, device)
+            features.append(pooled.detach().float().cpu().numpy())
+
+    return np.stack(features) if get_global else features
+
+def embed_audio_batch(audio_paths, get_global=True):
+    '''Embed several audio files in-process.
+
+    Returns a (B, 768) array when get_global, otherwise a list of (n_i, 768) arrays.
+    '''
+    models = load_model()
+    waveforms = [models['load_audio'](audio_path, target_sr=MERT_SAMPLE_RATE, is_mono=True) for audio_path in audio_paths]
+    return _embed_waveforms(waveforms, get_global)
+
+def embed_audio_arrays(waves, get_global=True):
+    '''Embed mono MERT_SAMPLE_RATE float waveforms in [-1, 1] (e.g. PCM piped from ffmpeg); same output as embed_audio_batch.'''
+    import torch
+
+    waveforms = [torch.from_numpy(np.asarray(wave, dtype=np.float32)).reshape(1, -1) for wave in waves]
+    return _embed_waveforms(waveforms, get_global)
+
+def embed_audio_file(audio_path, get_global=True):
+    '''Embed one audio file in-process; returns the array clamp3_embd.py would save for it ((1, 768) when get_global).'''
+    return embed_audio_batch([audio_path], get_global)[0][None]
+
+def embed_audio_array(wave, get_global=True):
+    '''Embed one waveform in-process; same output shape as embed_audio_file.'''
+    return embed_audio_arrays([wave], get_global)[0][None]
+
+def embed_audio_dir(input_dir_path, output_dir_path, global_flag):
+    '''Embed the audio files directly in input_dir_path in-process, saving <name>.npy files as extract_clamp3.py does.
+
+    Files whose output already exists are skipped. A batch that fails is retried file by file, so one bad
+    file only loses its own feature.
+    '''
+    os.makedirs(output_dir_path, exist_ok=True)
+    jobs = []
+    with os.scandir(input_dir_path) as entries:
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            output_file = os.path.join(output_dir_path, name + '.npy')
+            if entry.is_file() and ext.lower() in AUDIO_EXTENSIONS and not os.path.exists(output_file):
+                jobs.append((entry.path, output_file))
+    jobs.sort()
+
+    for start in range(0, len(jobs), FILE_BATCH_SIZE):
+        batch = jobs[start:start + FILE_BATCH_SIZE]
+        try:
+            features = embed_audio_batch([audio_path for audio_path, _ in batch], global_flag)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f'Failed to process {batch[0][0]}: {e}')
+                continue
+            features = []
+            for audio_path, _ in batch:
+                try:
+                    features.append(embed_audio_batch([audio_path], global_flag)[0])
+                except Exception as e:
+                    print(f'Failed to process {audio_path}: {e}')
+                    features.append(None)
+
+        for (_, output_file), feature in zip(batch, features):
+            if feature is not None:
+                np.save(output_file, feature[None])
+
+def serve():
+    '''Long-lived worker: read one JSON request per stdin line and reply "OK" or "ERROR <message>".
+
+    Request format: ["<input_dir_path>", "<output_dir_path>", <get_global>]
+
+    Audio directories are embedded in-process, so MERT and CLaMP 3 are loaded once for the life of the
+    worker; other modalities still go through run_extraction.
+    '''
+    # Keep the real stdout for replies only; progress output (ours and child processes') goes to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    root_dir = os.getcwd()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            input_dir_path, output_dir_path, global_flag = json.loads(line)
+            input_dir_path, output_dir_path = os.path.abspath(input_dir_path), os.path.abspath(output_dir_path)
+            if get_modality_from_dir(input_dir_path) == 'audio':
+                embed_audio_dir(input_dir_path, output_dir_path, bool(global_flag))
+            else:
+                run_extraction(input_dir_path, output_dir_path, bool(global_flag))
+            reply = 'OK'
+        except SystemExit:
+            reply = 'ERROR extraction failed'
+        except Exception as e:
+            reply = f'ERROR {e}'
+        finally:
+            os.chdir(root_dir)
+            sys.stdout.flush()
+        print(' '.join(reply.split()), file=replies, flush=True)
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == '--server':
+        serve()
+        return
+
+    if len(sys.argv) < 3 or len(sys.argv) > 4:
+        print('Usage: python clamp3_embd.py <input_dir_path> <output_dir_path> [--get_global]')
+        print('       python clamp3_embd.py --server')
+        sys.exit(1)
+
+    input_dir_path = os.path.abspath(sys.argv[1])
+    output_dir_path = os.path.abspath(sys.argv[2])
+
+    global_flag = True if len(sys.argv) == 4 and sys.argv[3] == '--get_global' else False
+
+    run_extraction(input_dir_path, output_dir_path, global_flag)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -76,4 +76,5 @@ CLAMP3_WEIGHTS_PATH = (
     "_p_length_" + str(PATCH_LENGTH) + ".pth"
 
 )  # Path to store CLaMP3 model weights
+BF16_CHECKPOINT_SUFFIX = ".bf16.pth"  # bf16 copy of a checkpoint, written by download_weights.py
 CLAMP3_LOGS_PATH = CLAMP3_WEIGHTS_PATH.replace("weights", "logs").replace("pth", "txt")  # Path to save training logs
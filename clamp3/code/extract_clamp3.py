@@ -9,6 +9,7 @@ from accelerate import Accelerator
 from transformers import BertConfig, AutoTokenizer
 import argparse
 import requests
+import contextlib
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Feature extraction for CLaMP3.")
@@ -93,10 +94,24 @@ if not os.path.exists(checkpoint_path):
 
     print("Weights file downloaded successfully.")
 
+# Run the transformers under bf16 autocast on GPUs that support it (inference is memory-bandwidth bound in fp32)
+use_bf16 = device.type == "cuda" and torch.cuda.is_bf16_supported()
+
+# Only the bf16 autocast path may use the bf16 copy written by download_weights.py (half the bytes to read);
+# other devices run in fp32 and load the full-precision weights so their features are unchanged
+bf16_checkpoint_path = checkpoint_path.replace(".pth", BF16_CHECKPOINT_SUFFIX)
+if use_bf16 and os.path.exists(bf16_checkpoint_path):
+    checkpoint_path = bf16_checkpoint_path
+
 checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
 print(f"Successfully Loaded CLaMP 3 Checkpoint from Epoch {checkpoint['epoch']} with loss {checkpoint['min_eval_loss']}")
 model.load_state_dict(checkpoint['model'])
 
+if use_bf16:
+    inference_context = lambda: torch.autocast(device_type="cuda", dtype=torch.bfloat16)
+else:
+    inference_context = contextlib.nullcontext
+
 def extract_feature(filename, get_global=get_global):
     if not filename.endswith(".npy"):
         with open(filename, "r", encoding="utf-8") as f:
@@ -204,9 +219,9 @@ def process_directory(input_dir, output_dir, files):
             continue
 
         try:
-            with torch.no_grad():
+            with torch.no_grad(), inference_context():
                 features = extract_feature(file).unsqueeze(0)
-            np.save(output_file, features.detach().cpu().numpy())
+            np.save(output_file, features.detach().float().cpu().numpy())
         except Exception as e:
             print(f"Failed to process {file}: {e}")
 
@@ -22,6 +22,35 @@ def download_file(url, filename):
                     f.write(chunk)
                     pbar.update(len(chunk))
 
+# bf16权重副本后缀 (与 code/config.py 的 BF16_CHECKPOINT_SUFFIX 一致)
+BF16_CHECKPOINT_SUFFIX = ".bf16.pth"
+
+def convert_checkpoint_to_bf16(weights_path):
+    """
+    一次性生成bf16权重副本，code/extract_clamp3.py 在CUDA上以bf16推理时加载它 (其他设备仍加载FP32权重)
+    
+    浮点张量转为bfloat16，其余 (步数、epoch等) 保持不变，文件大小约减半
+    """
+    bf16_path = weights_path.replace(".pth", BF16_CHECKPOINT_SUFFIX)
+    if os.path.exists(bf16_path):
+        return bf16_path
+    
+    try:
+        import torch
+    except ImportError:
+        print("⚠️  未安装torch，跳过bf16权重转换")
+        return None
+    
+    print("🔄 生成bf16权重副本...")
+    checkpoint = torch.load(weights_path, map_location='cpu', weights_only=True)
+    checkpoint['model'] = {
+        k: v.to(torch.bfloat16) if v.is_floating_point() else v
+        for k, v in checkpoint['model'].items()
+    }
+    torch.save(checkpoint, bf16_path)
+    print(f"✅ bf16权重副本: {bf16_path} ({os.path.getsize(bf16_path) / 1024 / 1024:.2f} MB)")
+    return bf16_path
+
 def main():
     # CLAMP3 SAAS权重文件URL
     weights_url = "https://huggingface.co/sander-wood/clamp3/resolve/main/weights_clamp3_saas_h_size_768_t_model_FacebookAI_xlm-roberta-base_t_length_128_a_size_768_a_layers_12_a_length_128_s_size_768_s_layers_12_p_size_64_p_length_512.pth"
@@ -31,6 +60,7 @@ def main():
     
     if os.path.exists(weights_path):
         print(f"权重文件已存在: {weights_path}")
+        convert_checkpoint_to_bf16(weights_path)
         return
     
     print("开始下载CLAMP3 SAAS权重文件...")
@@ -48,6 +78,8 @@ def main():
         file_size = os.path.getsize(weights_path)
         print(f"文件大小: {file_size / 1024 / 1024:.2f} MB")
         
+        convert_checkpoint_to_bf16(weights_path)
+        
     except Exception as e:
         print(f"❌ 下载失败: {e}")
         if os.path.exists(weights_path):
@@ -4,11 +4,20 @@ CLAMP3权重文件稳定下载脚本
 支持断点续传和网络重连
 """
 import os
+import json
+import asyncio
 import requests
 import time
 from tqdm import tqdm
 
-def download_file_with_resume(url, filename, max_retries=5, chunk_size=8192):
+from download_weights import convert_checkpoint_to_bf16
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+def download_file_with_resume(url, filename, max_retries=5, chunk_size=1024 * 1024):
     """带断点续传的文件下载"""
     headers = {}
     initial_pos = 0
@@ -59,6 +68,108 @@ def download_file_with_resume(url, filename, max_retries=5, chunk_size=8192):
     
     return False
 
+def _load_part_state(state_path, num_parts):
+    """读取各分段已下载的字节数 (断点续传状态)"""
+    try:
+        with open(state_path) as f:
+            done = json.load(f)
+        if isinstance(done, list) and len(done) == num_parts:
+            return done
+    except (OSError, ValueError):
+        pass
+    return [0] * num_parts
+
+async def _download_range(session, url, fd, start, end, done, index, pbar, max_retries, chunk_size):
+    """下载 [start, end] 字节范围并写入文件对应位置，done[index] 记录该分段已写入的字节数"""
+    for attempt in range(max_retries):
+        pos = start + done[index]
+        if pos > end:
+            return
+        try:
+            async with session.get(url, headers={'Range': f'bytes={pos}-{end}'}) as response:
+                if response.status != 206:
+                    raise RuntimeError(f"服务器未返回分段内容: HTTP {response.status}")
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    os.pwrite(fd, chunk, pos)
+                    pos += len(chunk)
+                    done[index] += len(chunk)
+                    pbar.update(len(chunk))
+            if pos > end:
+                return
+        except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+            print(f"❌ 分段 {index} 下载失败 (尝试 {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)
+    raise RuntimeError(f"分段 {index} 达到最大重试次数")
+
+async def _download_ranges(url, filename, total_size, num_parts, max_retries, chunk_size):
+    """并发下载所有分段，写入预先分配好大小的文件"""
+    part_size = -(-total_size // num_parts)
+    ranges = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+    state_path = filename + '.parts'
+    done = _load_part_state(state_path, len(ranges))
+    
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT)
+    try:
+        os.ftruncate(fd, total_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=30)
+        with tqdm(
+            total=total_size,
+            initial=sum(done),
+            unit='B',
+            unit_scale=True,
+            desc=os.path.basename(filename)
+        ) as pbar:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                await asyncio.gather(*(
+                    _download_range(session, url, fd, start, end, done, index, pbar, max_retries, chunk_size)
+                    for index, (start, end) in enumerate(ranges)
+                ))
+    finally:
+        os.close(fd)
+        # 保存各分段进度，中断后重新运行可继续
+        with open(state_path, 'w') as f:
+            json.dump(done, f)
+    
+    os.remove(state_path)
+
+def download_file_parallel(url, filename, num_parts=8, max_retries=5, chunk_size=1024 * 1024):
+    """
+    多连接分段并行下载 (HTTP Range + aiohttp)，支持断点续传
+    
+    服务器不支持Range、未安装aiohttp或存在旧的单连接下载残留时，回退到 download_file_with_resume
+    """
+    state_path = filename + '.parts'
+    if aiohttp is None or not hasattr(os, 'pwrite') or (os.path.exists(filename) and not os.path.exists(state_path)):
+        return download_file_with_resume(url, filename, max_retries, chunk_size)
+    
+    try:
+        head = requests.head(url, allow_redirects=True, timeout=30)
+        head.raise_for_status()
+        total_size = int(head.headers.get('content-length', 0))
+        accepts_ranges = head.headers.get('accept-ranges', '').lower() == 'bytes'
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️  获取文件信息失败: {e}，改用单连接下载")
+        return download_file_with_resume(url, filename, max_retries, chunk_size)
+    
+    if not total_size or not accepts_ranges:
+        print("⚠️  服务器不支持分段下载，改用单连接下载")
+        return download_file_with_resume(url, filename, max_retries, chunk_size)
+    
+    print(f"🚀 {num_parts} 个连接并行下载，共 {total_size / 1024 / 1024:.1f} MB")
+    try:
+        # 重定向后的CDN地址直接用于分段请求
+        asyncio.run(_download_ranges(head.url, filename, total_size, num_parts, max_retries, chunk_size))
+    except (RuntimeError, OSError) as e:
+        print(f"❌ 下载失败: {e}，重新运行可从中断处继续")
+        return False
+    except KeyboardInterrupt:
+        print("⏸️  下载已暂停，重新运行可从中断处继续")
+        return False
+    
+    print(f"✅ 下载完成: {filename}")
+    return True
+
 def verify_file_size(filename, expected_size=None):
     """验证文件大小"""
     if not os.path.exists(filename):
@@ -87,7 +198,7 @@ def main():
     os.makedirs(os.path.dirname(weights_path), exist_ok=True)
     
     # 下载文件
-    success = download_file_with_resume(weights_url, weights_path)
+    success = download_file_parallel(weights_url, weights_path)
     
     if success:
         print("✅ 权重文件下载成功！")
@@ -99,6 +210,7 @@ def main():
             print("🔍 验证权重文件...")
             checkpoint = torch.load(weights_path, map_location='cpu')
             print(f"✅ 权重文件验证通过，包含 {len(checkpoint)} 个模块")
+            convert_checkpoint_to_bf16(weights_path)
         except Exception as e:
             print(f"⚠️  权重文件验证失败: {e}")
     else:
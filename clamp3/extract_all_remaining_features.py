@@ -4,17 +4,21 @@
 """
 import os
 import sys
-import subprocess
 import shutil
 import time
 import glob
 
-def extract_features_for_duration(duration):
-    """提取指定时长视频的音乐特征"""
-    # 路径配置
-    materials_dir = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/retrieve_libraries"
+from batch_music_feature_extraction import (
+    make_audio_temp_dir, process_videos_parallel, stop_clamp3_server
+)
+
+# 路径配置
+materials_dir = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/retrieve_libraries"
+output_dir = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/music_features"
+
+def extract_features_for_duration(duration, max_workers=None):
+    """提取指定时长视频的音乐特征 (max_workers 为音频提取进程数)"""
     segments_dir = os.path.join(materials_dir, f"segments_{duration}")
-    output_dir = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/music_features"
     features_dir = os.path.join(output_dir, f"features_{duration}")
     
     # 创建输出目录
@@ -29,65 +33,16 @@ def extract_features_for_duration(duration):
     print(f"找到 {len(video_files)} 个视频文件")
     print(f"{'='*60}")
     
-    processed_count = 0
-    failed_count = 0
     start_time = time.time()
     
-    for i, video_path in enumerate(video_files, 1):
-        video_name = os.path.basename(video_path)
-        base_name = os.path.splitext(video_name)[0]
-        
-        # 检查是否已处理
-        feature_path = os.path.join(features_dir, f"{base_name}.npy")
-        if os.path.exists(feature_path):
-            print(f"[{i:2d}/{len(video_files)}] ✓ 已存在: {base_name}")
-            processed_count += 1
-            continue
-        
-        print(f"[{i:2d}/{len(video_files)}] 🔄 处理中: {base_name}")
-        
-        try:
-            # 创建临时目录
-            temp_dir = f"temp_{base_name}"
-            audio_dir = os.path.join(temp_dir, "audio")
-            temp_features_dir = os.path.join(temp_dir, "features")
-            
-            os.makedirs(audio_dir, exist_ok=True)
-            
-            # 提取音频
-            audio_path = os.path.join(audio_dir, f"{base_name}.wav")
-            cmd = ['ffmpeg', '-i', video_path, '-q:a', '0', '-map', 'a', '-y', audio_path]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                print(f"    ❌ 音频提取失败")
-                failed_count += 1
-                continue
-            
-            # 提取特征
-            result = subprocess.run([
-                'python', 'clamp3_embd.py', 
-                audio_dir, temp_features_dir, '--get_global'
-            ], capture_output=True, text=True)
-            
-            # 复制特征文件
-            temp_feature_file = os.path.join(temp_features_dir, f"{base_name}.npy")
-            if os.path.exists(temp_feature_file):
-                shutil.copy2(temp_feature_file, feature_path)
-                print(f"    ✅ 特征提取成功")
-                processed_count += 1
-            else:
-                print(f"    ❌ 特征文件未生成")
-                failed_count += 1
-            
-        except Exception as e:
-            print(f"    ❌ 处理异常: {e}")
-            failed_count += 1
-        
-        finally:
-            # 清理临时目录
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+    # 并行提取音频后批量调用一次CLAMP3
+    audio_temp_dir = make_audio_temp_dir(duration, output_dir)
+    try:
+        processed_count, failed_count = process_videos_parallel(video_files, features_dir, audio_temp_dir,
+                                                                max_workers=max_workers)
+    finally:
+        # 清理临时目录
+        shutil.rmtree(audio_temp_dir, ignore_errors=True)
     
     end_time = time.time()
     duration_time = end_time - start_time
@@ -111,13 +66,15 @@ def main():
     total_failed = 0
     total_start_time = time.time()
     
-    for duration in durations:
-        processed, failed = extract_features_for_duration(duration)
-        total_processed += processed
-        total_failed += failed
-        
-        # 短暂休息，避免过热
-        time.sleep(2)
+    # 各时长依次提取，共用本进程的一个常驻CLAMP3服务 (模型只加载一份)；
+    # 并行只发生在每个时长内部的ffmpeg音频提取阶段 (见 process_videos_parallel)
+    try:
+        for duration in durations:
+            processed, failed = extract_features_for_duration(duration)
+            total_processed += processed
+            total_failed += failed
+    finally:
+        stop_clamp3_server()
     
     total_end_time = time.time()
     total_duration = total_end_time - total_start_time
@@ -4,18 +4,45 @@
 """
 import os
 import sys
-import subprocess
-import shutil
 import time
-import glob
 import gc
+import queue
 import psutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+# 降低GPU内存使用 (需在导入torch之前设置)
+os.environ.setdefault('PYTORCH_MPS_HIGH_WATERMARK_RATIO', '0.0')
+
+from clamp3_embd import load_model, embed_audio_arrays
+from batch_music_feature_extraction import decode_audio_from_video
+from feature_matrix import build_feature_matrix, load_feature_matrix
+
+# 流水线参数: 每个ffmpeg的线程数、并发ffmpeg数 (二者乘积不超过核数，最多4个以限制内存中的长音频)、
+# 解码结果队列长度 (预取的音频数)
+FFMPEG_THREADS = 2
+DECODE_WORKERS = max(1, min(4, (os.cpu_count() or 2) // FFMPEG_THREADS))
+PREFETCH = 4
+
+# 每个文件的推理耗时提示阈值 (秒)：进程内的torch推理无法中途终止，超过阈值只提示，结果照常保存
+SLOW_EMBED_SECONDS = 60
+
 def get_memory_usage():
     """获取内存使用情况"""
     return psutil.virtual_memory().percent
 
+def save_features(batch, feats):
+    """写盘线程: 保存一批特征，返回 (成功数, 失败数)"""
+    saved = 0
+    for (base_name, _, feature_path), feat in zip(batch, feats):
+        try:
+            np.save(feature_path, feat[None])  # 与 clamp3_embd.py 输出格式一致: (1, 768)
+            saved += 1
+        except OSError as e:
+            print(f"    ❌ 特征保存失败: {base_name} ({e})")
+    return saved, len(batch) - saved
+
 def extract_features_optimized(duration):
     """优化的特征提取"""
     # 路径配置
@@ -27,10 +54,9 @@ def extract_features_optimized(duration):
     os.makedirs(features_dir, exist_ok=True)
     
     # 获取视频文件并按大小排序（小文件优先）
-    video_files = []
-    for f in glob.glob(os.path.join(segments_dir, "*.mp4")):
-        size = os.path.getsize(f)
-        video_files.append((f, size))
+    # 一次scandir遍历目录，每个mp4文件只stat一次取文件大小
+    with os.scandir(segments_dir) as entries:
+        video_files = [(e.path, e.stat().st_size) for e in entries if e.name.endswith('.mp4')]
     
     # 按文件大小排序
     video_files.sort(key=lambda x: x[1])
@@ -45,114 +71,100 @@ def extract_features_optimized(duration):
     failed_count = 0
     start_time = time.time()
     
-    # 分批处理，每批3个文件
+    # MERT和CLAMP3模型在本进程内只加载一次，之后每个文件直接推理
+    print(f"🔄 加载CLAMP3模型...")
+    load_model()
+    
+    # 已有特征的文件直接计为成功，其余进入流水线 (已有特征一次scandir列出，不逐个stat)
+    with os.scandir(features_dir) as entries:
+        existing = {e.name for e in entries if e.name.endswith('.npy')}
+    todo = []
+    for video_path in video_files:
+        base_name = os.path.splitext(os.path.basename(video_path))[0]
+        feature_path = os.path.join(features_dir, f"{base_name}.npy")
+        if f"{base_name}.npy" in existing:
+            print(f"  ✓ 已存在: {base_name}")
+            processed_count += 1
+        else:
+            todo.append((video_path, base_name, feature_path))
+    
+    # 三段流水线: ffmpeg解码线程 -> 有界队列 -> 主线程批量推理 -> 写盘线程
+    # 队列满时解码线程阻塞，内存中的解码音频最多 DECODE_WORKERS + PREFETCH 段
+    jobs = queue.Queue()
+    for job in todo:
+        jobs.put(job)
+    audio_queue = queue.Queue(maxsize=PREFETCH)
+    
+    def decode_worker():
+        """从任务队列取视频解码音频，结果放入有界队列；结束时放入None"""
+        try:
+            while True:
+                try:
+                    video_path, base_name, feature_path = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                audio_queue.put((base_name, decode_audio_from_video(video_path, threads=FFMPEG_THREADS), feature_path))
+        finally:
+            audio_queue.put(None)
+    
     batch_size = 3
-    for batch_start in range(0, len(video_files), batch_size):
-        batch_files = video_files[batch_start:batch_start+batch_size]
-        
-        print(f"\n🔄 处理批次 {batch_start//batch_size + 1}/{(len(video_files)-1)//batch_size + 1}")
-        print(f"内存使用: {get_memory_usage():.1f}%")
+    batch = []
+    save_futures = []
+    finished_workers = 0
+    batch_index = 0
+    total_batches = (len(todo) - 1) // batch_size + 1 if todo else 0
+    
+    with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as decoders, ThreadPoolExecutor(max_workers=1) as writer:
+        for _ in range(DECODE_WORKERS):
+            decoders.submit(decode_worker)
         
-        for video_path in batch_files:
-            video_name = os.path.basename(video_path)
-            base_name = os.path.splitext(video_name)[0]
+        while finished_workers < DECODE_WORKERS:
+            item = audio_queue.get()
+            if item is None:
+                finished_workers += 1
+            elif item[1] is None:
+                print(f"    ❌ 音频提取失败: {item[0]}")
+                failed_count += 1
+            else:
+                batch.append(item)
             
-            # 检查是否已处理
-            feature_path = os.path.join(features_dir, f"{base_name}.npy")
-            if os.path.exists(feature_path):
-                print(f"  ✓ 已存在: {base_name}")
-                processed_count += 1
+            if not batch or (len(batch) < batch_size and finished_workers < DECODE_WORKERS):
                 continue
             
-            file_size = os.path.getsize(video_path) / 1024 / 1024
-            print(f"  🔄 处理: {base_name} ({file_size:.1f}MB)")
-            
+            # 整批特征提取 (MERT窗口和CLAMP3片段跨文件合并前向计算)
+            batch_index += 1
+            print(f"\n🔄 处理批次 {batch_index}/{total_batches} ({len(batch)} 个文件)")
+            print(f"内存使用: {get_memory_usage():.1f}%")
             step_start = time.time()
             
             try:
-                # 创建临时目录
-                temp_dir = f"temp_{base_name}"
-                audio_dir = os.path.join(temp_dir, "audio")
-                temp_features_dir = os.path.join(temp_dir, "features")
-                
-                # 清理可能存在的临时目录
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                
-                os.makedirs(audio_dir, exist_ok=True)
-                
-                # 1. 提取音频 (优化参数)
-                audio_path = os.path.join(audio_dir, f"{base_name}.wav")
-                cmd = [
-                    'ffmpeg', '-i', video_path, 
-                    '-q:a', '2',  # 稍微降低音质以减少文件大小
-                    '-ar', '44100',  # 固定采样率
-                    '-ac', '2',  # 立体声
-                    '-map', 'a', '-y', audio_path
-                ]
+                feats = embed_audio_arrays([wave for _, wave, _ in batch], get_global=True)
+                save_futures.append(writer.submit(save_features, batch, feats))
                 
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                
-                if result.returncode != 0:
-                    print(f"    ❌ 音频提取失败: {base_name}")
-                    failed_count += 1
-                    continue
-                
-                audio_size = os.path.getsize(audio_path) / 1024 / 1024
-                print(f"    ✅ 音频提取完成 ({audio_size:.1f}MB)")
-                
-                # 2. 特征提取 (设置更长的超时)
-                print(f"    🔄 开始特征提取...")
-                
-                # 增加超时时间和内存限制
-                env = os.environ.copy()
-                env['PYTORCH_MPS_HIGH_WATERMARK_RATIO'] = '0.0'  # 降低GPU内存使用
-                
-                result = subprocess.run([
-                    'python', 'clamp3_embd.py', 
-                    audio_dir, temp_features_dir, '--get_global'
-                ], capture_output=True, text=True, timeout=60, env=env)  # 60秒超时
-                
-                temp_feature_file = os.path.join(temp_features_dir, f"{base_name}.npy")
-                if os.path.exists(temp_feature_file):
-                    shutil.copy2(temp_feature_file, feature_path)
-                    
-                    step_time = time.time() - step_start
-                    print(f"    ✅ 特征提取成功 ({step_time:.1f}秒)")
-                    processed_count += 1
+                step_time = time.time() - step_start
+                if step_time > SLOW_EMBED_SECONDS * len(batch):
+                    print(f"    ⚠️  特征提取较慢 ({step_time:.1f}秒 > {SLOW_EMBED_SECONDS * len(batch)}秒)，结果已保存")
                 else:
-                    print(f"    ❌ 特征文件未生成")
-                    # 输出更详细的错误信息
-                    if result.stderr:
-                        error_lines = result.stderr.split('\n')
-                        for line in error_lines[-5:]:  # 只显示最后5行错误
-                            if line.strip():
-                                print(f"    错误: {line.strip()}")
-                    failed_count += 1
-                
-            except subprocess.TimeoutExpired:
-                print(f"    ❌ 处理超时 (>60秒)")
-                failed_count += 1
+                    print(f"    ✅ 特征提取成功 ({step_time:.1f}秒)")
                 
             except Exception as e:
-                print(f"    ❌ 处理异常: {e}")
-                failed_count += 1
+                print(f"    ❌ 批量特征提取异常: {e}")
+                failed_count += len(batch)
             
-            finally:
-                # 强制清理临时目录
-                if os.path.exists(temp_dir):
-                    try:
-                        shutil.rmtree(temp_dir)
-                    except:
-                        pass
-                
-                # 强制垃圾回收
-                gc.collect()
-        
-        # 批次间休息
-        if batch_start + batch_size < len(video_files):
-            print(f"  💤 批次休息3秒...")
-            time.sleep(3)
+            batch = []
+            
+            # 强制垃圾回收
+            gc.collect()
+    
+    # 等待写盘完成后再统计
+    for future in save_futures:
+        saved, failed = future.result()
+        processed_count += saved
+        failed_count += failed
+    
+    # 合并为一个归一化特征矩阵，检索端内存映射打开，无需逐个读取特征文件
+    if save_futures or load_feature_matrix(output_dir, duration) is None:
+        build_feature_matrix(output_dir, duration)
     
     end_time = time.time()
     total_time = end_time - start_time
@@ -179,7 +191,8 @@ def main():
     for duration in durations:
         features_dir = f"/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/music_features/features_{duration}"
         if os.path.exists(features_dir):
-            count = len(glob.glob(os.path.join(features_dir, "*.npy")))
+            with os.scandir(features_dir) as entries:
+                count = sum(1 for e in entries if e.name.endswith('.npy'))
             print(f"📊 {duration}: {count}/20 已完成")
         else:
             print(f"📊 {duration}: 0/20 已完成")
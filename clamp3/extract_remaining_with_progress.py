@@ -4,37 +4,12 @@
 """
 import os
 import sys
-import subprocess
-import shutil
 import time
-import glob
+import numpy as np
 from tqdm import tqdm
-import threading
 
-class ProgressTracker:
-    def __init__(self):
-        self.current_step = ""
-        self.start_time = None
-        self.is_running = False
-        
-    def start_step(self, step_name):
-        self.current_step = step_name
-        self.start_time = time.time()
-        self.is_running = True
-        
-    def end_step(self):
-        if self.start_time:
-            elapsed = time.time() - self.start_time
-            print(f"    完成时间: {elapsed:.1f}秒")
-        self.is_running = False
-        
-    def show_progress(self):
-        """显示实时进度"""
-        while self.is_running:
-            if self.start_time:
-                elapsed = time.time() - self.start_time
-                print(f"\r    {self.current_step} - 已用时: {elapsed:.1f}秒", end='', flush=True)
-            time.sleep(1)
+from clamp3_embd import load_model, embed_audio_array
+from batch_music_feature_extraction import CLAMP3_SAMPLE_RATE, decode_audio_from_video
 
 def extract_features_for_duration(duration):
     """提取指定时长视频的音乐特征"""
@@ -48,8 +23,8 @@ def extract_features_for_duration(duration):
     os.makedirs(features_dir, exist_ok=True)
     
     # 获取所有视频文件
-    video_files = glob.glob(os.path.join(segments_dir, "*.mp4"))
-    video_files.sort()
+    with os.scandir(segments_dir) as entries:
+        video_files = sorted(e.path for e in entries if e.name.endswith('.mp4'))
     
     print(f"\n{'='*60}")
     print(f"处理 {duration} 视频片段 - 共 {len(video_files)} 个文件")
@@ -59,8 +34,11 @@ def extract_features_for_duration(duration):
     failed_count = 0
     start_time = time.time()
     
-    # 创建进度条
-    progress_bar = tqdm(video_files, desc=f"处理{duration}视频", unit="个")
+    # MERT和CLAMP3模型在本进程内只加载一次
+    load_model()
+    
+    # 创建进度条 (各步骤用时显示在后缀中，由主线程在步骤结束后更新)
+    progress_bar = tqdm(video_files, desc=f"处理{duration}视频", unit="个", mininterval=1.0)
     
     for i, video_path in enumerate(progress_bar):
         video_name = os.path.basename(video_path)
@@ -78,72 +56,29 @@ def extract_features_for_duration(duration):
         
         progress_bar.write(f"🔄 处理中: {base_name}")
         
-        # 创建进度追踪器
-        tracker = ProgressTracker()
-        
         try:
-            # 创建临时目录
-            temp_dir = f"temp_{base_name}"
-            audio_dir = os.path.join(temp_dir, "audio")
-            temp_features_dir = os.path.join(temp_dir, "features")
-            
-            os.makedirs(audio_dir, exist_ok=True)
-            
-            # 1. 提取音频
-            tracker.start_step("提取音频")
-            progress_thread = threading.Thread(target=tracker.show_progress)
-            progress_thread.daemon = True
-            progress_thread.start()
-            
-            audio_path = os.path.join(audio_dir, f"{base_name}.wav")
-            cmd = ['ffmpeg', '-i', video_path, '-q:a', '0', '-map', 'a', '-y', audio_path]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            tracker.end_step()
+            # 1. 提取音频 (ffmpeg经管道直接输出PCM，不写临时WAV)
+            step_start = time.time()
+            wave = decode_audio_from_video(video_path)
+            progress_bar.set_postfix_str(f"提取音频 {time.time() - step_start:.1f}s")
             
-            if result.returncode != 0:
+            if wave is None:
                 progress_bar.write(f"    ❌ 音频提取失败")
                 failed_count += 1
                 continue
             
-            # 检查音频文件大小
-            audio_size = os.path.getsize(audio_path) / 1024 / 1024  # MB
-            progress_bar.write(f"    ✅ 音频提取成功 ({audio_size:.1f}MB)")
+            progress_bar.write(f"    ✅ 音频提取成功 ({wave.size / CLAMP3_SAMPLE_RATE:.0f}秒)")
             
             # 2. 提取特征
-            tracker.start_step("提取CLAMP3特征")
-            progress_thread = threading.Thread(target=tracker.show_progress)
-            progress_thread.daemon = True
-            progress_thread.start()
-            
-            result = subprocess.run([
-                'python', 'clamp3_embd.py', 
-                audio_dir, temp_features_dir, '--get_global'
-            ], capture_output=True, text=True)
-            
-            tracker.end_step()
-            
-            # 复制特征文件
-            temp_feature_file = os.path.join(temp_features_dir, f"{base_name}.npy")
-            if os.path.exists(temp_feature_file):
-                shutil.copy2(temp_feature_file, feature_path)
-                progress_bar.write(f"    ✅ 特征提取成功")
-                processed_count += 1
-            else:
-                progress_bar.write(f"    ❌ 特征文件未生成")
-                if result.stderr:
-                    progress_bar.write(f"    错误信息: {result.stderr[:200]}...")
-                failed_count += 1
+            step_start = time.time()
+            np.save(feature_path, embed_audio_array(wave, get_global=True))
+            progress_bar.set_postfix_str(f"提取CLAMP3特征 {time.time() - step_start:.1f}s")
+            progress_bar.write(f"    ✅ 特征提取成功")
+            processed_count += 1
             
         except Exception as e:
-            tracker.end_step()
             progress_bar.write(f"    ❌ 处理异常: {e}")
             failed_count += 1
-        
-        finally:
-            # 清理临时目录
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
     
     progress_bar.close()
     
@@ -171,10 +106,11 @@ def main():
     for duration in all_durations:
         features_dir = os.path.join(output_dir, f"features_{duration}")
         if os.path.exists(features_dir):
-            feature_files = glob.glob(os.path.join(features_dir, "*.npy"))
-            if len(feature_files) < 20:
+            with os.scandir(features_dir) as entries:
+                count = sum(1 for e in entries if e.name.endswith('.npy'))
+            if count < 20:
                 pending_durations.append(duration)
-                print(f"📂 {duration}: {len(feature_files)}/20 个文件已完成")
+                print(f"📂 {duration}: {count}/20 个文件已完成")
             else:
                 print(f"✅ {duration}: 已完成所有20个文件")
         else:
@@ -195,10 +131,6 @@ def main():
         processed, failed = extract_features_for_duration(duration)
         total_processed += processed
         total_failed += failed
-        
-        # 短暂休息，避免过热
-        print("😴 休息2秒...")
-        time.sleep(2)
     
     total_end_time = time.time()
     total_duration = total_end_time - total_start_time
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+合并特征矩阵 - 每个时长的CLAMP3特征合并为一个L2归一化矩阵文件
+特征提取脚本写入，检索系统 (clamp3 与 MI_retrieve) 以内存映射方式打开
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from typing import List, Tuple, Optional
+
+def feature_matrix_paths(features_base_dir: str, duration: str) -> Tuple[str, str]:
+    """合并特征矩阵文件及其索引文件的路径"""
+    prefix = os.path.join(features_base_dir, f"features_{duration}")
+    return f"{prefix}_matrix.npy", f"{prefix}_index.json"
+
+def scan_feature_files(features_dir: str) -> Tuple[List[str], str]:
+    """
+    一次scandir列出特征文件，并由每个文件的 (文件名, 大小, 修改时间) 生成目录状态戳
+    
+    原地覆盖已有特征文件不会改变目录修改时间，但会改变该文件的大小或修改时间
+    
+    Returns:
+        (排序后的特征文件路径列表, 状态戳)
+    """
+    with os.scandir(features_dir) as entries:
+        files = sorted((e.name, e.path, e.stat()) for e in entries if e.name.endswith('.npy'))
+    digest = hashlib.sha1()
+    for name, _, stat in files:
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return [path for _, path, _ in files], digest.hexdigest()
+
+def load_feature_matrix(features_base_dir: str, duration: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    """以内存映射方式打开合并特征矩阵；不存在、损坏或特征文件已变化时返回None"""
+    features_dir = os.path.join(features_base_dir, f"features_{duration}")
+    matrix_path, index_path = feature_matrix_paths(features_base_dir, duration)
+    
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index_info = json.load(f)
+        
+        # 增删或覆盖特征文件都会改变状态戳
+        if index_info.get("source_stamp") != scan_feature_files(features_dir)[1]:
+            return None
+        
+        video_names = index_info["video_names"]
+        matrix = np.load(matrix_path, mmap_mode='r')
+        if matrix.shape != (len(video_names), 768):
+            return None
+        
+        return video_names, matrix
+    
+    except (OSError, ValueError, KeyError):
+        return None
+
+def build_feature_matrix(features_base_dir: str, duration: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    """
+    逐个读取某时长的特征文件，L2归一化后写入合并特征矩阵文件
+    
+    特征提取脚本在每个时长完成后调用，检索端启动时直接内存映射打开，不再逐个读取小文件
+    
+    Returns:
+        (视频名称列表, (N, 768)特征矩阵)，没有可用特征时返回None
+    """
+    features_dir = os.path.join(features_base_dir, f"features_{duration}")
+    
+    # 状态戳在读取前生成，读取期间被改写的文件下次加载时会触发重建
+    feature_files, source_stamp = scan_feature_files(features_dir)
+    
+    if not feature_files:
+        print(f"⚠️  {duration} 目录中没有特征文件")
+        return None
+    
+    duration_features = {}
+    for feature_file in feature_files:
+        try:
+            # 从文件名提取视频名称
+            video_name = os.path.splitext(os.path.basename(feature_file))[0]
+            
+            # 加载特征向量
+            feature_vector = np.load(feature_file)
+            
+            # 确保特征向量是正确的维度 (1, 768)
+            if feature_vector.shape != (1, 768):
+                print(f"⚠️  {video_name} 特征维度异常: {feature_vector.shape}")
+                continue
+            
+            duration_features[video_name] = feature_vector.flatten()  # 转为1D数组
+        
+        except Exception as e:
+            print(f"❌ 加载特征文件失败 {feature_file}: {e}")
+            continue
+    
+    if not duration_features:
+        return None
+    
+    # 余弦相似度只依赖方向，直接存储L2归一化后的矩阵
+    video_names = list(duration_features.keys())
+    matrix = np.stack(list(duration_features.values())).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    matrix /= np.where(norms == 0, 1.0, norms)[:, None]
+    
+    matrix_path, index_path = feature_matrix_paths(features_base_dir, duration)
+    try:
+        np.save(matrix_path, matrix)
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump({"video_names": video_names, "source_stamp": source_stamp}, f, ensure_ascii=False)
+        matrix = np.load(matrix_path, mmap_mode='r')
+    except OSError as e:
+        print(f"⚠️  无法写入合并特征矩阵 {matrix_path}: {e}，使用内存中的特征")
+    
+    return video_names, matrix
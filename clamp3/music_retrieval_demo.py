@@ -8,6 +8,8 @@ import os
 import sys
 import random
 import json
+import functools
+import numpy as np
 from pathlib import Path
 from datetime import datetime
 import logging
@@ -15,18 +17,28 @@ import logging
 # 添加当前目录到路径
 sys.path.append(str(Path(__file__).parent))
 
-from music_search_api import MusicSearchAPI
+from music_search_api import MusicSearchAPI, get_music_search_api
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1024)
+def _path_exists(path: str) -> bool:
+    """检查音乐库中的路径是否存在 (会话期间音乐库不变，结果缓存，重新扫描时调用 _path_exists.cache_clear())"""
+    return os.path.exists(path)
+
 class MusicRetrievalDemo:
     """音乐检索系统演示类"""
     
-    def __init__(self):
-        """初始化演示"""
-        self.api = MusicSearchAPI()
+    def __init__(self, api: MusicSearchAPI = None):
+        """
+        初始化演示
+        
+        Args:
+            api: 音乐检索API实例，默认使用进程内共享实例
+        """
+        self.api = api or get_music_search_api()
         self.last_search_results = []
         self.current_selection = None
         
@@ -85,7 +97,7 @@ class MusicRetrievalDemo:
             "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/retrieve_libraries/segments_3min/56_3min_05.mp4"
         ]
         
-        available_files = [(i+1, f) for i, f in enumerate(test_files) if os.path.exists(f)]
+        available_files = [(i+1, f) for i, f in enumerate(test_files) if _path_exists(f)]
         
         if not available_files:
             print("❌ 没有找到可用的测试文件")
@@ -208,19 +220,18 @@ class MusicRetrievalDemo:
         num_results = min(search_count, len(available_videos))
         selected_videos = random.sample(available_videos, num_results)
         
-        # 生成模拟结果
-        results = []
-        for video_name in selected_videos:
-            video_path = f"/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/retrieve_libraries/segments_{duration}/{video_name}.mp4"
-            results.append({
-                "video_name": video_name,
-                "similarity": random.uniform(0.7, 0.95),
-                "video_path": video_path,
+        # 生成模拟结果：一次生成全部相似度，按相似度降序组装
+        segments_dir = f"/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/retrieve_libraries/segments_{duration}"
+        similarities = np.random.uniform(0.7, 0.95, num_results)
+        results = [
+            {
+                "video_name": selected_videos[i],
+                "similarity": float(similarities[i]),
+                "video_path": f"{segments_dir}/{selected_videos[i]}.mp4",
                 "duration": duration
-            })
-        
-        # 按相似度排序
-        results.sort(key=lambda x: x["similarity"], reverse=True)
+            }
+            for i in np.argsort(-similarities)
+        ]
         
         return {
             "success": True,
@@ -266,7 +277,7 @@ class MusicRetrievalDemo:
         print(f"   📂 路径: {selected_music['video_path']}")
         
         # 检查文件是否存在
-        if os.path.exists(selected_music["video_path"]):
+        if _path_exists(selected_music["video_path"]):
             print(f"   ✅ 文件存在，可以播放")
             
             # 询问是否播放
@@ -316,7 +327,7 @@ class MusicRetrievalDemo:
         print(f"   📂 路径: {selected_music['video_path']}")
         
         # 检查文件是否存在
-        if os.path.exists(selected_music["video_path"]):
+        if _path_exists(selected_music["video_path"]):
             print(f"   ✅ 文件存在，可以播放")
             
             # 询问是否播放
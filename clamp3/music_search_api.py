@@ -7,15 +7,21 @@ import os
 import sys
 import json
 import argparse
+import functools
 from typing import Dict, List, Any
 from music_search_system import MusicSearchSystem
 
 class MusicSearchAPI:
     """音乐检索API类"""
     
-    def __init__(self):
-        """初始化API"""
-        self.search_system = MusicSearchSystem()
+    def __init__(self, use_int8: bool = False):
+        """
+        初始化API
+        
+        Args:
+            use_int8: 是否使用int8量化特征检索
+        """
+        self.search_system = MusicSearchSystem(use_int8=use_int8)
         print("✅ 音乐检索API初始化完成")
     
     def search_by_audio_file(self, audio_path: str, duration: str = "3min", 
@@ -157,6 +163,15 @@ class MusicSearchAPI:
         
         return results
 
+@functools.lru_cache(maxsize=1)
+def get_music_search_api() -> MusicSearchAPI:
+    """
+    进程内共享的MusicSearchAPI实例，避免演示和UI重复加载特征库和CLAMP3模型
+    
+    需要独立实例时可先调用 get_music_search_api.cache_clear()
+    """
+    return MusicSearchAPI()
+
 def main():
     """命令行接口"""
     parser = argparse.ArgumentParser(description="音乐检索API命令行工具")
@@ -169,11 +184,12 @@ def main():
     parser.add_argument("--full-audio", action="store_true", help="使用完整音频（默认使用前25%）")
     parser.add_argument("--stats", action="store_true", help="显示特征库统计信息")
     parser.add_argument("--output", "-o", type=str, help="输出结果到JSON文件")
+    parser.add_argument("--int8", action="store_true", help="使用int8量化特征检索（默认FP32）")
     
     args = parser.parse_args()
     
     # 初始化API
-    api = MusicSearchAPI()
+    api = MusicSearchAPI(use_int8=args.int8)
     
     # 显示统计信息
     if args.stats:
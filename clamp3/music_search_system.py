@@ -9,22 +9,40 @@ import sys
 import numpy as np
 import json
 import time
-import glob
 import subprocess
 import shutil
 from typing import List, Tuple, Dict, Optional
 from pathlib import Path
 import tempfile
 
+from feature_matrix import build_feature_matrix, load_feature_matrix
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    对称逐向量int8量化：scale = max(|v|) / 127，q = round(v / scale)
+    
+    Args:
+        vectors: (D,) 或 (N, D) 特征
+        
+    Returns:
+        (int8量化值, float32缩放系数)，v ≈ q * scale；全零向量的scale为1
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales).astype(np.int8)
+    return quantized, scales[..., 0]
+
 class MusicSearchSystem:
     """音乐检索系统核心类"""
     
-    def __init__(self, features_base_dir: str = None):
+    def __init__(self, features_base_dir: str = None, use_int8: bool = False):
         """
         初始化音乐检索系统
         
         Args:
             features_base_dir: 特征文件基础目录
+            use_int8: 是否以int8量化特征检索 (特征库内存为FP32的1/4，相似度有微小误差)
         """
         if features_base_dir is None:
             features_base_dir = "/Users/wanxinchen/Study/AI/Project/Final project/SuperClaude/qm_final4/materials/music_features"
@@ -32,12 +50,21 @@ class MusicSearchSystem:
         self.features_base_dir = features_base_dir
         self.supported_durations = ["1min", "3min", "5min", "10min", "20min", "30min"]
         self.feature_cache = {}
+        self.use_int8 = use_int8
+        
+        # 检索索引：每个时长一份 (视频名称列表, L2归一化特征矩阵, 零向量掩码, (int8矩阵, 缩放系数)或None)
+        self.search_index = {}
         
         # 加载所有特征文件
         self._load_features()
     
     def _load_features(self):
-        """加载所有可用的特征文件"""
+        """
+        加载所有可用的特征文件
+        
+        优先以内存映射方式打开合并特征矩阵 (见 build_feature_matrix)，
+        矩阵不存在或特征目录已变化时才逐个读取特征文件并重建
+        """
         print("🔄 加载音乐特征库...")
         
         for duration in self.supported_durations:
@@ -47,34 +74,19 @@ class MusicSearchSystem:
                 print(f"⚠️  {duration} 特征目录不存在: {features_dir}")
                 continue
             
-            # 加载该时长的所有特征
-            feature_files = glob.glob(os.path.join(features_dir, "*.npy"))
-            
-            if not feature_files:
-                print(f"⚠️  {duration} 目录中没有特征文件")
+            loaded = load_feature_matrix(self.features_base_dir, duration)
+            if loaded is None:
+                loaded = build_feature_matrix(self.features_base_dir, duration)
+            if loaded is None:
                 continue
             
-            duration_features = {}
-            for feature_file in feature_files:
-                try:
-                    # 从文件名提取视频名称
-                    video_name = os.path.splitext(os.path.basename(feature_file))[0]
-                    
-                    # 加载特征向量
-                    feature_vector = np.load(feature_file)
-                    
-                    # 确保特征向量是正确的维度 (1, 768)
-                    if feature_vector.shape != (1, 768):
-                        print(f"⚠️  {video_name} 特征维度异常: {feature_vector.shape}")
-                        continue
-                    
-                    duration_features[video_name] = feature_vector.flatten()  # 转为1D数组
-                    
-                except Exception as e:
-                    print(f"❌ 加载特征文件失败 {feature_file}: {e}")
-                    continue
+            video_names, matrix = loaded
+            # 每个视频的特征是矩阵行视图 (已归一化，余弦相似度不受影响)，不额外复制
+            duration_features = dict(zip(video_names, matrix))
             
             self.feature_cache[duration] = duration_features
+            quantized = quantize_int8(matrix) if self.use_int8 else None
+            self.search_index[duration] = (video_names, matrix, ~np.any(matrix, axis=1), quantized)
             print(f"✅ {duration}: 加载了 {len(duration_features)} 个特征文件")
         
         total_features = sum(len(features) for features in self.feature_cache.values())
@@ -221,18 +233,42 @@ class MusicSearchSystem:
         
         print(f"🔍 在 {duration} 版本中搜索相似音乐...")
         
-        # 计算与所有音乐的相似度
-        similarities = []
+        # 一次矩阵乘计算与所有音乐的相似度，返回前top_k个结果
+        return self._rank_by_similarity(target_features, duration, top_k)
+    
+    def _rank_by_similarity(self, query_features: np.ndarray, duration: str, top_k: int) -> List[Tuple[str, float]]:
+        """
+        在指定时长的特征库中检索与查询向量最相似的前top_k个音乐
+        
+        相似度与 calculate_similarity 一致：余弦相似度映射到[0,1]，零向量相似度为0
+        """
+        video_names, matrix, zero_rows, quantized = self.search_index[duration]
+        top_k = min(top_k, len(video_names))
+        
+        query = np.asarray(query_features, dtype=np.float32).reshape(-1)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return [(name, 0.0) for name in video_names[:top_k]]
+        query = query / query_norm
         
-        for video_name, reference_features in duration_features.items():
-            similarity = self.calculate_similarity(target_features, reference_features)
-            similarities.append((video_name, similarity))
+        if quantized is not None:
+            # int8点积累加到int32，再乘以两侧缩放系数还原余弦相似度
+            q_db, scales_db = quantized
+            q_query, scale_query = quantize_int8(query)
+            cosines = (q_db.astype(np.int32) @ q_query.astype(np.int32)).astype(np.float32) * (scale_query * scales_db)
+        else:
+            cosines = matrix @ query
         
-        # 按相似度降序排序
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        scores = (cosines + 1) / 2
+        scores[zero_rows] = 0.0
         
-        # 返回前top_k个结果
-        return similarities[:top_k]
+        # 先部分排序取前top_k (O(N))，再只对这top_k个按相似度降序排列 (同分保持特征库顺序)
+        if top_k < len(scores):
+            top_indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top_indices = np.arange(len(scores))
+        top_indices = top_indices[np.lexsort((top_indices, -scores[top_indices]))]
+        return [(video_names[i], float(scores[i])) for i in top_indices]
     
     def search_music_by_file(self, audio_path: str, duration: str, top_k: int = 3, use_partial: bool = True) -> List[Tuple[str, float]]:
         """
@@ -3,6 +3,9 @@ import sys
 import shutil
 import subprocess
 
+# Scratch directory for intermediate files; set CLAMP3_TEMP_DIR to give concurrent runs their own
+TEMP_DIR = os.environ.get('CLAMP3_TEMP_DIR', 'temp')
+
 def get_modality_from_dir(directory):
     '''Recursively determine modality based on file extensions found in the directory.'''
     if not os.path.exists(directory) or not os.path.isdir(directory):
@@ -183,24 +186,26 @@ def extract_audio_features(audio_dir, feat_dir=None, global_flag=True):
     if feat_dir is not None:
         feat_dir = os.path.abspath(feat_dir)
     
+    mert_dir = os.path.abspath(os.path.join(TEMP_DIR, 'mert'))
+
     # Step 1: Delete temp folder
-    remove_folder('temp/mert')
+    remove_folder(mert_dir)
 
     # Step 2: Change directory to the preprocessing/audio folder
     change_directory('preprocessing/audio')
 
     # Step 3: Extract MERT features from audio files
-    run_command(f'python extract_mert.py --input_path "{audio_dir}" --output_path ../../temp/mert --model_path m-a-p/MERT-v1-95M --mean_features')
+    run_command(f'python extract_mert.py --input_path "{audio_dir}" --output_path "{mert_dir}" --model_path m-a-p/MERT-v1-95M --mean_features')
 
     # Step 4: Change directory back to the code folder
     change_directory('../../code')
 
     # Step 5: Run extract_clamp3.py
     if feat_dir is None:
-        run_command(f'python extract_clamp3.py ../temp/mert ../cache/audio_features{global_flag}')
+        run_command(f'python extract_clamp3.py "{mert_dir}" ../cache/audio_features{global_flag}')
     else:
         feat_dir = os.path.abspath(feat_dir)
-        run_command(f'python extract_clamp3.py ../temp/mert "{feat_dir}"{global_flag}')
+        run_command(f'python extract_clamp3.py "{mert_dir}" "{feat_dir}"{global_flag}')
 
     # Step 6: Change directory back to the main folder
     change_directory('..')
@@ -16,6 +16,7 @@ from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import logging
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
@@ -108,18 +109,7 @@ class CLAMP3FeatureExtractor:
                 return self._extract_fallback_features(audio_path, video_path, extract_ratio, feature_id)
             
             # 3. 构建特征字典
-            features = {
-                'clamp3_features': clamp3_features,
-                'feature_vector': clamp3_features,  # 主要特征向量
-                'video_path': str(video_path),
-                'video_name': video_path.name,
-                'extract_ratio': extract_ratio,
-                'feature_id': feature_id,
-                'extracted_at': datetime.now().isoformat(),
-                'file_size': video_path.stat().st_size,
-                'extractor_version': '4.0.0-clamp3',
-                'model_type': 'clamp3-saas'
-            }
+            features = self._build_clamp3_features(video_path, extract_ratio, feature_id, clamp3_features)
             
             # 4. 保存到缓存
             self.features_cache[feature_id] = features
@@ -147,10 +137,29 @@ class CLAMP3FeatureExtractor:
             # 清理临时文件
             self._cleanup_temp_files()
     
+    def _build_clamp3_features(self, video_path: Path, extract_ratio: float,
+                               feature_id: str, clamp3_features: np.ndarray) -> Dict[str, Any]:
+        """构建CLAMP3特征字典"""
+        return {
+            'clamp3_features': clamp3_features,
+            'feature_vector': clamp3_features,  # 主要特征向量
+            'video_path': str(video_path),
+            'video_name': video_path.name,
+            'extract_ratio': extract_ratio,
+            'feature_id': feature_id,
+            'extracted_at': datetime.now().isoformat(),
+            'file_size': video_path.stat().st_size,
+            'extractor_version': '4.0.0-clamp3',
+            'model_type': 'clamp3-saas'
+        }
+    
     def _extract_fallback_features(self, audio_path: str, video_path: Path, 
-                                 extract_ratio: float, feature_id: str) -> Optional[Dict[str, Any]]:
+                                 extract_ratio: float, feature_id: str,
+                                 save_cache: bool = True) -> Optional[Dict[str, Any]]:
         """
         降级特征提取方法 - 使用librosa提取传统音频特征
+        
+        save_cache 为False时只更新内存缓存，由调用方 (批量提取) 统一写缓存文件
         """
         try:
             import librosa
@@ -222,7 +231,8 @@ class CLAMP3FeatureExtractor:
             
             # 保存到缓存
             self.features_cache[feature_id] = result
-            self._save_features_cache()
+            if save_cache:
+                self._save_features_cache()
             
             logger.info(f"✅ 降级特征提取完成: {video_path.name}")
             logger.info(f"   特征维度: {feature_vector.shape}")
@@ -239,13 +249,17 @@ class CLAMP3FeatureExtractor:
         content = f"clamp3_{video_path.name}_{stat.st_size}_{stat.st_mtime}_{extract_ratio}"
         return hashlib.md5(content.encode()).hexdigest()
     
-    def _extract_audio_segment(self, video_path: Path, extract_ratio: float) -> Optional[str]:
+    def _extract_audio_segment(self, video_path: Path, extract_ratio: float,
+                               output_dir: Optional[Path] = None,
+                               output_stem: Optional[str] = None) -> Optional[str]:
         """
         从视频中提取音频片段
         
         Args:
             video_path: 视频文件路径
             extract_ratio: 提取比例
+            output_dir: 音频输出目录，默认为临时目录
+            output_stem: 音频文件名 (不含扩展名)，默认为 "<视频名>_segment"
             
         Returns:
             str: 临时音频文件路径
@@ -259,11 +273,12 @@ class CLAMP3FeatureExtractor:
             # 计算提取时长
             extract_duration = duration * extract_ratio
             
-            # 创建临时目录
-            self.temp_dir.mkdir(exist_ok=True)
+            # 创建输出目录
+            output_dir = output_dir or self.temp_dir
+            output_dir.mkdir(parents=True, exist_ok=True)
             
             # 生成临时音频文件路径
-            temp_audio_path = self.temp_dir / f"{video_path.stem}_segment.wav"
+            temp_audio_path = output_dir / f"{output_stem or video_path.stem + '_segment'}.wav"
             
             # 使用ffmpeg提取音频
             cmd = [
@@ -304,16 +319,30 @@ class CLAMP3FeatureExtractor:
         Returns:
             np.ndarray: CLAMP3特征向量
         """
-        try:
-            # 创建临时输入目录（CLAMP3需要目录作为输入）
-            temp_input_dir = self.temp_dir / "input"
-            temp_input_dir.mkdir(exist_ok=True)
-            
-            # 复制音频文件到临时输入目录
-            audio_path = Path(audio_path)
-            temp_audio_in_dir = temp_input_dir / audio_path.name
-            shutil.copy(audio_path, temp_audio_in_dir)
+        # 创建临时输入目录（CLAMP3需要目录作为输入）
+        temp_input_dir = self.temp_dir / "input"
+        temp_input_dir.mkdir(parents=True, exist_ok=True)
+        
+        # 复制音频文件到临时输入目录
+        audio_path = Path(audio_path)
+        shutil.copy(audio_path, temp_input_dir / audio_path.name)
+        
+        features = self._run_clamp3_on_dir(temp_input_dir)
+        if not features:
+            return None
+        return features.get(audio_path.stem, next(iter(features.values())))
+    
+    def _run_clamp3_on_dir(self, temp_input_dir: Path) -> Optional[Dict[str, np.ndarray]]:
+        """
+        对目录中的全部音频运行一次CLAMP3 (模型只加载一次)
+        
+        Args:
+            temp_input_dir: 音频输入目录
             
+        Returns:
+            Dict: 音频文件名 (不含扩展名) 到CLAMP3特征向量的映射
+        """
+        try:
             # 创建唯一的特征输出目录（CLAMP3会创建）
             import time
             timestamp = str(int(time.time() * 1000))
@@ -358,7 +387,7 @@ class CLAMP3FeatureExtractor:
                     
                     return None
                 
-                # 查找输出的特征文件
+                # 查找输出的特征文件 (与输入音频同名)
                 feature_files = list(temp_output_dir.glob("*.npy"))
                 
                 if not feature_files:
@@ -366,10 +395,9 @@ class CLAMP3FeatureExtractor:
                     return None
                 
                 # 加载特征文件
-                feature_file = feature_files[0]
-                features = np.load(feature_file)
+                features = {feature_file.stem: np.load(feature_file) for feature_file in feature_files}
                 
-                logger.info(f"✅ CLAMP3特征加载成功: {features.shape}")
+                logger.info(f"✅ CLAMP3特征加载成功: {len(features)} 个")
                 
                 return features
                 
@@ -416,13 +444,18 @@ class CLAMP3FeatureExtractor:
             logger.warning(f"清理临时文件失败: {e}")
     
     def extract_batch_features(self, video_list: List[Dict[str, Any]], 
-                             extract_ratio: float = 0.25) -> Dict[str, Dict[str, Any]]:
+                             extract_ratio: float = 0.25,
+                             max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
         """
         批量提取CLAMP3特征
         
+        未缓存视频的音频先由多个ffmpeg进程并行提取到同一目录，
+        再只运行一次CLAMP3 (模型加载一次，整批推理)；失败的视频逐个降级到传统音频特征
+        
         Args:
             video_list: 视频信息列表
             extract_ratio: 提取比例
+            max_workers: 并行提取音频的ffmpeg进程数，默认为CPU核数
             
         Returns:
             Dict: 视频路径到特征的映射
@@ -431,16 +464,60 @@ class CLAMP3FeatureExtractor:
         
         logger.info(f"开始批量CLAMP3特征提取，共 {len(video_list)} 个视频")
         
-        for i, video_info in enumerate(video_list, 1):
+        # 1. 收集有效且未缓存的视频
+        valid_items = []
+        pending = {}
+        for video_info in video_list:
             video_path = video_info.get('segment_path') or video_info.get('file_path')
             
             if not video_path:
                 logger.warning(f"视频信息缺少路径: {video_info}")
                 continue
+            if not Path(video_path).exists():
+                logger.error(f"视频文件不存在: {video_path}")
+                continue
             
-            logger.info(f"处理 {i}/{len(video_list)}: {Path(video_path).name}")
-            
-            features = self.extract_video_features(video_path, extract_ratio)
+            feature_id = self._generate_feature_id(Path(video_path), extract_ratio)
+            valid_items.append((video_path, video_info, feature_id))
+            if feature_id not in self.features_cache:
+                pending[feature_id] = Path(video_path)
+        
+        logger.info(f"   缓存命中 {len(valid_items) - len(pending)} 个，待提取 {len(pending)} 个")
+        
+        if pending:
+            try:
+                # 2. 并行提取音频 (以feature_id命名，避免不同目录下同名视频冲突)
+                batch_input_dir = self.temp_dir / "batch_input"
+                with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+                    audio_paths = dict(zip(pending, pool.map(
+                        lambda item: self._extract_audio_segment(item[1], extract_ratio, batch_input_dir, item[0]),
+                        pending.items()
+                    )))
+                
+                # 3. 一次CLAMP3调用处理整批音频
+                clamp3_batch = {}
+                if any(audio_paths.values()):
+                    clamp3_batch = self._run_clamp3_on_dir(batch_input_dir) or {}
+                
+                for feature_id, video_path in pending.items():
+                    audio_path = audio_paths[feature_id]
+                    if feature_id in clamp3_batch:
+                        self.features_cache[feature_id] = self._build_clamp3_features(
+                            video_path, extract_ratio, feature_id, clamp3_batch[feature_id]
+                        )
+                    elif audio_path:
+                        logger.warning(f"CLAMP3特征提取失败，降级到传统音频特征: {video_path.name}")
+                        self._extract_fallback_features(audio_path, video_path, extract_ratio, feature_id,
+                                                        save_cache=False)
+                
+                # 整批结束后统一写一次缓存文件 (包括降级提取的特征)
+                self._save_features_cache()
+            finally:
+                self._cleanup_temp_files()
+        
+        # 4. 按输入顺序汇总结果
+        for video_path, video_info, feature_id in valid_items:
+            features = self.features_cache.get(feature_id)
             
             if features:
                 features_db[video_path] = features
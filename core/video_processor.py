@@ -6,6 +6,9 @@
 
 import os
 import json
+import bisect
+import asyncio
+import threading
 import subprocess
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
@@ -22,6 +25,9 @@ class VideoProcessor:
     负责切分、索引和管理疗愈视频素材库
     """
     
+    # 流复制时输入端seek会回退到前一个关键帧；偏差超过该值的片段改为重新编码
+    KEYFRAME_TOLERANCE_SEC = 2.0
+    
     def __init__(self, 
                  materials_dir: str = "materials",
                  durations: List[int] = [1, 3, 5, 10, 20, 30]):
@@ -45,6 +51,12 @@ class VideoProcessor:
         self.video_index = []
         self.segment_index = {}
         
+        # 关键帧时间缓存 {视频路径: 升序时间列表，探测失败为None}
+        self._keyframe_cache = {}
+        # 每个视频一把探测锁：并发切分同一视频的多个片段时只运行一次ffprobe，其余等待结果
+        self._keyframe_locks = {}
+        self._keyframe_locks_guard = threading.Lock()
+        
     def _ensure_directories(self):
         """确保所有必要的目录都存在"""
         self.materials_dir.mkdir(exist_ok=True)
@@ -156,13 +168,16 @@ class VideoProcessor:
     
     def segment_videos(self, 
                       force_resegment: bool = False,
-                      extract_intro_only: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+                      extract_intro_only: bool = True,
+                      skip_existing: bool = False) -> Dict[str, List[Dict[str, Any]]]:
         """
         切分视频为不同时长的片段
         
         Args:
             force_resegment: 是否强制重新切分
             extract_intro_only: 是否只提取前25%用于特征提取
+            skip_existing: 预先扫描一次时长目录，已存在的片段直接用扫描得到的stat生成信息，
+                           不再逐个检查文件 (force_resegment 时无效)
             
         Returns:
             Dict: 按时长分组的片段信息
@@ -173,41 +188,24 @@ class VideoProcessor:
         all_segments = {}
         
         for duration_min in self.durations:
-            duration_sec = duration_min * 60
-            segments_for_duration = []
-            
             logger.info(f"开始切分 {duration_min} 分钟片段...")
             
-            for video_info in self.video_index:
-                video_path = Path(video_info['file_path'])
-                video_duration = video_info['duration']
-                
-                # 计算可以切分多少个片段
-                num_segments = int(video_duration // duration_sec)
+            existing = self._scan_existing_segments(duration_min) if skip_existing and not force_resegment else {}
+            
+            segments_for_duration = []
+            for spec in self._segment_specs(duration_min, extract_intro_only):
+                video_path, start_time, duration, _, segment_index = spec
+                output_path = self._segment_output_path(video_path, duration_min, segment_index)
+                existing_stat = existing.get(output_path.name)
                 
-                if num_segments == 0:
-                    logger.warning(f"视频 {video_path.name} 时长不足 {duration_min} 分钟，跳过")
-                    continue
+                if existing_stat is not None:
+                    segment_info = self._get_existing_segment_info(output_path, video_path, start_time, duration,
+                                                                   segment_index, existing_stat)
+                else:
+                    segment_info = self._create_segment(*spec, force_resegment)
                 
-                # 为每个片段生成输出路径和信息
-                for i in range(num_segments):
-                    start_time = i * duration_sec
-                    
-                    # 如果只提取intro，只处理第一个片段
-                    if extract_intro_only and i > 0:
-                        break
-                    
-                    segment_info = self._create_segment(
-                        video_path, 
-                        start_time, 
-                        duration_sec, 
-                        duration_min, 
-                        i,
-                        force_resegment
-                    )
-                    
-                    if segment_info:
-                        segments_for_duration.append(segment_info)
+                if segment_info:
+                    segments_for_duration.append(segment_info)
             
             all_segments[f"{duration_min}min"] = segments_for_duration
             logger.info(f"完成 {duration_min} 分钟片段切分，共 {len(segments_for_duration)} 个")
@@ -218,6 +216,246 @@ class VideoProcessor:
         
         return all_segments
     
+    async def segment_videos_async(self, 
+                                   force_resegment: bool = False,
+                                   extract_intro_only: bool = True,
+                                   max_concurrency: Optional[int] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        并发切分视频 (asyncio子进程)，结果与 segment_videos 相同
+        
+        每个ffmpeg进程只占用一个核，同时运行多个切分可重叠磁盘I/O和启动开销
+        
+        Args:
+            force_resegment: 是否强制重新切分
+            extract_intro_only: 是否只提取前25%用于特征提取
+            max_concurrency: 同时运行的ffmpeg进程数，默认为CPU核数
+            
+        Returns:
+            Dict: 按时长分组的片段信息
+        """
+        if not self.video_index:
+            self.scan_source_videos()
+        
+        semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+        
+        async def _bounded(spec):
+            async with semaphore:
+                return await self._cut_one(*spec, force_resegment)
+        
+        specs = {
+            duration_min: list(self._segment_specs(duration_min, extract_intro_only))
+            for duration_min in self.durations
+        }
+        total = sum(len(duration_specs) for duration_specs in specs.values())
+        logger.info(f"开始并发切分 {total} 个片段...")
+        
+        results = await asyncio.gather(
+            *[_bounded(spec) for duration_specs in specs.values() for spec in duration_specs],
+            return_exceptions=True
+        )
+        
+        # 按原有顺序分组，丢弃失败的片段
+        all_segments = {}
+        position = 0
+        for duration_min, duration_specs in specs.items():
+            duration_results = results[position:position + len(duration_specs)]
+            position += len(duration_specs)
+            
+            for spec, result in zip(duration_specs, duration_results):
+                if isinstance(result, Exception):
+                    logger.error(f"创建片段失败: {spec[0].name} #{spec[4]}, 错误: {result}")
+            
+            all_segments[f"{duration_min}min"] = [
+                result for result in duration_results if result and not isinstance(result, Exception)
+            ]
+            logger.info(f"完成 {duration_min} 分钟片段切分，共 {len(all_segments[f'{duration_min}min'])} 个")
+        
+        # 保存片段索引
+        self.segment_index = all_segments
+        self._save_segment_index()
+        
+        return all_segments
+    
+    def _segment_specs(self, duration_min: int, extract_intro_only: bool):
+        """
+        生成某个时长下所有待切分片段的参数
+        
+        Yields:
+            (视频路径, 开始时间, 片段时长秒, 片段时长分钟, 片段索引)
+        """
+        duration_sec = duration_min * 60
+        
+        for video_info in self.video_index:
+            video_path = Path(video_info['file_path'])
+            video_duration = video_info['duration']
+            
+            # 计算可以切分多少个片段
+            num_segments = int(video_duration // duration_sec)
+            
+            if num_segments == 0:
+                logger.warning(f"视频 {video_path.name} 时长不足 {duration_min} 分钟，跳过")
+                continue
+            
+            # 如果只提取intro，只处理第一个片段
+            if extract_intro_only:
+                num_segments = 1
+            
+            for i in range(num_segments):
+                yield video_path, i * duration_sec, duration_sec, duration_min, i
+    
+    def _scan_existing_segments(self, duration_min: int) -> Dict[str, os.stat_result]:
+        """一次scandir列出某个时长目录下已有的片段 {文件名: stat}"""
+        duration_dir = self.segments_dir / f"{duration_min}min"
+        if not duration_dir.is_dir():
+            return {}
+        with os.scandir(duration_dir) as entries:
+            return {entry.name: entry.stat() for entry in entries if entry.name.endswith('.mp4')}
+    
+    def _segment_output_path(self, video_path: Path, duration_min: int, segment_index: int) -> Path:
+        """生成片段输出路径"""
+        output_name = f"{video_path.stem}_seg{segment_index:03d}_{duration_min}min.mp4"
+        return self.segments_dir / f"{duration_min}min" / output_name
+    
+    def _segment_command(self, video_path: Path, start_time: float, duration: float, output_path: Path) -> List[str]:
+        """
+        生成切分片段的ffmpeg命令
+        
+        -ss 放在 -i 之前，由容器索引直接定位到关键帧，无需从头解码；
+        检索只需要近似时长的片段，默认直接复制流，
+        仅当开始时间离前一个关键帧过远时才用 libx264 ultrafast 重新编码
+        """
+        if self._near_keyframe(video_path, start_time):
+            codec_args = ['-c', 'copy']  # 直接复制流，避免重新编码
+        else:
+            codec_args = ['-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac']
+        
+        return [
+            'ffmpeg', '-y',  # 覆盖输出文件
+            '-ss', str(start_time),  # 开始时间 (输入端seek)
+            '-i', str(video_path),
+            '-t', str(duration),     # 持续时间
+            *codec_args,
+            '-avoid_negative_ts', 'make_zero',
+            '-movflags', '+faststart',  # moov放在文件头，浏览器可按Range边下边播
+            str(output_path)
+        ]
+    
+    def _near_keyframe(self, video_path: Path, start_time: float) -> bool:
+        """开始时间与其前一个关键帧的距离是否在容差内 (无法探测关键帧时按流复制处理)"""
+        if start_time <= 0:
+            return True
+        
+        keyframes = self._get_keyframe_times(video_path)
+        if not keyframes:
+            return True
+        
+        position = bisect.bisect_right(keyframes, start_time)
+        return position > 0 and start_time - keyframes[position - 1] <= self.KEYFRAME_TOLERANCE_SEC
+    
+    def _get_keyframe_times(self, video_path: Path) -> Optional[List[float]]:
+        """获取视频关键帧时间，每个视频只探测一次 (线程安全，并发请求同一视频时等待正在进行的探测)"""
+        key = str(video_path)
+        if key in self._keyframe_cache:
+            return self._keyframe_cache[key]
+        
+        with self._keyframe_locks_guard:
+            probe_lock = self._keyframe_locks.setdefault(key, threading.Lock())
+        
+        with probe_lock:
+            if key not in self._keyframe_cache:
+                self._keyframe_cache[key] = self._probe_keyframe_times(video_path)
+        
+        return self._keyframe_cache[key]
+    
+    def _probe_keyframe_times(self, video_path: Path) -> Optional[List[float]]:
+        """使用ffprobe (-skip_frame nokey) 探测视频关键帧时间，失败返回None"""
+        try:
+            cmd = [
+                'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
+                '-skip_frame', 'nokey', '-show_entries', 'frame=pts_time',
+                '-of', 'csv=p=0', str(video_path)
+            ]
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            
+            if result.returncode == 0:
+                return sorted(
+                    float(line.strip().rstrip(',')) for line in result.stdout.splitlines()
+                    if line.strip().rstrip(',') not in ('', 'N/A')
+                )
+            logger.warning(f"关键帧探测失败，按流复制切分: {video_path.name}")
+        except (subprocess.TimeoutExpired, ValueError) as e:
+            logger.warning(f"关键帧探测失败，按流复制切分: {video_path.name}, 错误: {e}")
+        
+        return None
+    
+    def _new_segment_info(self, 
+                          output_path: Path, 
+                          video_path: Path, 
+                          start_time: float, 
+                          duration: float, 
+                          duration_min: int, 
+                          segment_index: int) -> Optional[Dict[str, Any]]:
+        """验证新切分的片段并生成片段信息"""
+        if not output_path.exists() or output_path.stat().st_size == 0:
+            logger.error(f"输出文件无效: {output_path}")
+            return None
+        
+        logger.info(f"✅ 成功创建片段: {output_path.name}")
+        
+        return {
+            'segment_path': str(output_path),
+            'segment_name': output_path.name,
+            'source_video': str(video_path),
+            'start_time': start_time,
+            'duration': duration,
+            'duration_min': duration_min,
+            'segment_index': segment_index,
+            'file_size': output_path.stat().st_size,
+            'created_at': datetime.now().isoformat(),
+            'is_intro_segment': segment_index == 0,  # 标记是否为intro片段
+            'intro_ratio': 0.25 if segment_index == 0 else 0  # ISO原则匹配阶段
+        }
+    
+    async def _cut_one(self, 
+                       video_path: Path, 
+                       start_time: float, 
+                       duration: float, 
+                       duration_min: int, 
+                       segment_index: int,
+                       force_resegment: bool) -> Optional[Dict[str, Any]]:
+        """创建单个视频片段 (asyncio子进程版本，参数同 _create_segment)"""
+        output_path = self._segment_output_path(video_path, duration_min, segment_index)
+        
+        # 检查文件是否已存在
+        if output_path.exists() and not force_resegment:
+            logger.info(f"片段已存在，跳过: {output_path.name}")
+            return self._get_existing_segment_info(output_path, video_path, start_time, duration, segment_index)
+        
+        logger.info(f"切分视频片段: {output_path.name}")
+        # 首次生成命令时需同步探测关键帧，放到线程池避免阻塞事件循环 (同一视频的探测只运行一次，见 _get_keyframe_times)
+        cmd = await asyncio.get_running_loop().run_in_executor(
+            None, self._segment_command, video_path, start_time, duration, output_path
+        )
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=300)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.error(f"ffmpeg切分超时: {output_path.name}")
+            return None
+        
+        if process.returncode != 0:
+            logger.error(f"ffmpeg切分失败: {stderr.decode(errors='replace')}")
+            return None
+        
+        return self._new_segment_info(output_path, video_path, start_time, duration, duration_min, segment_index)
+    
     def _create_segment(self, 
                        video_path: Path, 
                        start_time: float, 
@@ -240,9 +478,8 @@ class VideoProcessor:
             Dict: 片段信息
         """
         # 生成输出文件名
-        base_name = video_path.stem
-        output_name = f"{base_name}_seg{segment_index:03d}_{duration_min}min.mp4"
-        output_path = self.segments_dir / f"{duration_min}min" / output_name
+        output_path = self._segment_output_path(video_path, duration_min, segment_index)
+        output_name = output_path.name
         
         # 检查文件是否已存在
         if output_path.exists() and not force_resegment:
@@ -251,15 +488,7 @@ class VideoProcessor:
         
         try:
             # 使用ffmpeg切分视频
-            cmd = [
-                'ffmpeg', '-y',  # 覆盖输出文件
-                '-i', str(video_path),
-                '-ss', str(start_time),  # 开始时间
-                '-t', str(duration),     # 持续时间
-                '-c', 'copy',            # 直接复制流，避免重新编码
-                '-avoid_negative_ts', 'make_zero',
-                str(output_path)
-            ]
+            cmd = self._segment_command(video_path, start_time, duration, output_path)
             
             logger.info(f"切分视频片段: {output_name}")
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
@@ -269,25 +498,7 @@ class VideoProcessor:
                 return None
             
             # 验证输出文件
-            if not output_path.exists() or output_path.stat().st_size == 0:
-                logger.error(f"输出文件无效: {output_path}")
-                return None
-            
-            logger.info(f"✅ 成功创建片段: {output_name}")
-            
-            return {
-                'segment_path': str(output_path),
-                'segment_name': output_name,
-                'source_video': str(video_path),
-                'start_time': start_time,
-                'duration': duration,
-                'duration_min': duration_min,
-                'segment_index': segment_index,
-                'file_size': output_path.stat().st_size,
-                'created_at': datetime.now().isoformat(),
-                'is_intro_segment': segment_index == 0,  # 标记是否为intro片段
-                'intro_ratio': 0.25 if segment_index == 0 else 0  # ISO原则匹配阶段
-            }
+            return self._new_segment_info(output_path, video_path, start_time, duration, duration_min, segment_index)
             
         except subprocess.TimeoutExpired:
             logger.error(f"ffmpeg切分超时: {output_name}")
@@ -301,9 +512,11 @@ class VideoProcessor:
                                   video_path: Path, 
                                   start_time: float, 
                                   duration: float, 
-                                  segment_index: int) -> Dict[str, Any]:
-        """获取已存在片段的信息"""
+                                  segment_index: int,
+                                  stat: Optional[os.stat_result] = None) -> Dict[str, Any]:
+        """获取已存在片段的信息 (可传入已有的stat结果，避免重复stat)"""
         duration_min = int(duration // 60)
+        stat = stat or output_path.stat()
         
         return {
             'segment_path': str(output_path),
@@ -313,8 +526,8 @@ class VideoProcessor:
             'duration': duration,
             'duration_min': duration_min,
             'segment_index': segment_index,
-            'file_size': output_path.stat().st_size,
-            'created_at': datetime.fromtimestamp(output_path.stat().st_mtime).isoformat(),
+            'file_size': stat.st_size,
+            'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(),
             'is_intro_segment': segment_index == 0,
             'intro_ratio': 0.25 if segment_index == 0 else 0
         }
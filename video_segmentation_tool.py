@@ -108,6 +108,7 @@ class VideoSegmentationTool:
                 '-t', str(duration),
                 '-c', 'copy',  # 使用流复制，避免重编码
                 '-avoid_negative_ts', 'make_zero',
+                '-movflags', '+faststart',  # moov放在文件头，浏览器可按Range边下边播
                 str(output_video),
                 '-y'  # 覆盖输出文件
             ]